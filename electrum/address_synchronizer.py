@@ -34,8 +34,8 @@ from .util import profiler, bfh, TxMinedInfo, UnrelatedTransactionException, wit
 from .transaction import Transaction, TxOutput, TxInput, PartialTxInput, TxOutpoint
 from .synchronizer import Synchronizer
 from .verifier import SPV
-from .asset import get_asset_info_from_script, StrictAssetMetadata, get_error_for_asset_typed, AssetType
-from .blockchain import hash_header, Blockchain
+from .asset import StrictAssetMetadata, get_error_for_asset_typed, AssetType
+from .blockchain import Blockchain, MissingHeader
 from .i18n import _
 from .logging import Logger
 from .util import EventListener, event_listener
@@ -70,6 +70,24 @@ class HistoryItem(NamedTuple):
     balance: int
 
 
+class AddrBalance:
+    """The unspent coins of an address, bucketed for get_balance.
+
+    Values are asset-aware, keyed by asset (None for RVN). Only depends on
+    the history of the address and on which of its txs are mined, so it
+    survives new blocks; coinbase maturity and the unconfirmed coins are
+    evaluated at query time.
+    """
+    __slots__ = ('confirmed', 'confirmed_coins', 'coinbase', 'unconfirmed')
+
+    def __init__(self):
+        self.confirmed = defaultdict(int)  # type: Dict[Optional[str], int]
+        self.confirmed_coins = {}  # type: Dict[str, Tuple[Optional[str], int]]
+        # (prevout, txid, height, asset, value)
+        self.coinbase = []  # type: List[Tuple[str, str, int, Optional[str], int]]
+        self.unconfirmed = []  # type: List[Tuple[str, str, int, Optional[str], int]]
+
+
 class AddressSynchronizer(Logger, EventListener):
     """ address database """
 
@@ -122,6 +140,7 @@ class AddressSynchronizer(Logger, EventListener):
         self._get_balance_cache = {}
         self._get_asset_balance_cache = {}
         self._get_assets_in_mempool_cache = {}
+        self._addr_balances = {}  # type: Dict[str, AddrBalance]
 
         self.load_and_cleanup()
 
@@ -392,6 +411,7 @@ class AddressSynchronizer(Logger, EventListener):
                         pass
                     else:
                         self.db.add_txi_addr(tx_hash, addr, ser, v, asset)
+                        self._addr_balances.pop(addr, None)
                         self._get_balance_cache.clear()  # invalidate cache
                         self._get_asset_balance_cache.clear()
                         self._get_assets_in_mempool_cache.clear()
@@ -412,15 +432,19 @@ class AddressSynchronizer(Logger, EventListener):
                     util.trigger_callback('adb_swap_redeemed', self, swap_id)
 
             # add outputs
+            asset_outputs = {}
             for n, txo in enumerate(tx.outputs()):
                 v = txo.value
                 ser = tx_hash + ':%d'%n
-                asset_data = get_asset_info_from_script(txo.scriptpubkey)
+                asset_data = txo.get_asset_vout_info()
+                if asset_data.is_transferable():
+                    asset_outputs[n] = asset_data
                 scripthash = bitcoin.script_to_scripthash(txo.scriptpubkey.hex())
                 self.db.add_prevout_by_scripthash(scripthash, prevout=TxOutpoint.from_str(ser), value=asset_data.amount or v, asset=asset_data.asset)
                 addr = txo.address
                 if addr and self.is_mine(addr):
                     self.db.add_txo_addr(tx_hash, addr, n, asset_data.amount or v, asset_data.asset, is_coinbase)
+                    self._addr_balances.pop(addr, None)
                     self._get_balance_cache.clear()  # invalidate cache
                     self._get_asset_balance_cache.clear()
                     self._get_assets_in_mempool_cache.clear()
@@ -439,6 +463,7 @@ class AddressSynchronizer(Logger, EventListener):
                             else:
                                 self.logger.info(f'{outpoint.to_str()} is not well-formed')
                             self.db.add_non_deterministic_txo_lockingscript(outpoint)
+            self.db.set_txo_asset_info(tx_hash, asset_outputs)
 
             # add to local history
             self._add_tx_to_local_history(tx_hash)
@@ -517,6 +542,7 @@ class AddressSynchronizer(Logger, EventListener):
             remove_from_spent_outpoints()
             self._remove_tx_from_local_history(tx_hash)
             for addr in itertools.chain(self.db.get_txi_addresses(tx_hash), self.db.get_txo_addresses(tx_hash)):
+                self._addr_balances.pop(addr, None)
                 self._get_balance_cache.clear()  # invalidate cache
                 self._get_asset_balance_cache.clear()
                 self._get_assets_in_mempool_cache.clear()
@@ -556,6 +582,7 @@ class AddressSynchronizer(Logger, EventListener):
                     self.unverified_tx.pop(tx_hash, None)
                     self.unconfirmed_tx.pop(tx_hash, None)
                     self.db.remove_verified_tx(tx_hash)
+                    self._invalidate_addr_balances_for_tx(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.db.set_addr_history(addr, hist)
@@ -610,6 +637,7 @@ class AddressSynchronizer(Logger, EventListener):
             with self.transaction_lock:
                 self.db.clear_history()
                 self._history_local.clear()
+                self._addr_balances.clear()
                 self._get_balance_cache.clear()  # invalidate cache
                 self._get_asset_balance_cache.clear()
                 self._get_assets_in_mempool_cache.clear()
@@ -698,6 +726,7 @@ class AddressSynchronizer(Logger, EventListener):
                 cur_hist = self._history_local.get(addr, set())
                 cur_hist.add(txid)
                 self._history_local[addr] = cur_hist
+                self._addr_balances.pop(addr, None)
                 self._mark_address_history_changed(addr)
 
     def _remove_tx_from_local_history(self, txid):
@@ -710,8 +739,17 @@ class AddressSynchronizer(Logger, EventListener):
                     pass
                 else:
                     self._history_local[addr] = cur_hist
+                    self._addr_balances.pop(addr, None)
                     self._mark_address_history_changed(addr)
 
+    def _invalidate_addr_balances_for_tx(self, txid: str) -> None:
+        """To be called when txid moves between mined and unmined."""
+        for addr in itertools.chain(self.db.get_txi_addresses(txid), self.db.get_txo_addresses(txid)):
+            self._addr_balances.pop(addr, None)
+            self._get_balance_cache.clear()  # invalidate cache
+            self._get_asset_balance_cache.clear()
+            self._get_assets_in_mempool_cache.clear()
+
     def _mark_address_history_changed(self, addr: str) -> None:
         def set_and_clear():
             event = self._address_history_changed_events[addr]
@@ -738,14 +776,18 @@ class AddressSynchronizer(Logger, EventListener):
                 with self.lock:
                     self.db.remove_verified_tx(tx_hash)
                     self.unconfirmed_tx[tx_hash] = tx_height
+                    self._invalidate_addr_balances_for_tx(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
+                was_mined = self.get_tx_height(tx_hash).height > 0
                 if tx_height > 0:
                     self.unverified_tx[tx_hash] = tx_height
                 else:
                     self.unconfirmed_tx[tx_hash] = tx_height
+                if was_mined != (self.get_tx_height(tx_hash).height > 0):
+                    self._invalidate_addr_balances_for_tx(tx_hash)
 
     def add_unverified_or_unconfirmed_asset_metadata(self, asset, d):
         metadata = StrictAssetMetadata(
@@ -1266,12 +1308,16 @@ class AddressSynchronizer(Logger, EventListener):
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._invalidate_addr_balances_for_tx(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
+            was_mined = self.get_tx_height(tx_hash).height > 0
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
+            if not was_mined:
+                self._invalidate_addr_balances_for_tx(tx_hash)
         util.trigger_callback('adb_added_verified_tx', self, tx_hash)
 
     def get_unverified_txs(self) -> Dict[str, int]:
@@ -1283,12 +1329,25 @@ class AddressSynchronizer(Logger, EventListener):
         '''Used by the verifier when a reorg has happened'''
         txs = set()
         assets = set()
+        header_hashes = {}  # type: Dict[int, Optional[str]]
+
+        def header_hash_at(height: int) -> Optional[str]:
+            if height not in header_hashes:
+                try:
+                    header_hashes[height] = blockchain.get_hash(height)
+                except MissingHeader:
+                    header_hashes[height] = None
+            return header_hashes[height]
+
+        def is_still_verified(tx_hash: str, height: int) -> bool:
+            verified_info = self.db.get_verified_tx(tx_hash)
+            header_hash = header_hash_at(height)
+            return bool(header_hash and verified_info and header_hash == verified_info.header_hash)
+
         with self.lock:
             for asset in self.db.get_assets_verified_after_height(above_height):
                 base_outpoint, base_height = self.db.get_verified_asset_metadata_base_source(asset)
-                verified_info = self.db.get_verified_tx(base_outpoint.txid.hex())
-                header = blockchain.read_header(base_height)
-                if header and verified_info and hash_header(header) == verified_info.header_hash: continue
+                if is_still_verified(base_outpoint.txid.hex(), base_height): continue
                 assets.add(asset)
                 tup = self.db.remove_verified_asset_metadata(asset)
                 self.unverified_asset_metadata[asset] = tup
@@ -1300,76 +1359,55 @@ class AddressSynchronizer(Logger, EventListener):
                     txs.add(associated_data_tup[0].txid.hex())
             for asset in self.db.get_verified_restricted_verifier_after_height(above_height):
                 data = self.db.get_verified_restricted_verifier(asset)
-                verified_info = self.db.get_verified_tx(data['tx_hash'])
-                header = blockchain.read_header(data['height'])
-                if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-                
+                if is_still_verified(data['tx_hash'], data['height']): continue
                 self.db.remove_verified_restricted_verifier(asset)
                 txs.add(data['tx_hash'])
             for asset in self.db.get_verified_restricted_freezes_after_height(above_height):
                 data = self.db.get_verified_restricted_freeze(asset)
-                verified_info = self.db.get_verified_tx(data['tx_hash'])
-                header = blockchain.read_header(data['height'])
-                if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-                
+                if is_still_verified(data['tx_hash'], data['height']): continue
                 self.db.remove_verified_restricted_freeze(asset)
                 txs.add(data['tx_hash'])
             for asset, restricted_assets in self.db.get_verified_associations_after_height(above_height).items():
                 for restricted_asset in restricted_assets:
                     association_data = self.db.get_verified_associations(asset)[restricted_asset]
-                    verified_info = self.db.get_verified_tx(association_data['tx_hash'])
-                    
-                    header = blockchain.read_header(association_data['height'])
-                    if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-                    
+                    if is_still_verified(association_data['tx_hash'], association_data['height']): continue
                     self.db.remove_verified_association(asset, restricted_asset)
-                    txs.add(tag_data['tx_hash'])
-            
+                    txs.add(association_data['tx_hash'])
             for asset, h160s in self.db.get_verified_qualifier_tags_after_height(above_height).items():
                 for h160 in h160s:
                     tag_data = self.db.get_verified_qualifier_tag(asset, h160)
-                    verified_info = self.db.get_verified_tx(tag_data['tx_hash'])
-                    header = blockchain.read_header(tag_data['height'])
-                    if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-                    
+                    if is_still_verified(tag_data['tx_hash'], tag_data['height']): continue
                     self.db.remove_verified_qualifier_tag(asset, h160)
                     txs.add(tag_data['tx_hash'])
-            for h160, assets in self.db.get_verified_h160_tags_after_height(above_height).items():
-                for asset in assets:
+            for h160, assets_ in self.db.get_verified_h160_tags_after_height(above_height).items():
+                for asset in assets_:
                     tag_data = self.db.get_verified_h160_tag(h160, asset)
-                    verified_info = self.db.get_verified_tx(tag_data['tx_hash'])
-                    header = blockchain.read_header(tag_data['height'])
-                    if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-                    
+                    if is_still_verified(tag_data['tx_hash'], tag_data['height']): continue
                     self.db.remove_verified_h160_tag(h160, asset)
                     txs.add(tag_data['tx_hash'])
             for asset, tx_hashes in self.db.get_verified_broadcasts_after_height(above_height).items():
                 for tx_hash in tx_hashes:
                     broadcast = self.db.get_verified_broadcast(asset, tx_hash)
-                    verified_info = self.db.get_verified_tx(tx_hash)
-                    header = blockchain.read_header(broadcast['height'])
-                    if header and verified_info and hash_header(header) == verified_info.header_hash: continue
-
+                    if is_still_verified(tx_hash, broadcast['height']): continue
                     self.db.remove_verified_broadcast(asset, tx_hash)
                     txs.add(tx_hash)
-            for tx_hash in self.db.list_verified_tx():
+            for tx_hash in self.db.list_verified_tx_after_height(above_height):
                 info = self.db.get_verified_tx(tx_hash)
                 tx_height = info.height
-                if tx_height > above_height:
-                    header = blockchain.read_header(tx_height)
-                    if not header or hash_header(header) != info.header_hash:
-                        self.db.remove_verified_tx(tx_hash)
-                        # NOTE: we should add these txns to self.unverified_tx,
-                        # but with what height?
-                        # If on the new fork after the reorg, the txn is at the
-                        # same height, we will not get a status update for the
-                        # address. If the txn is not mined or at a diff height,
-                        # we should get a status update. Unless we put tx into
-                        # unverified_tx, it will turn into local. So we put it
-                        # into unverified_tx with the old height, and if we get
-                        # a status update, that will overwrite it.
-                        self.unverified_tx[tx_hash] = tx_height
-                        txs.add(tx_hash)
+                header_hash = header_hash_at(tx_height)
+                if not header_hash or header_hash != info.header_hash:
+                    self.db.remove_verified_tx(tx_hash)
+                    # NOTE: we should add these txns to self.unverified_tx,
+                    # but with what height?
+                    # If on the new fork after the reorg, the txn is at the
+                    # same height, we will not get a status update for the
+                    # address. If the txn is not mined or at a diff height,
+                    # we should get a status update. Unless we put tx into
+                    # unverified_tx, it will turn into local. So we put it
+                    # into unverified_tx with the old height, and if we get
+                    # a status update, that will overwrite it.
+                    self.unverified_tx[tx_hash] = tx_height
+                    txs.add(tx_hash)
 
         for tx_hash in txs:
             util.trigger_callback('adb_removed_verified_tx', self, tx_hash)
@@ -1448,6 +1486,11 @@ class AddressSynchronizer(Logger, EventListener):
             nans += n2
         return nsent, nans
 
+    def get_verification_progress(self) -> Optional[dict]:
+        if self.verifier:
+            return self.verifier.get_verification_progress()
+        return None
+
     @with_transaction_lock
     def get_tx_delta(self, tx_hash: str, address: str) -> Mapping[Optional[str], int]:
         """effect of tx on address"""
@@ -1560,6 +1603,27 @@ class AddressSynchronizer(Logger, EventListener):
                 out.pop(k)
         return out
 
+    def _get_addr_balance(self, address: str) -> AddrBalance:
+        entry = self._addr_balances.get(address)
+        if entry is None:
+            entry = AddrBalance()
+            for prevout, utxo in self.get_addr_outputs(address).items():
+                if utxo.spent_height is not None:
+                    continue
+                prevout_str = prevout.to_str()
+                asset = utxo.asset
+                v = utxo.value_sats(asset_aware=True)
+                coin = (prevout_str, prevout.txid.hex(), utxo.block_height, asset, v)
+                if utxo.is_coinbase_output():
+                    entry.coinbase.append(coin)
+                elif utxo.block_height > 0:
+                    entry.confirmed[asset] += v
+                    entry.confirmed_coins[prevout_str] = (asset, v)
+                else:
+                    entry.unconfirmed.append(coin)
+            self._addr_balances[address] = entry
+        return entry
+
     @with_lock
     @with_transaction_lock
     @with_local_height_cached
@@ -1598,74 +1662,51 @@ class AddressSynchronizer(Logger, EventListener):
         if cached_value:
             return cached_value
 
-        coins = {}  # type: Dict[TxOutpoint, PartialTxInput]
-        for address in domain:
-            coins.update(self.get_addr_outputs(address))
-
-        if asset_aware:
-            c = defaultdict(int)
-            u = defaultdict(int)
-            x = defaultdict(int)
-            assets_in_mempool = set()
-        else:
-            c = u = x = 0
-        
+        c = defaultdict(int)
+        u = defaultdict(int)
+        x = defaultdict(int)
+        assets_in_mempool = set()
+        unconfirmed = []
         mempool_height = self.get_local_height() + 1  # height of next block
-        for utxo in coins.values():
-            if utxo.spent_height is not None:
-                continue
-            if utxo.prevout.to_str() in excluded_coins:
-                continue
-
-            v = utxo.value_sats(asset_aware=asset_aware)
-            tx_height = utxo.block_height
-            is_cb = utxo.is_coinbase_output()
-            if is_cb and tx_height + COINBASE_MATURITY > mempool_height:
-                if asset_aware:
-                    x[utxo.asset] += v
-                else:
-                    x += v
-            elif tx_height > 0:
-                if asset_aware:
-                    c[utxo.asset] += v
-                else:
-                    c += v
+        for address in domain:
+            entry = self._get_addr_balance(address)
+            if excluded_coins and not excluded_coins.isdisjoint(entry.confirmed_coins):
+                for prevout_str, (asset, v) in entry.confirmed_coins.items():
+                    if prevout_str not in excluded_coins:
+                        c[asset] += v
             else:
-                txid = utxo.prevout.txid.hex()
-                tx = self.db.get_transaction(txid)
-                assert tx is not None # txid comes from get_addr_io
-                # we look at the outputs that are spent by this transaction
-                # if those outputs are ours and confirmed, we count this coin as confirmed
-
-                if asset_aware:
-                    confirmed_spent_amount = defaultdict(int)
-                else:
-                    confirmed_spent_amount = 0
-                
-                for txin in tx.inputs():
-                    if txin.prevout in coins:
-                        coin = coins[txin.prevout]
-                        if coin.block_height > 0:
-                            if asset_aware:
-                                confirmed_spent_amount[coin.asset] += coin.value_sats(asset_aware=asset_aware)
-                            else:
-                                confirmed_spent_amount += coin.value_sats(asset_aware=asset_aware)
-                # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
-                # (fixme: tx may have multiple change outputs)
-
-                if asset_aware:
-                    assets_in_mempool.add(utxo.asset)
-                    if confirmed_spent_amount[utxo.asset] >= v:
-                        c[utxo.asset] += v
-                    else:
-                        c[utxo.asset] += confirmed_spent_amount[utxo.asset]
-                        u[utxo.asset] += v - confirmed_spent_amount[utxo.asset]
+                for asset, v in entry.confirmed.items():
+                    c[asset] += v
+            for coin in entry.coinbase:
+                prevout_str, txid, tx_height, asset, v = coin
+                if prevout_str in excluded_coins:
+                    continue
+                if tx_height + COINBASE_MATURITY > mempool_height:
+                    x[asset] += v
+                elif tx_height > 0:
+                    c[asset] += v
                 else:
-                    if confirmed_spent_amount >= v:
-                        c += v
-                    else:
-                        c += confirmed_spent_amount
-                        u += v - confirmed_spent_amount
+                    unconfirmed.append(coin)
+            unconfirmed.extend(coin for coin in entry.unconfirmed if coin[0] not in excluded_coins)
+
+        for prevout_str, txid, tx_height, asset, v in unconfirmed:
+            # we look at the outputs that are spent by this transaction
+            # if those outputs are ours and confirmed, we count this coin as confirmed
+            confirmed_spent_amount = 0
+            for address in self.db.get_txi_addresses(txid):
+                if address not in domain:
+                    continue
+                for spent_prevout_str, spent_v, spent_asset in self.db.get_txi_addr(txid, address):
+                    if spent_asset == asset and self.get_tx_height(spent_prevout_str.split(':')[0]).height > 0:
+                        confirmed_spent_amount += spent_v
+            # Compare amount, in case tx has confirmed and unconfirmed inputs, or is a coinjoin.
+            # (fixme: tx may have multiple change outputs)
+            assets_in_mempool.add(asset)
+            if confirmed_spent_amount >= v:
+                c[asset] += v
+            else:
+                c[asset] += confirmed_spent_amount
+                u[asset] += v - confirmed_spent_amount
 
         if asset_aware:
             result = defaultdict(lambda: (0, 0, 0))
@@ -1674,7 +1715,8 @@ class AddressSynchronizer(Logger, EventListener):
             self._get_asset_balance_cache[cache_key] = result
             self._get_assets_in_mempool_cache[cache_key] = assets_in_mempool
         else:
-            result = c, u, x
+            # plain values are those of the RVN coins, asset coins count as 0
+            result = c[None], u[None], x[None]
             # cache result.
             # Cache needs to be invalidated if a transaction is added to/
             # removed from history; or on new blocks (maturity...)
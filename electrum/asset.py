@@ -436,7 +436,98 @@ class FreezeTagAssetVoutInformation(TagAssetVoutInformation):
         self.asset = asset
         self.flag = flag
 
+def _parse_asset_portion(asset_portion: bytes, well_formed: bool) -> Optional[BaseAssetVoutInformation]:
+    """Parses the data following OP_ASSET in a transferable asset script.
+    Returns None if it is not an asset payload. May raise IndexError.
+    """
+    asset_prefix_position = asset_portion.find(constants.net.ASSET_PREFIX)
+    if asset_prefix_position < 0: return None
+    if len(asset_portion) < len(constants.net.ASSET_PREFIX) + 3: return None
+    reader = ByteReader(asset_portion[asset_prefix_position + len(constants.net.ASSET_PREFIX):])
+    vout_type = reader.read_bytes(1)
+    if vout_type == RVN_ASSET_TYPE_CREATE:
+        asset_vout_type = AssetVoutType.CREATE
+    elif vout_type == RVN_ASSET_TYPE_OWNER:
+        asset_vout_type = AssetVoutType.OWNER
+    elif vout_type == RVN_ASSET_TYPE_TRANSFER:
+        asset_vout_type = AssetVoutType.TRANSFER
+    elif vout_type == RVN_ASSET_TYPE_REISSUE:
+        asset_vout_type = AssetVoutType.REISSUE
+    else: return None
+
+    asset_length = reader.read_byte_as_int()
+    asset = reader.read_bytes(asset_length).decode()
+    if asset_vout_type == AssetVoutType.OWNER:
+        return OwnerAssetVoutInformation(well_formed, asset)
+
+    asset_amount_bytes = reader.read_bytes(8)
+    asset_amount = int.from_bytes(asset_amount_bytes, 'little')
+
+    if asset_vout_type == AssetVoutType.TRANSFER:
+        memo = None
+        timestamp = None
+        if reader.can_read_amount(34):
+            memo = reader.read_bytes(34)
+            if reader.can_read_amount(8):
+                timestamp_bytes = reader.read_bytes(8)
+                timestamp = int.from_bytes(timestamp_bytes, 'little')
+        return TransferAssetVoutInformation(well_formed, asset, asset_amount, memo, timestamp)
+
+    divisions = reader.read_byte_as_int()
+    reissuable = reader.read_byte_as_int() == 1
+
+    if asset_vout_type == AssetVoutType.CREATE:
+        has_associated_data = reader.read_byte_as_int() == 1
+        if has_associated_data:
+            associated_data = reader.read_bytes(34)
+            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, associated_data)
+        else:
+            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, None)
+    elif asset_vout_type == AssetVoutType.REISSUE:
+        if reader.can_read_amount(34):
+            associated_data = reader.read_bytes(34)
+            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, associated_data)
+        else:
+            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, None)
+    return None
+
+def _decode_standard_asset_script(script: bytes) -> Optional[BaseAssetVoutInformation]:
+    """Single pass decoder for P2PKH and P2SH scripts, optionally followed by
+    a well-formed asset payload, which are nearly all the outputs a wallet sees.
+    Returns None for any other script, which needs the script_GetOp path.
+    """
+    script_len = len(script)
+    if script_len >= 25 and script[:3] == b'\x76\xa9\x14' and script[23:25] == b'\x88\xac':
+        start = 25
+    elif script_len >= 23 and script[:2] == b'\xa9\x14' and script[22] == opcodes.OP_EQUAL:
+        start = 23
+    else:
+        return None
+    if script_len == start:
+        return NoAssetVoutInformation()
+    if script_len < start + 3 or script[start] != opcodes.OP_ASSET or script[-1] != opcodes.OP_DROP:
+        return None
+    asset_portion = script[start + 1:]
+    op = asset_portion[0]
+    if op < opcodes.OP_PUSHDATA1:
+        size, header = op, 1
+    elif op == opcodes.OP_PUSHDATA1:
+        size, header = asset_portion[1], 2
+    elif op == opcodes.OP_PUSHDATA2 and len(asset_portion) >= 3:
+        size, header = int.from_bytes(asset_portion[1:3], 'little'), 3
+    else:
+        return None
+    if header + size + 1 != len(asset_portion) or asset_portion[:header] != bytes.fromhex(_op_push(size)):
+        return None
+    try:
+        return _parse_asset_portion(asset_portion, True) or NoAssetVoutInformation()
+    except IndexError:
+        return NoAssetVoutInformation()
+
 def get_asset_info_from_script(script: bytes) -> BaseAssetVoutInformation:
+    asset_info = _decode_standard_asset_script(script)
+    if asset_info is not None:
+        return asset_info
     try:
         decoded = [x for x in script_GetOp(script)]
     except MalformedBitcoinScript:
@@ -479,61 +570,42 @@ def get_asset_info_from_script(script: bytes) -> BaseAssetVoutInformation:
                             op_push_prefix = bytes.fromhex(_op_push(len(decoded[i+1][1])))
                             remaining_matches = (op_push_prefix + decoded[i+1][1] + b'\x75') == asset_portion
                     well_formed = decoded_has_good_length and next_op_is_a_push and remaining_matches
-                    
-                    asset_prefix_position = asset_portion.find(constants.net.ASSET_PREFIX)
-                    if asset_prefix_position < 0: break
-                    if len(asset_portion) < len(constants.net.ASSET_PREFIX) + 3: break
-                    reader = ByteReader(asset_portion[asset_prefix_position + len(constants.net.ASSET_PREFIX):])
-                    vout_type = reader.read_bytes(1)
-                    if vout_type == RVN_ASSET_TYPE_CREATE:
-                        asset_vout_type = AssetVoutType.CREATE
-                    elif vout_type == RVN_ASSET_TYPE_OWNER:
-                        asset_vout_type = AssetVoutType.OWNER
-                    elif vout_type == RVN_ASSET_TYPE_TRANSFER:
-                        asset_vout_type = AssetVoutType.TRANSFER
-                    elif vout_type == RVN_ASSET_TYPE_REISSUE:
-                        asset_vout_type = AssetVoutType.REISSUE
-                    else: break
-
-                    asset_length = reader.read_byte_as_int()
-                    asset = reader.read_bytes(asset_length).decode()
-                    if asset_vout_type == AssetVoutType.OWNER:
-                        return OwnerAssetVoutInformation(well_formed, asset)
-
-                    asset_amount_bytes = reader.read_bytes(8)
-                    asset_amount = int.from_bytes(asset_amount_bytes, 'little')
-
-                    if asset_vout_type == AssetVoutType.TRANSFER:
-                        memo = None
-                        timestamp = None
-                        if reader.can_read_amount(34):
-                            memo = reader.read_bytes(34)
-                            if reader.can_read_amount(8):
-                                timestamp_bytes = reader.read_bytes(8)
-                                timestamp = int.from_bytes(timestamp_bytes, 'little')
-                        return TransferAssetVoutInformation(well_formed, asset, asset_amount, memo, timestamp)
-                    
-                    divisions = reader.read_byte_as_int()
-                    reissuable = reader.read_byte_as_int() == 1
-
-                    if asset_vout_type == AssetVoutType.CREATE:
-                        has_associated_data = reader.read_byte_as_int() == 1
-                        if has_associated_data:
-                            associated_data = reader.read_bytes(34)
-                            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, associated_data)
-                        else:
-                            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, None)
-                    elif asset_vout_type == AssetVoutType.REISSUE:
-                        if reader.can_read_amount(34):
-                            associated_data = reader.read_bytes(34)
-                            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, associated_data)
-                        else:
-                            return MetadataAssetVoutInformation(asset_vout_type, well_formed, asset, asset_amount, divisions, reissuable, None)
-                    break
+                    asset_info = _parse_asset_portion(asset_portion, well_formed)
+                    if asset_info is None: break
+                    return asset_info
     except IndexError:
         pass
     return NoAssetVoutInformation()
 
+def asset_vout_info_to_json(asset_info: BaseAssetVoutInformation) -> Optional[list]:
+    """Compact form of the info of a transferable asset vout, for the wallet db.
+    Returns None for any other vout.
+    """
+    type_ = asset_info.get_type()
+    if type_ == AssetVoutType.OWNER:
+        return [type_.name, asset_info.well_formed_script, asset_info.asset]
+    if type_ == AssetVoutType.TRANSFER:
+        memo = asset_info.asset_memo.hex() if asset_info.asset_memo is not None else None
+        return [type_.name, asset_info.well_formed_script, asset_info.asset, asset_info.amount,
+                memo, asset_info.asset_memo_timestamp]
+    if type_ in (AssetVoutType.CREATE, AssetVoutType.REISSUE):
+        data = asset_info.associated_data.hex() if asset_info.associated_data is not None else None
+        return [type_.name, asset_info.well_formed_script, asset_info.asset, asset_info.amount,
+                asset_info.divisions, asset_info.reissuable, data]
+    return None
+
+def asset_vout_info_from_json(d: Optional[Sequence]) -> BaseAssetVoutInformation:
+    if d is None:
+        return NoAssetVoutInformation()
+    type_ = AssetVoutType[d[0]]
+    if type_ == AssetVoutType.OWNER:
+        return OwnerAssetVoutInformation(d[1], d[2])
+    if type_ == AssetVoutType.TRANSFER:
+        memo = bytes.fromhex(d[4]) if d[4] is not None else None
+        return TransferAssetVoutInformation(d[1], d[2], d[3], memo, d[5])
+    data = bytes.fromhex(d[6]) if d[6] is not None else None
+    return MetadataAssetVoutInformation(type_, d[1], d[2], d[3], d[4], d[5], data)
+
 def compress_verifier_string(verifier: str) -> str:
     return ''.join(verifier.split()).replace(_QUALIFIER_TAG_DELIMITER, '')
 
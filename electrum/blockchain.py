@@ -21,14 +21,22 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import mmap
+import json
 import threading
 import time
 import struct
-from typing import Optional, Dict, Mapping, Sequence, TYPE_CHECKING, Tuple
+import asyncio
+import concurrent.futures
+import multiprocessing
+from collections import deque
+from typing import Optional, Dict, Mapping, Sequence, TYPE_CHECKING, Tuple, List, Union
+
+from aiorpcx import run_in_thread
 
 from . import util
 from .bitcoin import hash_encode, int_to_hex, rev_hex
-from .crypto import sha256d
+from .crypto import sha256, sha256d
 from . import constants
 from .util import bfh, with_lock
 from .logging import get_logger, Logger
@@ -47,6 +55,8 @@ KAWPOW_LIMIT = 0x0000000000fffffffffffffffffffffffffffffffffffffffffffffffffffff
 
 HEADER_SIZE = 120  # bytes
 LEGACY_HEADER_SIZE = 80
+HASH_SIZE = 32
+HASHES_FILE_SUFFIX = '.hashes'
 
 DGW_PASTBLOCKS = 180
 
@@ -151,13 +161,176 @@ def hash_raw_header_kawpow(header: str) -> str:
     return final_hash
 
 
+def split_chunk(start_height: int, data: bytes) -> List[bytes]:
+    """Splits a chunk as sent by the server into raw headers.
+    Headers below KawpowActivationHeight are LEGACY_HEADER_SIZE long, the rest HEADER_SIZE.
+    """
+    raw_headers = []
+    p = 0
+    s = start_height
+    while p < len(data):
+        size = header_record_size(s)
+        raw = data[p:p + size]
+        if len(raw) != size:
+            raise Exception('Invalid header length: {}'.format(len(raw)))
+        raw_headers.append(raw)
+        p += size
+        s += 1
+    return raw_headers
+
+
+# Headers files (v2 layout) store the headers before KawpowActivationHeight
+# in LEGACY_HEADER_SIZE records, and the ones after in HEADER_SIZE records.
+# These two segments make the position of any height computable in O(1).
+# The v1 layout padded legacy headers to HEADER_SIZE with zeroes.
+
+def header_record_size(height: int) -> int:
+    return LEGACY_HEADER_SIZE if height < constants.net.KawpowActivationHeight else HEADER_SIZE
+
+
+def header_offset(height: int) -> int:
+    """Returns the position of the header at height, in a headers file starting at height 0."""
+    k = constants.net.KawpowActivationHeight
+    if height <= k:
+        return height * LEGACY_HEADER_SIZE
+    return k * LEGACY_HEADER_SIZE + (height - k) * HEADER_SIZE
+
+
+def height_at_offset(offset: int) -> int:
+    """Returns the number of whole headers in the first offset bytes of a
+    headers file starting at height 0 (the inverse of header_offset).
+    """
+    k = constants.net.KawpowActivationHeight
+    legacy_size = k * LEGACY_HEADER_SIZE
+    if offset <= legacy_size:
+        return offset // LEGACY_HEADER_SIZE
+    return k + (offset - legacy_size) // HEADER_SIZE
+
+
+def convert_headers_file_to_v2(config: 'SimpleConfig') -> None:
+    """One-time conversion of the v1 main chain headers file, where legacy
+    headers were zero-padded to HEADER_SIZE, to the v2 layout.
+    Fork files only hold headers above the checkpoints, past KAWPOW
+    activation, so their layout is the same in both versions.
+    """
+    d = util.get_headers_dir(config)
+    old_path = os.path.join(d, 'blockchain_headers')
+    new_path = os.path.join(d, 'blockchain_headers_v2')
+    if not os.path.exists(old_path):
+        return
+    if os.path.exists(new_path):
+        os.unlink(old_path)
+        return
+    _logger.info("converting headers file to v2 layout")
+    tmp_path = new_path + '.tmp'
+    k = constants.net.KawpowActivationHeight
+    batch = 2016
+    with open(old_path, 'rb') as f_old, open(tmp_path, 'wb') as f_new:
+        util.ensure_sparse_file(tmp_path)
+        height = 0
+        while True:
+            data = f_old.read(batch * HEADER_SIZE)
+            if not data:
+                break
+            records = [data[i:i + HEADER_SIZE] for i in range(0, len(data) - HEADER_SIZE + 1, HEADER_SIZE)]
+            out = b''.join(r[:LEGACY_HEADER_SIZE] if height + i < k else r for i, r in enumerate(records))
+            if any(out):
+                f_new.seek(header_offset(height))
+                f_new.write(out)
+            height += len(records)
+        # keep missing headers at the end of the file, as zeroes
+        f_new.truncate(header_offset(height))
+        f_new.flush()
+        os.fsync(f_new.fileno())
+    os.replace(tmp_path, new_path)
+    os.unlink(old_path)
+
+
+def _init_pow_worker(net_name: str) -> None:
+    # worker processes do not inherit our choice of network
+    for net in constants.NETS_LIST:
+        if net.NET_NAME == net_name:
+            constants.net = net
+            break
+
+
+def _hash_raw_headers(start_height: int, raw_headers: Sequence[bytes]) -> List[str]:
+    return [hash_header(deserialize_header(raw, start_height + i))
+            for i, raw in enumerate(raw_headers)]
+
+
+# process pool for proof-of-work hashing, created on first use
+_pow_executor = None  # type: Optional[concurrent.futures.ProcessPoolExecutor]
+_pow_executor_lock = threading.Lock()
+
+
+def _get_pow_executor(num_workers: int) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+    global _pow_executor
+    with _pow_executor_lock:
+        if _pow_executor is None:
+            try:
+                _pow_executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=num_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_pow_worker,
+                    initargs=(constants.net.NET_NAME,))
+            except Exception as e:
+                _logger.warning(f'could not start proof-of-work process pool: {repr(e)}')
+                return None
+        return _pow_executor
+
+
+def shutdown_pow_executor() -> None:
+    global _pow_executor
+    with _pow_executor_lock:
+        if _pow_executor is not None:
+            _pow_executor.shutdown(wait=False, cancel_futures=True)
+            _pow_executor = None
+
+
+def get_num_pow_workers(config: 'SimpleConfig') -> int:
+    num_workers = config.BLOCKCHAIN_POW_VERIFY_WORKERS
+    if num_workers <= 0:
+        num_workers = os.cpu_count() or 1
+    return num_workers
+
+
+async def hash_chunk_headers(config: 'SimpleConfig', start_height: int, data: bytes) -> List[str]:
+    """Returns the block hashes of the headers in chunk.
+    The proof-of-work hashing is sharded across a process pool, so that
+    it uses all cores and does not block the event loop.
+    """
+    raw_headers = split_chunk(start_height, data)
+    num_workers = get_num_pow_workers(config)
+    executor = _get_pow_executor(num_workers) if num_workers > 1 else None
+    if executor is None:
+        return await run_in_thread(_hash_raw_headers, start_height, raw_headers)
+    loop = asyncio.get_running_loop()
+    shard_size = -(-len(raw_headers) // num_workers)
+    futures = [
+        loop.run_in_executor(executor, _hash_raw_headers, start_height + i, raw_headers[i:i + shard_size])
+        for i in range(0, len(raw_headers), shard_size)]
+    header_hashes = []
+    for shard in await asyncio.gather(*futures):
+        header_hashes.extend(shard)
+    return header_hashes
+
+
 # key: blockhash hex at forkpoint
 # the chain at some key is the best chain that includes the given hash
 blockchains = {}  # type: Dict[str, Blockchain]
 blockchains_lock = threading.RLock()  # lock order: take this last; so after Blockchain.lock
+_connect_chunk_lock = threading.Lock()  # lock order: take this first
 
 
-def read_blockchains(config: 'SimpleConfig'):
+def read_blockchains(config: 'SimpleConfig') -> bool:
+    """Instantiates our chains from the headers files.
+    Returns whether they were restored from a snapshot, in which case
+    verify_snapshot_chains has to be run (e.g. in the background).
+    """
+    convert_headers_file_to_v2(config)
+    if config.BLOCKCHAIN_FAST_START and _read_snapshot(config):
+        return True
     best_chain = Blockchain(config=config,
                             forkpoint=0,
                             parent=None,
@@ -165,12 +338,12 @@ def read_blockchains(config: 'SimpleConfig'):
                             prev_hash=None)
     blockchains[constants.net.GENESIS] = best_chain
     # consistency checks
-    if best_chain.height() > constants.net.max_checkpoint():
-        header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
-        if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
-            _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
-            os.unlink(best_chain.path())
-            best_chain.update_size()
+    if not _check_best_chain(best_chain):
+        _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+        best_chain.close_mmap()
+        os.unlink(best_chain.path())
+        best_chain.delete_hashes_file()
+        best_chain.update_size()
     # forks
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
     util.make_dir(fdir)
@@ -181,6 +354,8 @@ def read_blockchains(config: 'SimpleConfig'):
     def delete_chain(filename, reason):
         _logger.info(f"[blockchain] deleting chain {filename}: {reason}")
         os.unlink(os.path.join(fdir, filename))
+        if os.path.exists(os.path.join(fdir, filename + HASHES_FILE_SUFFIX)):
+            os.unlink(os.path.join(fdir, filename + HASHES_FILE_SUFFIX))
 
     def instantiate_chain(filename):
         __, forkpoint, prev_hash, first_hash = filename.split('_')
@@ -204,12 +379,8 @@ def read_blockchains(config: 'SimpleConfig'):
                        forkpoint_hash=first_hash,
                        prev_hash=prev_hash)
         # consistency checks
-        h = b.read_header(b.forkpoint)
-        if first_hash != hash_header(h):
-            delete_chain(filename, "incorrect first hash for chain")
-            return
-        if not b.parent.can_connect(h, check_height=False):
-            delete_chain(filename, "cannot connect chain to parent")
+        if reason := _check_fork(b):
+            delete_chain(filename, reason)
             return
         chain_id = b.get_id()
         assert first_hash == chain_id, (first_hash, chain_id)
@@ -217,6 +388,159 @@ def read_blockchains(config: 'SimpleConfig'):
 
     for filename in l:
         instantiate_chain(filename)
+    return False
+
+
+def _check_best_chain(best_chain: 'Blockchain') -> bool:
+    if best_chain.height() > constants.net.max_checkpoint():
+        header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
+        if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
+            return False
+    return True
+
+
+def _check_fork(b: 'Blockchain') -> Optional[str]:
+    """Returns why the fork is inconsistent with its parent, if it is."""
+    h = b.read_header(b.forkpoint)
+    if h is None or b.get_id() != hash_header(h):
+        return "incorrect first hash for chain"
+    if not b.parent.can_connect(h, check_height=False):
+        return "cannot connect chain to parent"
+    return None
+
+
+# Snapshot of our chains, saved on shutdown, so that the next start can
+# skip the consistency checks of read_blockchains and the chainwork
+# computation. It is only used once: read_blockchains deletes it, so that
+# it cannot get out of sync with headers saved after the start.
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_path(config: 'SimpleConfig') -> str:
+    return os.path.join(util.get_headers_dir(config), 'blockchain_snapshot')
+
+
+def _snapshot_checksum(d: dict) -> str:
+    return sha256(json.dumps(d, sort_keys=True).encode('utf-8')).hex()
+
+
+def save_snapshot(config: 'SimpleConfig') -> None:
+    """Saves our chains, their chainwork and the DGW window at the tip
+    of the best chain, for read_blockchains.
+    """
+    with blockchains_lock:
+        chains = sorted(blockchains.values(), key=lambda b: b.forkpoint)
+    d = {
+        'version': SNAPSHOT_VERSION,
+        'net': constants.net.NET_NAME,
+        'chains': [b.get_snapshot_entry() for b in chains],
+        'chainwork': dict(_CHAINWORK_CACHE),
+        'dgw_window': get_best_chain().get_tip_dgw_window_json(),
+    }
+    d['checksum'] = _snapshot_checksum(d)
+    path = get_snapshot_path(config)
+    try:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(d))
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        _logger.info(f"failed to save blockchain snapshot: {e!r}")
+
+
+def _read_snapshot(config: 'SimpleConfig') -> bool:
+    path = get_snapshot_path(config)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            d = json.loads(f.read())
+        chains = _chains_from_snapshot(config, d)
+    except Exception as e:
+        _logger.info(f"[blockchain] ignoring snapshot: {e!r}")
+        return False
+    finally:
+        os.unlink(path)
+    if chains is None:
+        return False
+    for b in chains:
+        blockchains[b.get_id()] = b
+    _CHAINWORK_CACHE.update({k: int(v) for k, v in d['chainwork'].items()})
+    if d['dgw_window'] is not None:
+        get_best_chain().set_tip_dgw_window(DGWWindow.from_json(d['dgw_window']))
+    _logger.info(f"[blockchain] restored {len(chains)} chains from snapshot")
+    return True
+
+
+def _chains_from_snapshot(config: 'SimpleConfig', d: dict) -> Optional[List['Blockchain']]:
+    checksum = d.pop('checksum', None)
+    if checksum != _snapshot_checksum(d):
+        _logger.info("[blockchain] ignoring snapshot: bad checksum")
+        return None
+    if d['version'] != SNAPSHOT_VERSION or d['net'] != constants.net.NET_NAME:
+        return None
+    chains = {}  # type: Dict[str, Blockchain]
+    for entry in d['chains']:
+        parent = chains[entry['parent']] if entry['parent'] is not None else None
+        if parent is None and entry['forkpoint_hash'] != constants.net.GENESIS:
+            return None
+        b = Blockchain(config=config,
+                       forkpoint=entry['forkpoint'],
+                       parent=parent,
+                       forkpoint_hash=entry['forkpoint_hash'],
+                       prev_hash=entry['prev_hash'])
+        # the headers files must not have changed since the snapshot
+        if not os.path.exists(b.path()) or os.path.getsize(b.path()) != entry['file_size']:
+            _logger.info(f"[blockchain] ignoring snapshot: {b.path()} changed")
+            return None
+        if b.read_cached_hash(b.height()) not in (None, entry['tip_hash']):
+            _logger.info(f"[blockchain] ignoring snapshot: tip of {b.get_id()} changed")
+            return None
+        chains[b.get_id()] = b
+    if constants.net.GENESIS not in chains:
+        return None
+    return list(chains.values())
+
+
+def verify_snapshot_chains() -> None:
+    """Runs the consistency checks of read_blockchains on chains restored
+    from a snapshot, deleting those that fail, and computes the chainwork
+    of forks and their parents if the snapshot did not have it.
+    The caller must prevent headers from being saved meanwhile (network.bhi_lock).
+    """
+    # as chunks may be connected concurrently, from another thread
+    with _connect_chunk_lock:
+        best_chain = get_best_chain()
+        with blockchains_lock:
+            forks = sorted((b for b in blockchains.values() if b.parent is not None), key=lambda b: b.forkpoint)
+        deleted = set()
+        if not _check_best_chain(best_chain):
+            _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            with best_chain.lock:
+                best_chain.close_mmap()
+                os.unlink(best_chain.path())
+                best_chain.delete_hashes_file()
+                best_chain.set_tip_dgw_window(None)
+            init_headers_file_for_best_chain()
+            deleted.add(best_chain)
+        for b in forks:
+            if b.parent in deleted:
+                reason = "cannot find parent for chain"
+            else:
+                reason = _check_fork(b)
+            if reason:
+                _logger.info(f"[blockchain] deleting chain {b.get_id()}: {reason}")
+                with blockchains_lock:
+                    blockchains.pop(b.get_id(), None)
+                with b.lock:
+                    b.close_mmap()
+                    os.unlink(b.path())
+                    b.delete_hashes_file()
+                deleted.add(b)
+    # as needed by swap_with_parent
+    for b in forks:
+        if b not in deleted:
+            b.get_chainwork()
+            b.parent.get_chainwork()
 
 
 def get_best_chain() -> 'Blockchain':
@@ -234,13 +558,14 @@ if len(constants.net.DGW_CHECKPOINTS) > 0:
 def init_headers_file_for_best_chain():
     b = get_best_chain()
     filename = b.path()
-    length = HEADER_SIZE * (constants.net.max_checkpoint() + 1)
+    length = header_offset(constants.net.max_checkpoint() + 1)
     if not os.path.exists(filename) or os.path.getsize(filename) < length:
         with open(filename, 'wb') as f:
             if length > 0:
                 f.seek(length - 1)
                 f.write(b'\x00')
         util.ensure_sparse_file(filename)
+        b.delete_hashes_file()
     with b.lock:
         b.update_size()
 
@@ -264,6 +589,13 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self._mmap = None  # type: Optional[mmap.mmap]
+        # hash index: the block hashes of our headers, in a parallel file of HASH_SIZE records.
+        # all-zero records are unknown hashes. b'' when there is no such file yet.
+        self._hashes_mmap = None  # type: Union[mmap.mmap, bytes, None]
+        self._pending_hashes = {}  # type: Dict[int, str]  # computed by get_hash, not yet written
+        # DGW window over the headers up to our tip, if restored from a snapshot
+        self._tip_dgw_window = None  # type: Optional[DGWWindow]
         self.update_size()
 
     @property
@@ -344,7 +676,7 @@ class Blockchain(Logger):
                           prev_hash=parent.get_hash(forkpoint-1))
         self.assert_headers_file_available(parent.path())
         open(self.path(), 'w+').close()
-        self.save_header(header)
+        self.save_header(header, header_hash=self._forkpoint_hash)
         # put into global dict. note that in some cases
         # save_header might have already put it there but that's OK
         chain_id = self.get_id()
@@ -363,11 +695,177 @@ class Blockchain(Logger):
     @with_lock
     def update_size(self) -> None:
         p = self.path()
-        self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
+        start = header_offset(self.forkpoint)
+        self._size = height_at_offset(start + os.path.getsize(p)) - self.forkpoint if os.path.exists(p) else 0
+        # the file might have changed under the mapping; remap lazily on next read
+        self.close_mmap()
+
+    def _offset(self, height: int) -> int:
+        """Returns the position of the header at height in our headers file."""
+        return header_offset(height) - header_offset(self.forkpoint)
+
+    @with_lock
+    def close_mmap(self) -> None:
+        for m in (self._mmap, self._hashes_mmap):
+            if not isinstance(m, mmap.mmap):
+                continue
+            try:
+                m.close()
+            except BufferError:
+                # someone still holds a view into the old mapping.
+                # it gets unmapped when that view is released.
+                pass
+        self._mmap = None
+        self._hashes_mmap = None
+
+    @with_lock
+    def _get_mmap(self) -> Optional[mmap.mmap]:
+        if self._mmap is None and self._size > 0:
+            filename = self.path()
+            self.assert_headers_file_available(filename)
+            with open(filename, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), self._offset(self.forkpoint + self._size), access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def hashes_path(self) -> str:
+        return self.path() + HASHES_FILE_SUFFIX
+
+    @with_lock
+    def delete_hashes_file(self) -> None:
+        self.close_mmap()
+        self._pending_hashes.clear()
+        if os.path.exists(self.hashes_path()):
+            os.unlink(self.hashes_path())
+
+    @with_lock
+    def _get_hashes_mmap(self) -> Union[mmap.mmap, bytes]:
+        if self._hashes_mmap is None:
+            path = self.hashes_path()
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, 'rb') as f:
+                    self._hashes_mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._hashes_mmap = b''
+        return self._hashes_mmap
+
+    @with_lock
+    def read_cached_hash(self, height: int) -> Optional[str]:
+        """Returns the block hash at height from the hash index, if known."""
+        if height < self.forkpoint:
+            return self.parent.read_cached_hash(height) if self.parent else None
+        if height > self.height():
+            return None
+        if header_hash := self._pending_hashes.get(height):
+            return header_hash
+        offset = (height - self.forkpoint) * HASH_SIZE
+        record = self._get_hashes_mmap()[offset:offset + HASH_SIZE]
+        if len(record) < HASH_SIZE or not any(record):
+            return None
+        return record.hex()
+
+    @with_lock
+    def _remember_hash(self, height: int, header_hash: str) -> None:
+        """Adds a hash computed from a stored header to the hash index.
+        These are written out in batches, e.g. for headers saved before the
+        index existed.
+        """
+        if height < self.forkpoint:
+            return self.parent._remember_hash(height, header_hash)
+        self._pending_hashes[height] = header_hash
+        if len(self._pending_hashes) >= 2016:
+            self._flush_pending_hashes()
+
+    @with_lock
+    def _flush_pending_hashes(self) -> None:
+        if not self._pending_hashes:
+            return
+        pending, self._pending_hashes = self._pending_hashes, {}
+        self.close_mmap()
+        path = self.hashes_path()
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            for height, header_hash in sorted(pending.items()):
+                f.seek((height - self.forkpoint) * HASH_SIZE)
+                f.write(bfh(header_hash))
+
+    @with_lock
+    def _read_hashes(self, start_height: int, count: int) -> bytes:
+        """Returns the hash index records of count heights from start_height, zeroes where unknown."""
+        self._flush_pending_hashes()
+        offset = (start_height - self.forkpoint) * HASH_SIZE
+        data = bytes(self._get_hashes_mmap()[offset:offset + count * HASH_SIZE])
+        return data.ljust(count * HASH_SIZE, b'\x00')
+
+    @with_lock
+    def _write_hashes(self, start_height: int, hashes: bytes, truncate: bool) -> None:
+        self.close_mmap()
+        path = self.hashes_path()
+        offset = (start_height - self.forkpoint) * HASH_SIZE
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as f:
+            if truncate:
+                f.truncate(offset + len(hashes))
+            f.seek(offset)
+            f.write(hashes)
+            f.flush()
+
+    @with_lock
+    def get_snapshot_entry(self) -> dict:
+        try:
+            tip_hash = self.get_hash(self.height())
+        except MissingHeader:
+            tip_hash = None
+        return {
+            'forkpoint': self.forkpoint,
+            'forkpoint_hash': self._forkpoint_hash,
+            'prev_hash': self._prev_hash,
+            'parent': self.parent.get_id() if self.parent else None,
+            'file_size': os.path.getsize(self.path()),
+            'tip_hash': tip_hash,
+        }
+
+    @with_lock
+    def get_tip_dgw_window_json(self) -> Optional[dict]:
+        tip = self.height()
+        window = self._tip_dgw_window
+        if window is None or window.tip != tip:
+            window = DGWWindow()
+            for height in range(tip - DGW_PASTBLOCKS + 1, tip + 1):
+                header = self.read_header(height)
+                if header is None:
+                    return None
+                window.push(header)
+        return window.to_json()
+
+    @with_lock
+    def set_tip_dgw_window(self, window: Optional['DGWWindow']) -> None:
+        if window is not None and not window.is_ready_for(self.height() + 1):
+            window = None
+        self._tip_dgw_window = window
+
+    @with_lock
+    def _get_tip_dgw_window(self, height: int) -> Optional['DGWWindow']:
+        window = self._tip_dgw_window
+        if window is None or not window.is_ready_for(height):
+            return None
+        return window.copy()
+
+    def get_header_hash(self, header: dict) -> str:
+        """Returns hash_header(header), from the hash index
+        if header is the one we store at its height.
+        """
+        height = header['block_height']
+        header_hash = self.read_cached_hash(height)
+        if header_hash is not None:
+            with self.lock:
+                raw = self.read_raw_header(height)
+                if raw is not None and bfh(serialize_header(header))[:len(raw)] == raw:
+                    return header_hash
+        return hash_header(header)
 
     @classmethod
-    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
-        _hash = hash_header(header)
+    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None,
+                      *, header_hash: str = None) -> None:
+        # header_hash can be passed in if it was already computed, e.g. by hash_chunk_headers
+        _hash = header_hash if header_hash is not None else hash_header(header)
         if expected_header_hash and expected_header_hash != _hash:
             raise InvalidHeader("hash mismatches with expected: {} vs {}".format(expected_header_hash, _hash))
         if prev_hash != header.get('prev_block_hash'):
@@ -381,25 +879,23 @@ class Blockchain(Logger):
         if block_hash_as_num > target:
             raise InvalidHeader(f"insufficient proof of work: {block_hash_as_num} vs target {target}")
 
-    def verify_chunk(self, start_height: int, data: bytes) -> None:
-        raw = []
-        p = 0
+    def verify_chunk(self, start_height: int, data: bytes, header_hashes: Sequence[str] = None) -> None:
+        """Verifies linkage, targets and checkpoints of the headers in chunk.
+        header_hashes, if given, are the already computed block hashes of the headers
+        (see hash_chunk_headers). Otherwise, they are computed here.
+        """
+        raw_headers = split_chunk(start_height, data)
+        if header_hashes is not None and len(header_hashes) != len(raw_headers):
+            raise Exception(f'expected {len(raw_headers)} header hashes, got {len(header_hashes)}')
         s = start_height
         prev_hash = self.get_hash(start_height - 1)
         headers = {}
-        while p < len(data):
-            if s < constants.net.KawpowActivationHeight:
-                raw = data[p:p + LEGACY_HEADER_SIZE]
-                p += LEGACY_HEADER_SIZE
-            else:
-                raw = data[p:p + HEADER_SIZE]
-                p += HEADER_SIZE
+        dgw_window = DGWWindow()
+        for i, raw in enumerate(raw_headers):
             try:
                 expected_header_hash = self.get_hash(s)
             except MissingHeader:
                 expected_header_hash = None
-            if len(raw) not in (LEGACY_HEADER_SIZE, HEADER_SIZE):
-                raise Exception('Invalid header length: {}'.format(len(raw)))
             header = deserialize_header(raw, s)
             headers[header.get('block_height')] = header
             
@@ -408,15 +904,17 @@ class Blockchain(Logger):
             target = 0
             if constants.net.DGW_CHECKPOINTS_START <= s <= constants.net.max_checkpoint():
                 if self.is_dgw_height_checkpoint(s) is not None:
-                    target = self.get_target(s, headers)
+                    target = self.get_target(s, headers, dgw_window)
                 else:
                     # Just use the headers own bits for the logic
                     target = self.bits_to_target(header['bits'])
             else:
-                target = self.get_target(s, headers)
+                target = self.get_target(s, headers, dgw_window)
             
-            self.verify_header(header, prev_hash, target, expected_header_hash)
-            prev_hash = hash_header(header)
+            header_hash = header_hashes[i] if header_hashes is not None else hash_header(header)
+            self.verify_header(header, prev_hash, target, expected_header_hash, header_hash=header_hash)
+            dgw_window.push(header)
+            prev_hash = header_hash
             s += 1
 
         # DGW must be received in correct chunk sizes to be valid with our checkpoints
@@ -428,7 +926,7 @@ class Blockchain(Logger):
     def path(self):
         d = util.get_headers_dir(self.config)
         if self.parent is None:
-            filename = 'blockchain_headers'
+            filename = 'blockchain_headers_v2'
         else:
             assert self.forkpoint > 0, self.forkpoint
             prev_hash = self._prev_hash.lstrip('0')
@@ -438,43 +936,29 @@ class Blockchain(Logger):
         return os.path.join(d, filename)
 
     @with_lock
-    def save_chunk(self, start_height: int, chunk: bytes):
+    def save_chunk(self, start_height: int, chunk: bytes, header_hashes: Sequence[str] = None):
         assert start_height >= 0, start_height
         chunk_within_checkpoint_region = start_height <= constants.net.max_checkpoint()
         # chunks in checkpoint region are the responsibility of the 'main chain'
         if chunk_within_checkpoint_region and self.parent is not None:
             main_chain = get_best_chain()
-            main_chain.save_chunk(start_height, chunk)
+            main_chain.save_chunk(start_height, chunk, header_hashes)
             return
 
-        delta_height = (start_height - self.forkpoint)
-        delta_bytes = delta_height * HEADER_SIZE
+        # chunks are sent in the v2 layout: legacy headers are not padded
+        delta_bytes = self._offset(start_height)
         # if this chunk contains our forkpoint, only save the part after forkpoint
         # (the part before is the responsibility of the parent)
         if delta_bytes < 0:
             chunk = chunk[-delta_bytes:]
+            if header_hashes is not None:
+                header_hashes = header_hashes[self.forkpoint - start_height:]
+            start_height = self.forkpoint
             delta_bytes = 0
         truncate = not chunk_within_checkpoint_region
-
-        def convert_to_kawpow_len():
-            r = b''
-            p = 0
-            s = start_height
-            while p < len(chunk):
-                if s < constants.net.KawpowActivationHeight:
-                    r += chunk[p:p + LEGACY_HEADER_SIZE] + bytes(40)
-                    p += LEGACY_HEADER_SIZE
-                else:
-                    r += chunk[p:p + HEADER_SIZE]
-                    p += HEADER_SIZE
-                s += 1
-            if len(r) % HEADER_SIZE != 0:
-                raise Exception('Header extension error')
-            return r
-
-        chunk = convert_to_kawpow_len()
-        self.write(chunk, delta_bytes, truncate)
-        assert self.read_header(start_height) == deserialize_header(chunk[:120], start_height)
+        hashes = b''.join(map(bfh, header_hashes)) if header_hashes is not None else None
+        self.write(chunk, delta_bytes, truncate, hashes=hashes)
+        assert self.read_header(start_height) == deserialize_header(chunk[:header_record_size(start_height)], start_height)
         self.swap_with_parent()
 
     def swap_with_parent(self) -> None:
@@ -520,17 +1004,22 @@ class Blockchain(Logger):
         assert forkpoint > parent.forkpoint, (f"forkpoint of parent chain ({parent.forkpoint}) "
                                               f"should be at lower height than children's ({forkpoint})")
         with open(parent.path(), 'rb') as f:
-            f.seek((forkpoint - parent.forkpoint)*HEADER_SIZE)
-            parent_data = f.read(parent_branch_size*HEADER_SIZE)
-        self.write(parent_data, 0)
-        parent.write(my_data, (forkpoint - parent.forkpoint)*HEADER_SIZE)
+            f.seek(parent._offset(forkpoint))
+            parent_data = f.read(parent._offset(forkpoint + parent_branch_size) - parent._offset(forkpoint))
+        my_hashes = self._read_hashes(forkpoint, self.size())
+        parent_hashes = parent._read_hashes(forkpoint, parent_branch_size)
+        self.write(parent_data, 0, hashes=parent_hashes)
+        parent.write(my_data, parent._offset(forkpoint), hashes=my_hashes)
         # swap parameters
         self.parent, parent.parent = parent.parent, self  # type: Tuple[Optional[Blockchain], Optional[Blockchain]]
         self.forkpoint, parent.forkpoint = parent.forkpoint, self.forkpoint
-        self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_header(deserialize_header(parent_data[:HEADER_SIZE], forkpoint))
+        self._forkpoint_hash, parent._forkpoint_hash = parent._forkpoint_hash, hash_header(deserialize_header(parent_data[:header_record_size(forkpoint)], forkpoint))
         self._prev_hash, parent._prev_hash = parent._prev_hash, self._prev_hash
         # parent's new name
+        self.close_mmap()
+        parent.close_mmap()
         os.replace(child_old_name, parent.path())
+        os.replace(child_old_name + HASHES_FILE_SUFFIX, parent.hashes_path())
         self.update_size()
         parent.update_size()
         # update pointers
@@ -552,46 +1041,81 @@ class Blockchain(Logger):
             raise FileNotFoundError('Cannot find headers file but headers_dir is there. Should be at {}'.format(path))
 
     @with_lock
-    def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
+    def write(self, data: bytes, offset: int, truncate: bool=True, *, hashes: bytes = None) -> None:
+        """Writes headers data at offset in our headers file, and their hashes,
+        if given, in the hash index. Unknown hashes are written as zeroes.
+        """
         filename = self.path()
         self.assert_headers_file_available(filename)
+        base = header_offset(self.forkpoint)
+        start_height = height_at_offset(base + offset)
+        num_headers = height_at_offset(base + offset + len(data)) - start_height
+        if hashes is None:
+            hashes = bytes(num_headers * HASH_SIZE)
+        assert len(hashes) == num_headers * HASH_SIZE, (len(hashes), num_headers)
+        self._tip_dgw_window = None
+        self._flush_pending_hashes()
+        # we must not truncate a file that is still mapped (not allowed on Windows)
+        self.close_mmap()
+        if start_height < self.forkpoint + self._size:
+            # headers get replaced: forget their hashes first, in case we crash in between
+            self._write_hashes(start_height, bytes(num_headers * HASH_SIZE), truncate)
         with open(filename, 'rb+') as f:
-            if truncate and offset != self._size * HEADER_SIZE:
+            if truncate and offset != self._offset(self.forkpoint + self._size):
                 f.seek(offset)
                 f.truncate()
             f.seek(offset)
             f.write(data)
             f.flush()
             os.fsync(f.fileno())
+        self._write_hashes(start_height, hashes, truncate)
         self.update_size()
 
     @with_lock
-    def save_header(self, header: dict) -> None:
-        delta = header.get('block_height') - self.forkpoint
-        data = bfh(serialize_header(header))
+    def save_header(self, header: dict, *, header_hash: str = None) -> None:
+        height = header.get('block_height')
+        delta = height - self.forkpoint
+        data = bfh(serialize_header(header))[:header_record_size(height)]
         # headers are only _appended_ to the end:
         assert delta == self.size(), (delta, self.size())
-        assert len(data) == HEADER_SIZE
-        self.write(data, delta*HEADER_SIZE)
+        if header_hash is None:
+            header_hash = hash_header(header)
+        window = self._tip_dgw_window
+        self.write(data, self._offset(height), hashes=bfh(header_hash))
+        if window is not None and window.is_ready_for(height):
+            window.push(header)
+            self._tip_dgw_window = window
         self.swap_with_parent()
 
     @with_lock
-    def read_header(self, height: int) -> Optional[dict]:
+    def read_raw_header(self, height: int) -> Optional[memoryview]:
+        """Returns the serialized header at height, as stored on disk
+        (LEGACY_HEADER_SIZE bytes before KAWPOW activation, HEADER_SIZE after).
+        The result is a view into the memory-mapped headers file; no copy is made.
+        Callers should not hold on to it, as it is only valid until the next write.
+        """
         if height < 0:
             return
         if height < self.forkpoint:
-            return self.parent.read_header(height)
+            return self.parent.read_raw_header(height)
         if height > self.height():
             return
-        delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
-        if h == bytes([0])*HEADER_SIZE:
+        size = header_record_size(height)
+        offset = self._offset(height)
+        h = memoryview(self._get_mmap())[offset:offset + size]
+        if len(h) < size:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        if not any(h):
+            return None
+        return h
+
+    @with_lock
+    def read_header(self, height: int) -> Optional[dict]:
+        if 0 <= height < self.forkpoint:
+            # deserialize while holding the lock of the chain that owns the mapping
+            return self.parent.read_header(height)
+        h = self.read_raw_header(height)
+        if h is None:
             return None
         return deserialize_header(h, height)
 
@@ -651,12 +1175,17 @@ class Blockchain(Logger):
             h, t = self.checkpoints[index][dgw_height_checkpoint]
             return h
         else:
+            header_hash = self.read_cached_hash(height)
+            if header_hash is not None:
+                return header_hash
             header = self.read_header(height)
             if header is None:
                 raise MissingHeader(height)
-            return hash_header(header)
+            header_hash = hash_header(header)
+            self._remember_hash(height, header_hash)
+            return header_hash
 
-    def get_target(self, height: int, chain=None) -> int:         
+    def get_target(self, height: int, chain=None, dgw_window: 'DGWWindow' = None) -> int:
         dgw_height_checkpoint = self.is_dgw_height_checkpoint(height)
 
         if constants.net.TESTNET:
@@ -686,9 +1215,10 @@ class Blockchain(Logger):
         else:
             # Now we no longer have cached checkpoints and need to compute our own DWG targets to verify
             # a header
-            return self.get_target_dgwv3(height, chain)
+            return self.get_target_dgwv3(height, chain, dgw_window)
 
-    def convbignum(self, bits):
+    @staticmethod
+    def convbignum(bits):
         MM = 256 * 256 * 256
         a = bits % MM
         if a < 0x8000:
@@ -696,7 +1226,7 @@ class Blockchain(Logger):
         target = a * pow(2, 8 * (bits // MM - 3))
         return target
 
-    def get_target_dgwv3(self, height, chain=None) -> int:
+    def get_target_dgwv3(self, height, chain=None, dgw_window: 'DGWWindow' = None) -> int:
 
         def get_block_reading_from_height(height):
             last = None
@@ -710,6 +1240,18 @@ class Blockchain(Logger):
                 raise NotEnoughHeaders()
             return last
 
+        if dgw_window is not None:
+            if not dgw_window.is_ready_for(height):
+                dgw_window.clear()
+                for h in range(height - DGW_PASTBLOCKS, height):
+                    dgw_window.push(get_block_reading_from_height(h))
+            target = dgw_window.get_target()
+            if self.config.BLOCKCHAIN_DGW_SELF_CHECK:
+                expected = self.get_target_dgwv3(height, chain)
+                if target != expected:
+                    raise Exception(f'DGW window mismatch at height {height}: {target} vs {expected}')
+            return target
+
         # params
         BlockReading = get_block_reading_from_height(height - 1)
         nActualTimespan = 0
@@ -843,7 +1385,7 @@ class Blockchain(Logger):
             return False
         headers = {header.get('block_height'): header}
         try:
-            target = self.get_target(height, headers)
+            target = self.get_target(height, headers, self._get_tip_dgw_window(height))
         except MissingHeader:
             return False
         try:
@@ -852,13 +1394,20 @@ class Blockchain(Logger):
             return False
         return True
 
+    def _verify_and_save_chunk(self, start_height: int, data: bytes, header_hashes: Sequence[str]) -> None:
+        # chunks used to be connected one at a time on the event loop; keep it that way
+        with _connect_chunk_lock:
+            # This is computationally intensive (thanks DGW)
+            self.verify_chunk(start_height, data, header_hashes)
+            self.save_chunk(start_height, data, header_hashes)
+
     async def connect_chunk(self, start_height: int, hexdata: str) -> bool:
         assert start_height >= 0, start_height
         try:
             data = bfh(hexdata)
-            # This is computationally intensive (thanks DGW)
-            self.verify_chunk(start_height, data)
-            self.save_chunk(start_height, data)
+            # proof-of-work in parallel, then the serial checks, both off the event loop
+            header_hashes = await hash_chunk_headers(self.config, start_height, data)
+            await run_in_thread(self._verify_and_save_chunk, start_height, data, header_hashes)
             return True
         except BaseException as e:
             self.logger.info(f'verify_chunk from height {start_height} failed: {repr(e)}')
@@ -875,6 +1424,83 @@ class Blockchain(Logger):
         return cp
 
 
+class DGWWindow:
+    """Rolling window over the bits and timestamps of the last DGW_PASTBLOCKS
+    consecutive headers, so that DGWv3 targets for consecutive heights
+    can be computed without walking back over the past headers each time.
+    """
+
+    def __init__(self):
+        self._targets = deque(maxlen=DGW_PASTBLOCKS)  # oldest first
+        self._timestamps = deque(maxlen=DGW_PASTBLOCKS)
+        self.tip = None  # type: Optional[int]
+
+    def clear(self) -> None:
+        self._targets.clear()
+        self._timestamps.clear()
+        self.tip = None
+
+    def copy(self) -> 'DGWWindow':
+        window = DGWWindow()
+        window._targets.extend(self._targets)
+        window._timestamps.extend(self._timestamps)
+        window.tip = self.tip
+        return window
+
+    def to_json(self) -> dict:
+        return {
+            'tip': self.tip,
+            'targets': list(self._targets),
+            'timestamps': list(self._timestamps),
+        }
+
+    @classmethod
+    def from_json(cls, d: dict) -> 'DGWWindow':
+        window = DGWWindow()
+        window._targets.extend(d['targets'])
+        window._timestamps.extend(d['timestamps'])
+        window.tip = d['tip']
+        return window
+
+    def push(self, header: dict) -> None:
+        height = header['block_height']
+        if self.tip is not None and height != self.tip + 1:
+            self.clear()
+        self._targets.append(Blockchain.convbignum(header['bits']))
+        self._timestamps.append(header['timestamp'])
+        self.tip = height
+
+    def is_ready_for(self, height: int) -> bool:
+        return self.tip == height - 1 and len(self._targets) == DGW_PASTBLOCKS
+
+    def get_target(self) -> int:
+        """Returns the DGWv3 target for the header following the window.
+        Same result as Blockchain.get_target_dgwv3.
+        """
+        assert len(self._targets) == DGW_PASTBLOCKS, len(self._targets)
+        # The timestamp deltas telescope to the span of the window.
+        nActualTimespan = self._timestamps[-1] - self._timestamps[0]
+        # The average is a running average with integer division at each step,
+        # newest block first, so it has to be redone over the window.
+        targets = reversed(self._targets)
+        PastDifficultyAverage = next(targets)
+        for CountBlocks, bnNum in enumerate(targets, start=2):
+            PastDifficultyAverage = ((PastDifficultyAverage * CountBlocks) + bnNum) // (CountBlocks + 1)
+
+        bnNew = PastDifficultyAverage
+        nTargetTimespan = DGW_PASTBLOCKS * 60  # 1 min
+
+        nActualTimespan = max(nActualTimespan, nTargetTimespan // 3)
+        nActualTimespan = min(nActualTimespan, nTargetTimespan * 3)
+
+        # retarget
+        bnNew *= nActualTimespan
+        bnNew //= nTargetTimespan
+        bnNew = min(bnNew, MAX_TARGET)
+
+        return bnNew
+
+
 def check_header(header: dict) -> Optional[Blockchain]:
     """Returns any Blockchain that contains header, or None."""
     if type(header) is not dict:
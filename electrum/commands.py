@@ -224,6 +224,12 @@ class Commands:
             'default_wallet': self.config.get_wallet_path(),
             'fee_per_kb': self.config.fee_per_kb(),
         }
+        if self.network.interface:
+            response['requests'] = self.network.interface.request_limiter.get_stats()
+        if self.daemon:
+            stats = [w.db.tx_cache.get_stats() for w in self.daemon.get_wallets().values()]
+            response['tx_cache'] = {k: sum(s[k] for s in stats)
+                                    for k in ('hits', 'misses', 'entries', 'size_bytes')}
         return response
 
     @command('n')
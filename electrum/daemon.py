@@ -542,6 +542,8 @@ class Daemon(Logger):
         self.stop_wallet(path)
         if os.path.exists(path):
             os.unlink(path)
+            if os.path.exists(path + '.sqlite'):
+                os.unlink(path + '.sqlite')
             return True
         return False
 
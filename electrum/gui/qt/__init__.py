@@ -466,7 +466,8 @@ class ElectrumGui(BaseElectrumGui, Logger):
             return
         # start wizard to select/create wallet
         self.timer.start()
-        IPFSDB.initialize(self.config.get_ipfs_data_path(), self.config.get_ipfs_raw_path())
+        IPFSDB.initialize(self.config.get_ipfs_data_path(), self.config.get_ipfs_raw_path(),
+                          self.config.MAX_IPFS_CACHE_SIZE)
         IPFSDB.get_instance().purge_stale_ipfs_data()
         path = self.config.get_wallet_path(use_gui_last_wallet=True)
         try:
@@ -1,5 +1,5 @@
 import enum
-from typing import Optional, TYPE_CHECKING, Tuple
+from typing import Optional, TYPE_CHECKING, Tuple, Dict
 
 from PyQt5.QtGui import QFont, QStandardItemModel, QStandardItem, QFontMetrics
 from PyQt5.QtCore import pyqtSignal, Qt, QItemSelectionModel
@@ -23,7 +23,7 @@ from electrum.util import format_satoshis_plain, profiler, SearchableListGroupin
 from electrum.address_synchronizer import METADATA_UNCONFIRMED, METADATA_UNVERIFIED
 from electrum.logging import Logger
 
-from .util import HelpLabel, ColorScheme, HelpButton, AutoResizingTextEdit
+from .util import HelpLabel, ColorScheme, HelpButton, AutoResizingTextEdit, QtEventListener, qt_event_listener
 from .util import QHSeperationLine, read_QIcon, MONOSPACE_FONT, IPFSViewer, EnterButton
 from .my_treeview import MyTreeView
 from .asset_qualifier_tag_panel import TaggedAddressList, AssociatedRestrictedAssetList
@@ -34,7 +34,7 @@ if TYPE_CHECKING:
     from .asset_tab import AssetTab
 
 
-class AssetList(MyTreeView):
+class AssetList(MyTreeView, QtEventListener):
     class Columns(MyTreeView.BaseColumnsEnum):
         ASSET = enum.auto()
         BALANCE = enum.auto()
@@ -59,8 +59,11 @@ class AssetList(MyTreeView):
         self.setModel(self.std_model)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setSortingEnabled(True)
+        self.update_headers(self.__class__.headers)
+        self.sortByColumn(self.Columns.ASSET, Qt.AscendingOrder)
         self.last_selected_asset = None
-        self.current_assets = []
+        # asset -> (balance, (sats in circulation, metadata kind) or None)
+        self.current_assets = {}  # type: Dict[str, Tuple[int, Optional[Tuple[int, int]]]]
 
         def selectionChange(new, old):
             rows = [x.row() for x in new.indexes()]
@@ -76,6 +79,7 @@ class AssetList(MyTreeView):
             self.parent.update_asset_trigger.emit(asset)
 
         self.selectionModel().selectionChanged.connect(selectionChange)
+        self.register_callbacks()
 
     def select_asset(self, asset: str):
         for i in range(self.model().rowCount()):
@@ -91,72 +95,96 @@ class AssetList(MyTreeView):
             QItemSelectionModel.Rows | QItemSelectionModel.SelectCurrent,
         )
 
+    def _get_metadata_data(self, asset: str) -> Optional[Tuple[int, int]]:
+        metadata = self.wallet.adb.get_asset_metadata(asset)
+        if metadata is None:
+            return None
+        return metadata[0].sats_in_circulation, metadata[1]
+
     @profiler(min_threshold=0.05)
     def update(self):
         # not calling maybe_defer_update() as it interferes with coincontrol status bar
-        watching_assets = [
-            asset
+        new_assets = {
+            asset: (sum(balance), self._get_metadata_data(asset))
             for asset, balance in self.wallet.get_balance(asset_aware=True).items()
             if asset
             and sum(balance) > 0
             and not self.wallet.is_asset_in_blacklist(asset)
-        ]
-        new_assets = sorted(
-            [
-                (
-                    asset,
-                    (
-                        (metadata[0].sats_in_circulation, metadata[1])
-                        if (
-                            (metadata := self.wallet.adb.get_asset_metadata(asset))
-                            is not None
-                        )
-                        else None
-                    ),
-                )
-                for asset in watching_assets
-            ],
-            key=lambda x: x[0],
-        )
+        }
         if self.current_assets == new_assets:
             return
         self.parent.logger.info("refreshing asset view")
-        self.model().clear()
-        self.update_headers(self.__class__.headers)
-        for idx, (asset, data) in enumerate(new_assets):
-            labels = [""] * len(self.Columns)
-            labels[self.Columns.ASSET] = asset
-            if self.wallet.do_we_own_this_asset(asset):
-                amount = sum(self.wallet.get_balance(asset_aware=True)[asset])
-                labels[self.Columns.BALANCE] = self.main_window.config.format_amount(
-                    amount, whitespaces=True, precision=8
-                )
-            asset_item = [QStandardItem(x) for x in labels]
-            if not self.wallet.do_we_own_this_asset(asset):
-                asset_item[self.Columns.BALANCE] = QStandardItem(
-                    read_QIcon("eye1.png"), labels[self.Columns.BALANCE]
-                )
-            self.set_editability(asset_item)
-            asset_item[self.Columns.ASSET].setData(asset, self.ROLE_ASSET_STR)
-            asset_item[self.Columns.ASSET].setFont(QFont(MONOSPACE_FONT))
-            asset_item[self.Columns.BALANCE].setFont(QFont(MONOSPACE_FONT))
-            self.model().insertRow(idx, asset_item)
-            self.refresh_row(asset, data, idx)
-            if asset == self.last_selected_asset:
+        # update rows in place, by asset, so that a new tx does not rebuild the whole list
+        removed_rows = [
+            row
+            for row in range(self.std_model.rowCount())
+            if self.std_model.item(row, self.Columns.ASSET).data(self.ROLE_ASSET_STR)
+            not in new_assets
+        ]
+        for row in reversed(removed_rows):
+            self.std_model.removeRow(row)
+        rows = {
+            self.std_model.item(row, self.Columns.ASSET).data(self.ROLE_ASSET_STR): row
+            for row in range(self.std_model.rowCount())
+        }
+        old_assets = self.current_assets
+        self.current_assets = new_assets
+        inserted = False
+        for asset, (amount, data) in sorted(new_assets.items()):
+            if old_assets.get(asset) == (amount, data):
+                continue
+            row = rows.get(asset)
+            is_new_row = row is None
+            if is_new_row:
+                row = self.std_model.rowCount()
+                labels = [""] * len(self.Columns)
+                labels[self.Columns.ASSET] = asset
+                asset_item = [QStandardItem(x) for x in labels]
+                self.set_editability(asset_item)
+                asset_item[self.Columns.ASSET].setData(asset, self.ROLE_ASSET_STR)
+                asset_item[self.Columns.ASSET].setFont(QFont(MONOSPACE_FONT))
+                asset_item[self.Columns.BALANCE].setFont(QFont(MONOSPACE_FONT))
+                self.std_model.insertRow(row, asset_item)
+                inserted = True
+            self.std_model.item(row, self.Columns.BALANCE).setText(
+                self.main_window.config.format_amount(amount, whitespaces=True, precision=8)
+            )
+            self.refresh_row(asset, row)
+            if is_new_row and asset == self.last_selected_asset:
                 self.selectionModel().select(
-                    self.model().createIndex(idx, 0),
+                    self.model().createIndex(row, 0),
                     QItemSelectionModel.Rows | QItemSelectionModel.SelectCurrent,
                 )
-        self.current_assets = new_assets
+        if inserted:
+            self.std_model.sort(self.header().sortIndicatorSection(), self.header().sortIndicatorOrder())
         self.filter()
 
-    def refresh_row(self, key, data, row):
+    @qt_event_listener
+    def on_event_adb_added_verified_asset_metadata(self, adb, asset):
+        self._on_asset_metadata_changed(adb, asset)
+
+    @qt_event_listener
+    def on_event_adb_added_unconfirmed_asset_metadata(self, adb, asset):
+        self._on_asset_metadata_changed(adb, asset)
+
+    def _on_asset_metadata_changed(self, adb, asset: str):
+        if adb != self.wallet.adb or asset not in self.current_assets:
+            return
+        amount, data = self.current_assets[asset]
+        new_data = self._get_metadata_data(asset)
+        if new_data == data:
+            return
+        self.current_assets[asset] = amount, new_data
+        self.refresh_item(asset)
+
+    def refresh_row(self, key, row):
         assert row is not None
         asset_item = [self.std_model.item(row, col) for col in self.Columns]
 
         color = self._default_bg_brush
 
         tooltip = ""
+        data = self.current_assets[key][1]
         if data is None:
             tooltip = _("No asset metadata avaliable")
             color = ColorScheme.RED.as_color(True)
@@ -167,13 +195,9 @@ class AssetList(MyTreeView):
             elif kind == METADATA_UNVERIFIED:
                 tooltip = _("(this metadata was not able to be verified)")
 
-        if not self.wallet.do_we_own_this_asset(key):
-            tooltip += " " + _("(This is a watch-only asset)")
-
         for col in asset_item:
             col.setBackground(color)
-            if tooltip:
-                col.setToolTip(tooltip)
+            col.setToolTip(tooltip)
 
     def create_menu(self, position):
         selected = self.selected_in_column(self.Columns.ASSET)
@@ -3,7 +3,6 @@
 # file LICENCE or http://www.opensource.org/licenses/mit-license.php
 
 import os
-import json
 import sys
 import threading
 import traceback
@@ -30,6 +29,7 @@ from PyQt5.QtWidgets import (
 
 from electrum.wallet import Wallet, Abstract_Wallet
 from electrum.storage import WalletStorage, StorageReadWriteError
+from electrum.json_db import loads_journaled
 from electrum.util import (
     UserCancelled,
     InvalidPassword,
@@ -491,7 +491,7 @@ class InstallWizard(QDialog, MessageBoxMixin, BaseWizard):
                     self.show_warning(_("The file was removed"))
                 return
             self.show()
-            self.data = json.loads(storage.read())
+            self.data = loads_journaled(storage.read())[0]
             self.run(action)
             for k, v in self.data.items():
                 db.put(k, v)
@@ -1031,6 +1031,10 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger, QtEventListener):
                 num_sent, num_answered = self.wallet.adb.get_history_sync_state_details()
                 network_text = ("{} ({}/{})"
                                 .format(_("Synchronizing..."), num_answered, num_sent))
+                progress = self.wallet.adb.get_verification_progress()
+                if progress and progress['pending']:
+                    network_text += " " + _("verifying {} txs ({:.0f}/s)").format(
+                        progress['pending'], progress['per_second'])
                 icon = read_QIcon("status_waiting.png")
             elif server_lag > 1:
                 network_text = _("Server is lagging ({} blocks)").format(server_lag)
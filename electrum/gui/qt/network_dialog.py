@@ -304,6 +304,12 @@ class NetworkChoiceLayout(object):
         self.split_label = QLabel('')
         grid.addWidget(self.split_label, 4, 0, 1, 3)
 
+        self.requests_label = QLabel('')
+        msg = _('Requests in flight to your server are limited to a window that adapts to the round-trip times of its answers.')
+        grid.addWidget(QLabel(_('Requests') + ':'), 5, 0)
+        grid.addWidget(self.requests_label, 5, 1, 1, 3)
+        grid.addWidget(HelpButton(msg), 5, 4)
+
         self.nodes_list_widget = NodesListWidget(self)
         grid.addWidget(self.nodes_list_widget, 6, 0, 1, 5)
 
@@ -360,6 +366,14 @@ class NetworkChoiceLayout(object):
         else:
             msg = ''
         self.split_label.setText(msg)
+        interface = self.network.interface
+        if interface:
+            stats = interface.request_limiter.get_stats()
+            rtt = stats['rtt_ms']
+            self.requests_label.setText(
+                _('window {}, RTT p50/p90/p99: {}/{}/{} ms').format(stats['window'], rtt['p50'], rtt['p90'], rtt['p99']))
+        else:
+            self.requests_label.setText('')
         self.nodes_list_widget.update(network=self.network,
                                       servers=self.network.get_servers(),
                                       use_tor=self.tor_cb.isChecked())
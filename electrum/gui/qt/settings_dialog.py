@@ -440,6 +440,14 @@ class SettingsDialog(QDialog, QtEventListener):
             self.config.MAX_IPFS_DOWNLOAD_SIZE = value * byte_scale
         ipfs_cache.valueChanged.connect(on_ipfs_cache)
 
+        ipfs_cache_budget_help = _('IPFS data saved to disk is kept up to this total size. Above it, the least recently viewed data is deleted first.')
+        ipfs_cache_budget_label = HelpLabel(_('IPFS Cache Size (MB)') + ':', ipfs_cache_budget_help)
+        ipfs_cache_budget = QSpinBox()
+        ipfs_cache_budget.setMinimum(0)
+        ipfs_cache_budget.setMaximum(100_000)  # 100GB
+        ipfs_cache_budget.setSpecialValueText(_('Unlimited'))
+        ipfs_cache_budget.setValue(self.config.MAX_IPFS_CACHE_SIZE // byte_scale)
+
         clear_cache_help = _('If view IPFS is enabled, some IPFS data is saved to disk. Click this button to delete all cached data.')
         clear_cache_label = HelpLabel(_('Cache') + f' ({human_readable_size(IPFSDB.get_instance().get_total_bytes_on_disk())})', clear_cache_help)
         clear_cache_button = QPushButton(_('Clear Cache'))
@@ -449,6 +457,14 @@ class SettingsDialog(QDialog, QtEventListener):
             clear_cache_label.setText(_('Cache') + f' ({human_readable_size(IPFSDB.get_instance().get_total_bytes_on_disk())})')
         clear_cache_button.pressed.connect(on_cache_clear_pressed)
 
+        def on_ipfs_cache_budget():
+            # on editingFinished, so that we do not evict while the value is being typed
+            value = ipfs_cache_budget.value()
+            self.config.MAX_IPFS_CACHE_SIZE = value * byte_scale
+            IPFSDB.get_instance().blob_store.set_max_size(value * byte_scale)
+            clear_cache_label.setText(_('Cache') + f' ({human_readable_size(IPFSDB.get_instance().get_total_bytes_on_disk())})')
+        ipfs_cache_budget.editingFinished.connect(on_ipfs_cache_budget)
+
         ipfs_timeout_help = _('How long to wait per endpoint when trying to download ipfs data.')
         ipfs_timeout_label = HelpLabel(_('IPFS Maximum Wait (Seconds)') + ':', ipfs_timeout_help)
         ipfs_timeout = QSpinBox()
@@ -493,6 +509,7 @@ class SettingsDialog(QDialog, QtEventListener):
         ipfs_widgets = []
         ipfs_widgets.append((ipfs_cache_label, ipfs_cache))
         ipfs_widgets.append((ipfs_timeout_label, ipfs_timeout))
+        ipfs_widgets.append((ipfs_cache_budget_label, ipfs_cache_budget))
         ipfs_widgets.append((clear_cache_label, clear_cache_button))
 
         tabs_info = [
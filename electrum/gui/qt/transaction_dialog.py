@@ -343,6 +343,9 @@ class TxInOutWidget(QWidget):
             addr = self.wallet.adb.get_txin_address(txin)
             txin_value = self.wallet.adb.get_txin_value(txin)
             txin_script = self.wallet.adb.get_txin_scriptpubkey(txin)
+            txin_asset_info = self.wallet.db.get_txo_asset_info(txin.prevout.txid.hex(), txin.prevout.out_idx)
+            if txin_asset_info is None and txin_script:
+                txin_asset_info = get_asset_info_from_script(txin_script)
             tcf_shortid = QTextCharFormat(lnk)
             tcf_shortid.setAnchorHref(txin.prevout.txid.hex())
             insert_tx_io(
@@ -350,7 +353,7 @@ class TxInOutWidget(QWidget):
                 tcf_shortid=tcf_shortid,
                 short_id=str(txin.short_id), addr=addr, value=txin_value,
                 script=txin.script_sig if txin.is_coinbase_input() else None,
-                asset_info=get_asset_info_from_script(txin_script) if txin_script else None
+                asset_info=txin_asset_info
             )
 
         self.outputs_header.setText(_("Outputs") + ' (%d)'%len(self.tx.outputs()))
@@ -377,7 +380,7 @@ class TxInOutWidget(QWidget):
                 cursor=cursor, is_coinbase=False, txio_idx=txout_idx,
                 short_id=str(short_id), addr=addr, value=o.value,
                 script=o.scriptpubkey if o.scriptpubkey[0] == opcodes.OP_RETURN else None,
-                asset_info=get_asset_info_from_script(o.scriptpubkey)
+                asset_info=o.get_asset_vout_info()
             )
 
         self.txo_color_recv.legend_label.setVisible(tf_used_recv)
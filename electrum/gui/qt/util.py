@@ -37,7 +37,7 @@ from electrum.util import EventListener, event_listener, get_asyncio_loop
 from electrum.invoices import PR_UNPAID, PR_PAID, PR_EXPIRED, PR_INFLIGHT, PR_UNKNOWN, PR_FAILED, PR_ROUTING, PR_UNCONFIRMED, PR_BROADCASTING, PR_BROADCAST
 from electrum.logging import Logger
 from electrum.qrreader import MissingQrDetectionLib
-from electrum.ipfs_db import IPFSDB
+from electrum.ipfs_db import IPFSDB, IPFSPrefetchScheduler
 from electrum.bitcoin import base_encode
 from electrum.boolean_ast_tree import AbstractBooleanASTNode
 
@@ -1708,7 +1708,8 @@ class IPFSViewer(QWidget, QtEventListener):
                         async def download_all_ipfs_data():
                             # Ensure data tries to download even if we have the info
                             await IPFSDB.get_instance().maybe_download_data_for_ipfs_hash(self.window.network, ipfs_str)
-                            await IPFSDB.get_instance().maybe_get_info_for_ipfs_hash(self.window.network, ipfs_str, asset)
+                            await IPFSDB.get_instance().maybe_get_info_for_ipfs_hash(
+                                self.window.network, ipfs_str, asset, priority=IPFSPrefetchScheduler.PRIORITY_VISIBLE)
 
                         self.window.network.run_from_another_thread(download_all_ipfs_data())
                         #self.window.run_coroutine_from_thread(download_all_ipfs_data(), ipfs_str)
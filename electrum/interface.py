@@ -29,8 +29,9 @@ import sys
 import traceback
 import asyncio
 import socket
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict
-from collections import defaultdict
+import time
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Set, NamedTuple, Any, Sequence, Dict, Callable
+from collections import defaultdict, deque, OrderedDict
 from ipaddress import IPv4Network, IPv6Network, ip_address, IPv6Address, IPv4Address
 import itertools
 import logging
@@ -179,6 +180,26 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_request_batch(self, requests: Sequence[Tuple[str, List]], *, timeout=None) -> List:
+        """Sends the requests as a single JSON-RPC batch.
+        Returns the results in order; a request that failed has the
+        RPCError in its place instead.
+        """
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch of {len(requests)} (id: {msg_id}) {requests[0]}...")
+
+        async def send_batch():
+            async with self.send_batch() as batch:
+                for method, params in requests:
+                    batch.add_request(method, params)
+            return batch.results
+        try:
+            results = await util.wait_for2(send_batch(), timeout)
+        except (TaskTimeout, asyncio.TimeoutError) as e:
+            raise RequestTimedOut(f'batch request timed out: {len(requests)} requests (id: {msg_id})') from e
+        self.maybe_log(f"--> batch of {len(results)} (id: {msg_id})")
+        return list(results)
+
     def set_default_timeout(self, timeout):
         self.sent_request_timeout = timeout
         self.max_send_delay = timeout
@@ -195,6 +216,32 @@ class NotificationSession(RPCSession):
             self.cache[key] = result
         await queue.put(params + [result])
 
+    async def subscribe_batch(self, subscriptions: Sequence[Tuple[str, List, asyncio.Queue]]):
+        """Like subscribe, for (method, params, queue) items, with the
+        requests not in the cache sent as a single batch. Errors are
+        raised after all the other results have been put to their queues.
+        """
+        to_request = []
+        for method, params, queue in subscriptions:
+            key = self.get_hashable_key_for_rpc_call(method, params)
+            self.subscriptions[key].append(queue)
+            if key in self.cache:
+                await queue.put(params + [self.cache[key]])
+            else:
+                to_request.append((key, method, params, queue))
+        if not to_request:
+            return
+        results = await self.send_request_batch([(method, params) for _, method, params, _ in to_request])
+        error = None
+        for (key, method, params, queue), result in zip(to_request, results):
+            if isinstance(result, Exception):
+                error = error or result
+                continue
+            self.cache[key] = result
+            await queue.put(params + [result])
+        if error is not None:
+            raise error
+
     def unsubscribe(self, queue):
         """Unsubscribe a callback to free object references to enable GC."""
         # note: we can't unsubscribe from the server, so we keep receiving
@@ -259,6 +306,133 @@ class InvalidOptionCombination(Exception): pass
 class ConnectError(NetworkException): pass
 
 
+class AdaptiveRequestLimiter:
+    """Limits the requests in flight to a server, with a window adapted to
+    the observed round-trip times (AIMD). The window grows by about one
+    request per round trip while RTTs stay close to the recent minimum,
+    and shrinks when they inflate or requests time out. This lets a server
+    on the LAN be saturated while slow links are not overloaded.
+
+    Requests waiting for a slot are served round-robin between owners
+    (network jobs), so that e.g. a large wallet's Synchronizer does not
+    starve the small wallets.
+    """
+    WINDOW_MIN = 4
+    WINDOW_INITIAL = 32
+    RTT_TOLERANCE = 2.0  # RTTs up to this multiple of the minimum count as flat
+    DECREASE_FACTOR = 0.9  # on inflated RTTs
+    TIMEOUT_DECREASE_FACTOR = 0.5
+    NUM_RTT_SAMPLES = 500
+
+    def __init__(self, *, max_window: int):
+        self.max_window = max(max_window, self.WINDOW_MIN)
+        self.window = float(min(self.WINDOW_INITIAL, self.max_window))
+        self.in_flight = 0
+        self.num_timeouts = 0
+        self._waiters = OrderedDict()  # type: OrderedDict[Any, deque[asyncio.Future]]
+        self._rtts = deque(maxlen=self.NUM_RTT_SAMPLES)
+        self._last_decrease = 0.0
+        # called with the RTT of each measured request, or None on timeouts
+        self.on_result = None  # type: Optional[Callable[[Optional[float]], None]]
+
+    def slot(self, owner: Any = None, *, measure_rtt: bool = True) -> '_RequestSlot':
+        """Returns an async context manager holding a slot for one request.
+        The time spent in it is taken as the RTT of the request, unless
+        measure_rtt is False (e.g. for batches, which take longer).
+        """
+        return _RequestSlot(self, owner, measure_rtt=measure_rtt)
+
+    async def acquire(self, owner: Any = None) -> None:
+        if not self._waiters and self.in_flight < int(self.window):
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(owner, deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # we were given the slot, pass it on
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake_up_waiters()
+
+    def _wake_up_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.window):
+            owner, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(owner)
+            else:
+                del self._waiters[owner]
+            if fut.done():  # cancelled
+                continue
+            self.in_flight += 1
+            fut.set_result(None)
+
+    def on_response(self, rtt: float) -> None:
+        if self.on_result:
+            self.on_result(rtt)
+        self._rtts.append(rtt)
+        if rtt <= min(self._rtts) * self.RTT_TOLERANCE:
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self._wake_up_waiters()
+        else:
+            self._decrease(self.DECREASE_FACTOR, rtt)
+
+    def on_timeout(self, elapsed: float) -> None:
+        if self.on_result:
+            self.on_result(None)
+        self.num_timeouts += 1
+        self._decrease(self.TIMEOUT_DECREASE_FACTOR, elapsed)
+
+    def _decrease(self, factor: float, rtt: float) -> None:
+        # at most once per round trip: the requests in flight saw the same congestion
+        now = time.monotonic()
+        if now - self._last_decrease < rtt:
+            return
+        self._last_decrease = now
+        self.window = max(self.WINDOW_MIN, self.window * factor)
+
+    def get_stats(self) -> dict:
+        rtts = sorted(self._rtts)
+
+        def percentile(p):
+            return round(rtts[min(len(rtts) - 1, int(len(rtts) * p))] * 1000) if rtts else None
+        return {
+            'window': int(self.window),
+            'in_flight': self.in_flight,
+            'timeouts': self.num_timeouts,
+            'rtt_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)},
+        }
+
+
+class _RequestSlot:
+
+    def __init__(self, limiter: AdaptiveRequestLimiter, owner: Any, *, measure_rtt: bool):
+        self._limiter = limiter
+        self._owner = owner
+        self._measure_rtt = measure_rtt
+        self._start = None
+
+    async def __aenter__(self):
+        await self._limiter.acquire(self._owner)
+        self._start = time.monotonic()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        elapsed = time.monotonic() - self._start
+        try:
+            if exc_type is None or issubclass(exc_type, CodeMessageError):
+                if self._measure_rtt:
+                    self._limiter.on_response(elapsed)
+            elif issubclass(exc_type, RequestTimedOut):
+                self._limiter.on_timeout(elapsed)
+        finally:
+            self._limiter.release()
+
+
 class _RSClient(RSClient):
     async def create_connection(self):
         try:
@@ -382,6 +556,7 @@ class Interface(Logger):
         self._requested_chunks = set()  # type: Set[int]
         self.network = network
         self.session = None  # type: Optional[NotificationSession]
+        self.request_limiter = AdaptiveRequestLimiter(max_window=network.config.NETWORK_MAX_REQUESTS_IN_FLIGHT)
         self._ipaddr_bucket = None
         # Set up proxy.
         # - for servers running on localhost, the proxy is not used. If user runs their own server
@@ -518,6 +693,9 @@ class Interface(Logger):
             except aiorpcx.jsonrpc.RPCError as e:
                 self.logger.warning(f"disconnecting due to {repr(e)}")
                 self.logger.debug(f"(disconnect) trace for {repr(e)}", exc_info=True)
+            except RequestCorrupted as e:
+                self.network.server_scores.record_ban(self.server)
+                raise
             finally:
                 self.got_disconnected.set()
                 await self.network.connection_down(self)
@@ -643,6 +821,45 @@ class Interface(Logger):
         if can_return_early and ret:
             return
 
+        hexdata, count = await self._fetch_chunk(height, tip)
+        conn = await self.blockchain.connect_chunk(height, hexdata)
+
+        if not conn:
+            return conn, 0
+        return conn, count
+
+    async def request_chunks(self, height: int, tip: int) -> Tuple[bool, int]:
+        """Downloads and connects all chunks from height up to tip.
+        Up to NETWORK_MAX_CHUNKS_IN_FLIGHT requests are kept outstanding, and responses
+        are buffered until all chunks below them have been connected, so verifying a chunk
+        overlaps with downloading the next ones.
+        Returns whether all chunks could be connected, and the number of headers connected.
+        """
+        if not is_non_negative_integer(height):
+            raise Exception(f"{repr(height)} is not a block height")
+        # chunks within DGW checkpoints must start at a 2016 boundary, see request_chunk.
+        # as chunks are consecutive, only the first one needs aligning.
+        if constants.net.DGW_CHECKPOINTS_START <= height <= constants.net.max_checkpoint():
+            height = (height // constants.net.DGW_CHECKPOINTS_SPACING) * constants.net.DGW_CHECKPOINTS_SPACING
+        max_in_flight = max(1, self.network.config.NETWORK_MAX_CHUNKS_IN_FLIGHT)
+        chunk_heights = range(height, tip + 1, 2016)
+        fetches = {}  # type: Dict[int, asyncio.Task]  # start height -> download
+        num_headers = 0
+        async with OldTaskGroup() as group:
+            for i, chunk_height in enumerate(chunk_heights):
+                for h in chunk_heights[i:i + max_in_flight]:
+                    if h not in fetches:
+                        fetches[h] = await group.spawn(self._fetch_chunk(h, tip))
+                hexdata, count = await fetches.pop(chunk_height)
+                conn = await self.blockchain.connect_chunk(chunk_height, hexdata)
+                if not conn:
+                    await group.cancel_remaining()
+                    return False, num_headers
+                num_headers += count
+                util.trigger_callback('network_updated')
+        return True, num_headers
+
+    async def _fetch_chunk(self, height: int, tip=None) -> Tuple[str, int]:
         self.logger.info(f"requesting chunk from height {height}")
         size = 2016
         if tip is not None:
@@ -668,11 +885,7 @@ class Interface(Logger):
             raise RequestCorrupted(f"server uses too low 'max' count for block.headers: {res['max']} < 2016")
         if res['count'] != size:
             raise RequestCorrupted(f"expected {size} headers but only got {res['count']}")
-        conn = await self.blockchain.connect_chunk(height, res['hex'])
-
-        if not conn:
-            return conn, 0
-        return conn, res['count']
+        return res['hex'], res['count']
 
     def is_main_server(self) -> bool:
         return (self.network.interface == self or
@@ -813,7 +1026,10 @@ class Interface(Logger):
                     # the start and end block's targets
                     height = (height // constants.net.DGW_CHECKPOINTS_SPACING) * constants.net.DGW_CHECKPOINTS_SPACING
 
-                could_connect, num_headers = await self.request_chunk(height, next_height)
+                could_connect, num_headers = await self.request_chunks(height, next_height)
+                # only the last chunk can be short
+                got_less_than_spacing = num_headers % constants.net.DGW_CHECKPOINTS_SPACING != 0
+                height = height + num_headers
 
                 if not could_connect:
                     if height <= constants.net.max_checkpoint():
@@ -821,9 +1037,6 @@ class Interface(Logger):
                     last, height = await self.step(height)
                     continue
 
-                util.trigger_callback('network_updated')
-                got_less_than_spacing = num_headers < constants.net.DGW_CHECKPOINTS_SPACING
-                height = height + num_headers
                 assert height <= next_height+1, (height, self.tip)
                 last = 'catchup'
             else:
@@ -1008,7 +1221,28 @@ class Interface(Logger):
             raise Exception(f"{repr(tx_height)} is not a block height")
         # do request
         res = await self.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
-        # check response
+        self._check_merkle_response(res)
+        return res
+
+    async def get_merkles_for_transactions(self, txs: Sequence[Tuple[str, int]]) -> List[Union[dict, aiorpcx.jsonrpc.RPCError]]:
+        """Requests the merkle proofs of (tx_hash, tx_height) items in one batch.
+        The server's error for a tx, e.g. if it is not at that height, is
+        returned in place of its proof.
+        """
+        for tx_hash, tx_height in txs:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+            if not is_non_negative_integer(tx_height):
+                raise Exception(f"{repr(tx_height)} is not a block height")
+        results = await self.session.send_request_batch(
+            [('blockchain.transaction.get_merkle', [tx_hash, tx_height]) for tx_hash, tx_height in txs])
+        for res in results:
+            if not isinstance(res, aiorpcx.jsonrpc.RPCError):
+                self._check_merkle_response(res)
+        return results
+
+    @staticmethod
+    def _check_merkle_response(res) -> None:
         block_height = assert_dict_contains_field(res, field_name='block_height')
         merkle = assert_dict_contains_field(res, field_name='merkle')
         pos = assert_dict_contains_field(res, field_name='pos')
@@ -1018,7 +1252,6 @@ class Interface(Logger):
         assert_list_or_tuple(merkle)
         for item in merkle:
             assert_hash256_str(item)
-        return res
 
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
         if not is_hash256_str(tx_hash):
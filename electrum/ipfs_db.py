@@ -6,28 +6,35 @@ import attr
 import asyncio
 import time
 import itertools
+import heapq
+import weakref
 
 import aiofiles
-from collections import defaultdict
-from typing import TYPE_CHECKING, Set, Dict, Optional
+from contextlib import nullcontext
+from collections import defaultdict, OrderedDict, deque
+from typing import (TYPE_CHECKING, Set, Dict, Optional, AsyncIterator, Callable, List, Sequence,
+                    Tuple, Awaitable, MutableMapping)
 
 from aiohttp import ClientResponse
 from aiorpcx import run_in_thread
 from multiformats import CID
-from ipfs_car_decoder import stream_bytes, FileByteStream
+from ipfs_car_decoder import stream_bytes, ChunkedMemoryByteStream
 
 from .bitcoin import base_decode
 from .json_db import JsonDB, locked, modifier, StoredObject, StoredDict
+from .logging import Logger, get_logger
 from .util import (
     standardize_path,
     test_read_write_permissions,
     profiler,
     os_chmod,
+    ipfs_explorer,
     ipfs_explorer_URL,
     ipfs_explorer_round_robin,
     event_listener,
     make_dir,
     EventListener,
+    OldTaskGroup,
 )
 from .network import Network
 
@@ -37,6 +44,9 @@ if TYPE_CHECKING:
     from .address_synchronizer import AddressSynchronizer
 
 
+_logger = get_logger(__name__)
+
+
 class CheckNextGateway(Exception):
     pass
 
@@ -48,6 +58,8 @@ _BAD_MIMES = ("text/html", "application/octet-stream")
 
 _LOOKUP_COOLDOWN_SEC = 60
 _RETRY_COOLDOWN_SEC = 60 * 5
+_MAX_LOOKUP_BACKOFF_SEC = 60 * 60 * 24
+_OWNED_ASSETS_TTL_SEC = 10
 _IPFS_CONCURS = 2
 
 
@@ -80,6 +92,198 @@ def cidv0_to_base32_cidv1(b58_ipfs_hash: str):
     return CID("base32", 1, "dag-pb", v0_cid.digest).encode()
 
 
+def base32_cidv1_to_cidv0(b32_ipfs_hash: str):
+    v1_cid = CID.decode(b32_ipfs_hash)
+    return CID("base58btc", 0, "dag-pb", v1_cid.digest).encode()
+
+
+class IPFSBlobTooLarge(Exception):
+    pass
+
+
+class CARResponseStream(ChunkedMemoryByteStream):
+    """The bytes of a CAR, as they are being received, so that they can be
+    decoded without waiting for the end of the download. Holds at most
+    max_size bytes; appending more raises IPFSBlobTooLarge.
+    """
+
+    def __init__(self, max_size: int):
+        ChunkedMemoryByteStream.__init__(self)
+        self.max_size = max_size
+
+    @property
+    def size(self) -> int:
+        return len(self._bytes)
+
+    async def append_bytes(self, b: bytes) -> None:
+        if len(self._bytes) + len(b) > self.max_size:
+            raise IPFSBlobTooLarge(f"more than {self.max_size} bytes")
+        await ChunkedMemoryByteStream.append_bytes(self, b)
+
+    async def can_read_more(self) -> bool:
+        # the block indexer stops when this returns False, so it must
+        # wait for more bytes when it has caught up with the download
+        async with self._added_bytes_cond:
+            await self._added_bytes_cond.wait_for(
+                lambda: self._complete or len(self._bytes) > self._pos + 1
+            )
+        return await ChunkedMemoryByteStream.can_read_more(self)
+
+
+class IPFSBlobStore(Logger):
+    """Decoded IPFS files on disk, named by their CID, within a byte budget.
+
+    Sizes and access order are kept in memory, from a single scan of the
+    directory when starting, so that accounting is O(1). When the budget
+    is exceeded, the least recently used files are evicted. Access times
+    are stored as file mtimes, so that the order survives restarts.
+
+    Files are added from the output of stream_bytes, which checks every
+    block of the CAR stream against its CID, starting from the root CID.
+    They are written under a temporary name, and only take their final
+    name once the whole stream has been decoded.
+    """
+
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(self, path: str, max_size: int, *, on_evict: Callable[[str], None] = None):
+        Logger.__init__(self)
+        self.path = path
+        self.max_size = max_size  # bytes; 0 for no limit
+        self.on_evict = on_evict  # called with the ipfs hash of evicted files
+        self.lock = threading.Lock()
+        self._blobs = OrderedDict()  # type: OrderedDict[str, int]  # ipfs hash -> size, least recently used first
+        self.total_size = 0
+        self._scan()
+
+    def _scan(self) -> None:
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.name.endswith(self.PARTIAL_SUFFIX):
+                # interrupted download
+                os.remove(entry.path)
+                continue
+            name, ext = os.path.splitext(entry.name)
+            try:
+                ipfs_hash = base32_cidv1_to_cidv0(name)
+            except Exception:
+                ipfs_hash = None
+            if ext != ".dat" or ipfs_hash is None:
+                self.logger.info(f"ignoring unknown file {entry.name}")
+                continue
+            st = entry.stat()
+            entries.append((st.st_mtime, ipfs_hash, st.st_size))
+        for _, ipfs_hash, size in sorted(entries):
+            self._blobs[ipfs_hash] = size
+            self.total_size += size
+
+    def path_for(self, ipfs_hash: str) -> str:
+        return standardize_path(
+            os.path.join(self.path, f"{cidv0_to_base32_cidv1(ipfs_hash)}.dat")
+        )
+
+    def __contains__(self, ipfs_hash: str) -> bool:
+        return ipfs_hash in self._blobs
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def get_path(self, ipfs_hash: str) -> Optional[str]:
+        """Returns the path of the file, marking it as recently used."""
+        path = self.path_for(ipfs_hash)
+        with self.lock:
+            if ipfs_hash not in self._blobs:
+                return None
+            try:
+                os.utime(path)
+            except OSError:
+                # deleted behind our back
+                self.total_size -= self._blobs.pop(ipfs_hash)
+                return None
+            self._blobs.move_to_end(ipfs_hash)
+        return path
+
+    async def add_from_stream(
+        self, ipfs_hash: str, chunks: AsyncIterator[bytes], *, max_size: int
+    ) -> int:
+        """Stores the bytes of chunks as the file for ipfs_hash.
+        Raises IPFSBlobTooLarge if there are more than max_size bytes.
+        Returns the size of the file.
+        """
+        path = self.path_for(ipfs_hash)
+        # unique, as the same file may be downloaded from several gateways at once
+        partial_path = f"{path}.{os.urandom(4).hex()}{self.PARTIAL_SUFFIX}"
+        size = 0
+        try:
+            async with aiofiles.open(partial_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise IPFSBlobTooLarge(f"{ipfs_hash} is larger than {max_size} bytes")
+                    await f.write(chunk)
+            os.replace(partial_path, path)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            raise
+        with self.lock:
+            self.total_size += size - self._blobs.pop(ipfs_hash, 0)
+            self._blobs[ipfs_hash] = size
+            evicted = self._evict()
+        self._notify_evicted(evicted)
+        return size
+
+    def get_hashes(self) -> List[str]:
+        with self.lock:
+            return list(self._blobs)
+
+    def remove(self, ipfs_hash: str) -> None:
+        with self.lock:
+            self.total_size -= self._blobs.pop(ipfs_hash, 0)
+            self._remove_file(ipfs_hash)
+
+    def clear(self) -> None:
+        with self.lock:
+            for ipfs_hash in self._blobs:
+                self._remove_file(ipfs_hash)
+            self._blobs.clear()
+            self.total_size = 0
+
+    def set_max_size(self, max_size: int) -> None:
+        with self.lock:
+            self.max_size = max_size
+            evicted = self._evict()
+        self._notify_evicted(evicted)
+
+    def _remove_file(self, ipfs_hash: str) -> None:
+        try:
+            os.remove(self.path_for(ipfs_hash))
+        except OSError:
+            pass
+
+    def _evict(self) -> List[str]:
+        """Removes the least recently used files until we are within budget,
+        keeping the most recent one."""
+        evicted = []
+        while self.max_size and self.total_size > self.max_size and len(self._blobs) > 1:
+            ipfs_hash, size = self._blobs.popitem(last=False)
+            self.total_size -= size
+            self._remove_file(ipfs_hash)
+            evicted.append(ipfs_hash)
+        if evicted:
+            self.logger.info(f"evicted {len(evicted)} files, {self.total_size} bytes left")
+        return evicted
+
+    def _notify_evicted(self, evicted: List[str]) -> None:
+        if self.on_evict:
+            for ipfs_hash in evicted:
+                self.on_evict(ipfs_hash)
+
+
 @attr.s
 class IPFSMetadata(StoredObject):
     known_size = attr.ib(
@@ -111,9 +315,214 @@ class IPFSMetadata(StoredObject):
     info_lookup_successful = attr.ib(
         default=False, type=bool, validator=attr.validators.instance_of(bool)
     )
+    failed_info_queries = attr.ib(
+        default=0, type=int, validator=attr.validators.instance_of(int)
+    )
     associated_assets = attr.ib(factory=set, type=Set[str], converter=set)
 
 
+class IPFSGatewayStats:
+    """EWMAs of the time to first byte and success rate of each gateway,
+    used to rank them, and the recent times to first byte of all gateways,
+    used to decide when to hedge a download with another gateway.
+    """
+
+    LATENCY_EWMA_ALPHA = 0.2
+    SUCCESS_EWMA_ALPHA = 0.2
+    HEDGE_PERCENTILE = 0.9
+    DEFAULT_HEDGE_DELAY = 2.0  # seconds, until we have enough samples
+    MIN_HEDGE_DELAY = 0.5
+    MIN_SAMPLES = 10
+
+    def __init__(self):
+        self._latency = {}  # type: Dict[str, float]
+        self._success = {}  # type: Dict[str, float]
+        self._recent_latencies = deque(maxlen=100)
+
+    def record_first_byte(self, gateway: str, latency: float) -> None:
+        if gateway not in self._latency:
+            self._latency[gateway] = latency
+        else:
+            self._latency[gateway] += self.LATENCY_EWMA_ALPHA * (latency - self._latency[gateway])
+        self._recent_latencies.append(latency)
+
+    def record_result(self, gateway: str, success: bool) -> None:
+        rate = self._success.get(gateway, 1.0)
+        self._success[gateway] = rate + self.SUCCESS_EWMA_ALPHA * (float(success) - rate)
+
+    def get_expected_latency(self, gateway: str) -> float:
+        """Time to first byte, inflated by failures. 0 for gateways we do not
+        know yet, so that each gets a chance to be ranked.
+        """
+        latency = self._latency.get(gateway)
+        if latency is None:
+            return 0
+        return latency / max(self._success.get(gateway, 1.0), 0.05)
+
+    def rank(self, gateways: Sequence[str]) -> List[str]:
+        """Returns gateways, best first. The order is kept among equals."""
+        return sorted(gateways, key=self.get_expected_latency)
+
+    def get_hedge_delay(self, max_delay: float) -> float:
+        """How long to wait for the first byte from a gateway before also
+        trying the next one.
+        """
+        if len(self._recent_latencies) < self.MIN_SAMPLES:
+            delay = self.DEFAULT_HEDGE_DELAY
+        else:
+            latencies = sorted(self._recent_latencies)
+            delay = latencies[int(self.HEDGE_PERCENTILE * (len(latencies) - 1))]
+        return min(max(delay, self.MIN_HEDGE_DELAY), max_delay)
+
+
+async def race_gateways(
+    gateways: Sequence[Tuple[str, str]],
+    fetch: Callable[[str, str, asyncio.Event, asyncio.Event], Awaitable[None]],
+    *,
+    hedge_delay: float,
+) -> Optional[str]:
+    """Hedged fetch: calls fetch(gateway, url, first_byte, started) for the
+    first gateway, and for the next one whenever a fetch fails, or when no
+    gateway sent its first byte (see first_byte) within hedge_delay of the
+    last fetch having started its request (see started), e.g. after waiting
+    for its gateway to be free.
+    The first fetch to return wins, and the others are cancelled.
+    Returns the winning gateway, or None if all of them failed.
+    """
+    candidates = list(gateways)
+    first_byte = asyncio.Event()
+    started = asyncio.Event()
+    tasks = {}  # type: Dict[asyncio.Task, Tuple[str, str]]
+
+    def start_next():
+        nonlocal started
+        gateway, url = candidates.pop(0)
+        started = asyncio.Event()
+        tasks[asyncio.create_task(fetch(gateway, url, first_byte, started))] = gateway, url
+
+    try:
+        if candidates:
+            start_next()
+        while tasks:
+            hedge = candidates and not first_byte.is_set()
+            if hedge and not started.is_set():
+                # the hedge timer only runs once the last fetch has started
+                waiter = asyncio.create_task(started.wait())
+                try:
+                    done, _ = await asyncio.wait(
+                        [*tasks, waiter], return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    waiter.cancel()
+                done.discard(waiter)
+            else:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=hedge_delay if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done and hedge:
+                    _logger.info(f"no data after {hedge_delay:.2f}s, also trying {candidates[0][0]}")
+                    start_next()
+            for task in done:
+                gateway, url = tasks.pop(task)
+                e = task.exception()
+                if e is None:
+                    return gateway
+                _logger.warning(f"failed to download from {url}: {str(e)} ({e.__class__})")
+                if candidates:
+                    start_next()
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+class IPFSPrefetchScheduler(Logger):
+    """Queue of the IPFS hashes to look up, shared by all wallets.
+
+    A hash is queued once, with the best priority it was requested with,
+    and lookups run highest priority first, at most
+    IPFS_MAX_CONCURRENT_LOOKUPS at a time across all wallets. Requests are
+    collected for BATCH_DELAY before the queue is ranked, so that a burst of
+    events (e.g. a wallet syncing its assets) is ranked as a whole.
+    """
+
+    PRIORITY_VISIBLE = 0  # shown in the GUI
+    PRIORITY_OWNED = 1  # held by a wallet
+    PRIORITY_WATCHED = 2
+
+    BATCH_DELAY = 0.25  # seconds
+
+    def __init__(self, lookup: Callable[['Network', str], Awaitable[None]]):
+        Logger.__init__(self)
+        self._lookup = lookup
+        self._queue = []  # type: List[Tuple[int, int, str]]  # heap of (priority, seq, ipfs_hash)
+        self._priorities = {}  # type: Dict[str, int]  # queued ipfs_hash -> priority
+        self._in_flight = set()  # type: Set[str]
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None  # type: Optional[asyncio.Task]
+
+    def __len__(self) -> int:
+        return len(self._priorities)
+
+    def is_pending(self, ipfs_hash: str) -> bool:
+        return ipfs_hash in self._priorities or ipfs_hash in self._in_flight
+
+    async def schedule(self, network: 'Network', ipfs_hash: str, priority: int) -> bool:
+        """Queues a lookup of ipfs_hash, or raises the priority of the queued one.
+        Returns False if it was already queued with at least that priority, or running.
+        """
+        # the worker is cancelled when the network restarts; the queue is kept
+        if self._worker is None or self._worker.done():
+            self._worker = await network.taskgroup.spawn(self._process_queue(network))
+        if ipfs_hash in self._in_flight:
+            return False
+        if self._priorities.get(ipfs_hash, priority + 1) <= priority:
+            return False
+        self._priorities[ipfs_hash] = priority
+        heapq.heappush(self._queue, (priority, next(self._seq), ipfs_hash))
+        self._wakeup.set()
+        return True
+
+    def discard(self, ipfs_hash: str) -> None:
+        # the heap entry is skipped when popped
+        self._priorities.pop(ipfs_hash, None)
+
+    def _pop(self) -> Optional[str]:
+        while self._queue:
+            priority, _, ipfs_hash = heapq.heappop(self._queue)
+            if self._priorities.get(ipfs_hash) == priority:
+                del self._priorities[ipfs_hash]
+                return ipfs_hash
+        return None
+
+    async def _process_queue(self, network: 'Network') -> None:
+        budget = asyncio.Semaphore(max(1, network.config.IPFS_MAX_CONCURRENT_LOOKUPS))
+        while True:
+            await budget.acquire()
+            try:
+                ipfs_hash = self._pop()
+                while ipfs_hash is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    await asyncio.sleep(self.BATCH_DELAY)
+                    ipfs_hash = self._pop()
+            except BaseException:
+                budget.release()
+                raise
+            self._in_flight.add(ipfs_hash)
+            await network.taskgroup.spawn(self._run_lookup(network, ipfs_hash, budget))
+
+    async def _run_lookup(self, network: 'Network', ipfs_hash: str, budget: asyncio.Semaphore) -> None:
+        try:
+            await self._lookup(network, ipfs_hash)
+        finally:
+            self._in_flight.discard(ipfs_hash)
+            budget.release()
+
+
 class IPFSDBReadWriteError(Exception):
     pass
 
@@ -126,15 +535,15 @@ class IPFSDB(JsonDB, EventListener):
         return cls._instance
 
     @classmethod
-    def initialize(cls, path: str, raw_path: str):
-        cls(path, raw_path).logger.info("loaded IPFS database")
+    def initialize(cls, path: str, raw_path: str, max_cache_size: int = 0):
+        cls(path, raw_path, max_cache_size).logger.info("loaded IPFS database")
 
     @classmethod
     def get_instance(cls) -> "IPFSDB":
         assert cls._instance
         return cls._instance
 
-    def __init__(self, path: str, raw_path: str):
+    def __init__(self, path: str, raw_path: str, max_cache_size: int = 0):
         JsonDB.__init__(self, {})
         self.path = standardize_path(path)
         self._file_exists = bool(self.path and os.path.exists(self.path))
@@ -151,8 +560,15 @@ class IPFSDB(JsonDB, EventListener):
 
         self.raw_ipfs_path = standardize_path(raw_path)
         make_dir(self.raw_ipfs_path, False)
+        self.blob_store = IPFSBlobStore(
+            self.raw_ipfs_path, max_cache_size, on_evict=self._on_ipfs_data_evicted
+        )
 
         self._ipfs_single_gateway_semaphore = asyncio.Semaphore(5)
+        self.prefetch_scheduler = IPFSPrefetchScheduler(self._download_ipfs_information)
+        # adb -> (time computed, assets held), see _get_priority_for_asset
+        self._owned_assets = weakref.WeakKeyDictionary()  # type: MutableMapping[AddressSynchronizer, Tuple[float, Set[str]]]
+        self.gateway_stats = IPFSGatewayStats()
         self._ipfs_gateway_locks = defaultdict(asyncio.Lock)
         self._ipfs_lookup_current = set()
         self._ipfs_download_current = set()
@@ -162,11 +578,6 @@ class IPFSDB(JsonDB, EventListener):
     def _should_convert_to_stored_dict(self, key) -> bool:
         return False
 
-    def _local_path_for_ipfs_data(self, ipfs_hash: str):
-        return standardize_path(
-            os.path.join(self.raw_ipfs_path, f"{cidv0_to_base32_cidv1(ipfs_hash)}.dat")
-        )
-
     @locked
     @profiler
     def write(self) -> None:
@@ -206,14 +617,13 @@ class IPFSDB(JsonDB, EventListener):
 
     @locked
     def purge_stale_ipfs_data(self):
-        valid_files = {
-            self._local_path_for_ipfs_data(ipfs_hash) for ipfs_hash in self.data.keys()
-        }
-        for _, _, filenames in os.walk(self.raw_ipfs_path):
-            for file in filenames:
-                path = os.path.join(self.raw_ipfs_path, file)
-                if path not in valid_files:
-                    os.remove(path)
+        for ipfs_hash in self.blob_store.get_hashes():
+            if ipfs_hash not in self.data:
+                self.blob_store.remove(ipfs_hash)
+        for ipfs_hash, metadata in self.data.items():
+            if metadata.is_client_side and ipfs_hash not in self.blob_store:
+                metadata.is_client_side = False
+                self.set_modified(True)
 
         stale_hashes = {
             ipfs_hash
@@ -227,96 +637,110 @@ class IPFSDB(JsonDB, EventListener):
     @modifier
     def remove_ipfs_info(self, ipfs_hash: str):
         self.data.pop(ipfs_hash)
+        self.prefetch_scheduler.discard(ipfs_hash)
+        self._ipfs_lookup_current.discard(ipfs_hash)
         self.remove_ipfs_data(ipfs_hash)
 
-    @locked
     def get_total_bytes_on_disk(self):
-        total_size = 0
-        for _, _, filenames in os.walk(self.raw_ipfs_path):
-            for file in filenames:
-                path = os.path.join(self.raw_ipfs_path, file)
-                if not os.path.islink(path):
-                    total_size += os.path.getsize(path)
-        return total_size
+        return self.blob_store.total_size
 
     @modifier
     def clear_cache(self):
         for ipfs_hash, metadata in self.data.items():
             metadata.is_client_side = False
-            self.remove_ipfs_data(ipfs_hash)
+        self.blob_store.clear()
         self.data.clear()
         self.set_modified(True)
 
     def remove_ipfs_data(self, ipfs_hash: str):
-        ipfs_file = self._local_path_for_ipfs_data(ipfs_hash)
-        try:
-            os.remove(ipfs_file)
-        except (FileNotFoundError, OSError):
-            pass
+        self.blob_store.remove(ipfs_hash)
 
-    class _DownloadException(Exception):
-        pass
+    @modifier
+    def _on_ipfs_data_evicted(self, ipfs_hash: str):
+        m = self.data.get(ipfs_hash, None)
+        if m:
+            m.is_client_side = False
 
     async def _download_ipfs_data(self, network: Network, ipfs_hash: str):
-        async def on_finish(resp: ClientResponse):
+        async def on_finish(resp: ClientResponse, gateway: str, first_byte: asyncio.Event):
             m = self.get_metadata(ipfs_hash)
             if m is None:
                 return
             v1_cid = cidv0_to_base32_cidv1(ipfs_hash)
-            car_block = os.path.join(network.config.path, "cache", f"{v1_cid}.car")
+            max_size = network.config.MAX_IPFS_DOWNLOAD_SIZE
+            stream = CARResponseStream(max_size)
+
+            async def receive():
+                async for chunk, _ in resp.content.iter_chunks():
+                    if not first_byte.is_set():
+                        self.gateway_stats.record_first_byte(gateway, time.monotonic() - t_start[gateway])
+                        first_byte.set()
+                    await stream.append_bytes(chunk)
+                await stream.mark_complete()
+                self.logger.info(f"successfully downloaded car block for {ipfs_hash}")
+
             try:
                 resp.raise_for_status()
                 if resp.content_type != "application/vnd.ipld.car":
                     raise Exception("not a car block")
+                if resp.content_length is not None and resp.content_length > max_size:
+                    raise IPFSBlobTooLarge()
 
-                # Ensure we aren't appending to something thats already there
-                self.remove_ipfs_data(ipfs_hash)
-
-                downloaded_length = 0
-                async with aiofiles.open(car_block, "wb") as f:
-                    async for chunk, _ in resp.content.iter_chunks():
-                        downloaded_length += len(chunk)
-                        if downloaded_length > network.config.MAX_IPFS_DOWNLOAD_SIZE:
-                            self.logger.warning(f"oversized ipfs data for {ipfs_hash}")
-                            m.over_sized = True
-                            m.known_size = downloaded_length
-                            raise self._DownloadException()
-                        await f.write(chunk)
-                self.logger.info(f"successfully downloaded car block for {ipfs_hash}")
-
+                # decode while downloading
                 try:
-                    ipfs_file = self._local_path_for_ipfs_data(ipfs_hash)
-                    async with FileByteStream(car_block) as stream:
-                        async with aiofiles.open(ipfs_file, "wb") as f:
-                            async for chunk in stream_bytes(v1_cid, stream):
-                                await f.write(chunk)
+                    async with OldTaskGroup() as group:
+                        await group.spawn(receive())
+                        await group.spawn(self.blob_store.add_from_stream(
+                            ipfs_hash,
+                            stream_bytes(v1_cid, stream),
+                            max_size=max_size,
+                        ))
+                except IPFSBlobTooLarge:
+                    raise
                 except Exception as e:
                     self.logger.warning(f"failed to decode car block for {ipfs_hash}")
                     raise e
 
                 self.logger.info(f"successfully decoded car block for {ipfs_hash}")
-                m.known_size = downloaded_length
+                m.known_size = stream.size
                 m.is_client_side = True
-            except Exception as e:
-                self.remove_ipfs_data(ipfs_hash)
-                # Move on to next url
-                if not isinstance(e, self._DownloadException):
-                    raise e
+            except IPFSBlobTooLarge:
+                # not the fault of the gateway, no use trying others
+                self.logger.warning(f"oversized ipfs data for {ipfs_hash}")
+                m.over_sized = True
+                m.known_size = max(stream.size, resp.content_length or 0)
             finally:
-                if os.path.exists(car_block):
-                    os.unlink(car_block)
                 resp.close()
 
-        async def lookup_data(ipfs_url: str):
-            await asyncio.sleep(0.25)
-            self.logger.info(f"attempting to download data from {ipfs_url}")
-            await Network.async_send_http_on_proxy(
-                "get",
-                ipfs_url,
-                on_finish=on_finish,
-                timeout=network.config.MAX_IPFS_DOWNLOAD_WAIT,
-                headers={"Accept": "application/vnd.ipld.car"},
-            )
+        t_start = {}  # gateway -> time we started requesting from it
+
+        async def lookup_data(
+            gateway: str,
+            ipfs_url: str,
+            first_byte: asyncio.Event,
+            started: asyncio.Event,
+            *,
+            lock: Optional[asyncio.Lock] = None,
+        ):
+            async with (lock or nullcontext()):
+                started.set()
+                self.logger.info(f"attempting to download data from {ipfs_url}")
+                t_start[gateway] = time.monotonic()
+                try:
+                    await Network.async_send_http_on_proxy(
+                        "get",
+                        ipfs_url,
+                        on_finish=lambda resp: on_finish(resp, gateway, first_byte),
+                        timeout=network.config.MAX_IPFS_DOWNLOAD_WAIT,
+                        headers={"Accept": "application/vnd.ipld.car"},
+                    )
+                except asyncio.TimeoutError:
+                    self.gateway_stats.record_result(gateway, False)
+                    raise Exception(f"timeout trying to download ipfs data from {ipfs_url}")
+                except Exception:
+                    self.gateway_stats.record_result(gateway, False)
+                    raise
+                self.gateway_stats.record_result(gateway, True)
 
         try:
             self.logger.info(f"downloading ipfs data for {ipfs_hash}")
@@ -327,65 +751,29 @@ class IPFSDB(JsonDB, EventListener):
                     for name, url in ipfs_explorer_round_robin(
                         network.config, "ipfs", ipfs_url_safe
                     )
+                    if url
                 }
-                tried_gateways = set()
-                while tried_gateways != set(ipfs_urls.keys()):
-
-                    async def get_gateway(gateway: str):
-                        lock = self._ipfs_gateway_locks[gateway]
-                        try:
-                            await lock.acquire()
-                        finally:
-                            return gateway
-
-                    # Need to populate default dict if doesnt exist
-                    locks = [
-                        asyncio.create_task(get_gateway(gateway))
-                        for gateway in ipfs_urls.keys()
-                        if gateway not in tried_gateways
-                    ]
-                    completed, pending = await asyncio.wait(
-                        locks, return_when=asyncio.FIRST_COMPLETED
-                    )
-                    completed_l = list(completed)
-
-                    # Immediately free unused locks for other tasks (is this needed?)
-                    for locking_task in itertools.chain(completed_l[1:], pending):
-
-                        def on_done(task: asyncio.Task):
-                            gateway = task.result()
-                            self._ipfs_gateway_locks[gateway].release()
-
-                        locking_task.add_done_callback(on_done)
-
-                    gateway = completed_l[0].result()
-                    url = ipfs_urls[gateway]
-                    try:
-                        await lookup_data(url)
-                        return
-                    except asyncio.TimeoutError:
-                        self.logger.warning(
-                            f"timeout trying to download ipfs data from {url}"
-                        )
-                    except Exception as e:
-                        self.logger.warning(
-                            f"failed to download data from {url}: {str(e)} ({e.__class__})"
-                        )
-                    finally:
-                        tried_gateways.add(gateway)
-                        self._ipfs_gateway_locks[gateway].release()
-                self.logger.warning(
-                    f"tried all gateways trying to download ipfs data for {ipfs_hash}"
+                gateways = self.gateway_stats.rank(list(ipfs_urls))
+                winner = await race_gateways(
+                    [(gateway, ipfs_urls[gateway]) for gateway in gateways],
+                    # one download at a time from each gateway
+                    lambda gateway, url, first_byte, started: lookup_data(
+                        gateway, url, first_byte, started, lock=self._ipfs_gateway_locks[gateway]
+                    ),
+                    hedge_delay=self.gateway_stats.get_hedge_delay(
+                        network.config.MAX_IPFS_DOWNLOAD_WAIT
+                    ),
                 )
+                if winner is None:
+                    self.logger.warning(
+                        f"tried all gateways trying to download ipfs data for {ipfs_hash}"
+                    )
             else:
                 url = ipfs_explorer_URL(network.config, "ipfs", ipfs_url_safe)
+                gateway = ipfs_explorer(network.config)
                 try:
                     async with self._ipfs_single_gateway_semaphore:
-                        await lookup_data(url)
-                except asyncio.TimeoutError:
-                    self.logger.warning(
-                        f"timeout trying to lookup ipfs info from {url}"
-                    )
+                        await lookup_data(gateway, url, asyncio.Event(), asyncio.Event())
                 except Exception as e:
                     self.logger.warning(
                         f"failed to download data from {url}: {str(e)} ({e.__class__})"
@@ -401,6 +789,10 @@ class IPFSDB(JsonDB, EventListener):
             util.trigger_callback("ipfs_download", ipfs_hash)
 
     async def _download_ipfs_information(self, network: Network, ipfs_hash: str):
+        if self.get_metadata(ipfs_hash) is None:
+            # no asset uses it anymore
+            self._ipfs_lookup_current.discard(ipfs_hash)
+            return
         seen_types = defaultdict(int)
         seen_sizes = defaultdict(int)
 
@@ -532,6 +924,10 @@ class IPFSDB(JsonDB, EventListener):
             m = self.get_metadata(ipfs_hash)
             if m:
                 m.last_attemped_info_query = curr_time
+                if m.info_lookup_successful:
+                    m.failed_info_queries = 0
+                else:
+                    m.failed_info_queries += 1
                 self._modified = True
                 self._ipfs_lookup_current.discard(ipfs_hash)
                 util.trigger_callback("ipfs_download", ipfs_hash)
@@ -584,7 +980,12 @@ class IPFSDB(JsonDB, EventListener):
                 )
 
     async def maybe_get_info_for_ipfs_hash(
-        self, network: "Network", ipfs_hash: str, asset: str
+        self,
+        network: "Network",
+        ipfs_hash: str,
+        asset: str,
+        *,
+        priority: int = IPFSPrefetchScheduler.PRIORITY_WATCHED,
     ):
         assert isinstance(ipfs_hash, str)
         assert isinstance(asset, str)
@@ -614,10 +1015,13 @@ class IPFSDB(JsonDB, EventListener):
             if m.info_lookup_successful:
                 return
             if ipfs_hash in self._ipfs_lookup_current:
+                # queued or running; this may raise its priority
+                await self.prefetch_scheduler.schedule(network, ipfs_hash, priority)
                 return
             if (
                 m.last_attemped_info_query
-                and (m.last_attemped_info_query + _LOOKUP_COOLDOWN_SEC) > curr_time
+                and (m.last_attemped_info_query + self._get_info_query_cooldown(m, priority))
+                > curr_time
             ):
                 self.logger.info(
                     f"Not downloading information for {ipfs_hash}: cooling down"
@@ -625,9 +1029,32 @@ class IPFSDB(JsonDB, EventListener):
                 return
             self._ipfs_lookup_current.add(ipfs_hash)
             util.trigger_callback("ipfs_download", ipfs_hash)
-            await network.taskgroup.spawn(
-                self._download_ipfs_information(network, ipfs_hash)
-            )
+            await self.prefetch_scheduler.schedule(network, ipfs_hash, priority)
+
+    @staticmethod
+    def _get_info_query_cooldown(m: IPFSMetadata, priority: int) -> int:
+        """Backs off exponentially from hashes no gateway could answer for.
+        Hashes shown in the GUI are retried after the base cooldown.
+        """
+        if priority == IPFSPrefetchScheduler.PRIORITY_VISIBLE or m.failed_info_queries <= 1:
+            return _LOOKUP_COOLDOWN_SEC
+        return min(_LOOKUP_COOLDOWN_SEC * 2 ** (m.failed_info_queries - 1), _MAX_LOOKUP_BACKOFF_SEC)
+
+    def _get_priority_for_asset(self, adb: "AddressSynchronizer", asset: str) -> int:
+        # the balance of all addresses is too costly to get on each event of a
+        # sync burst; the assets held change rarely, and priorities are a hint
+        now = time.monotonic()
+        t, owned_assets = self._owned_assets.get(adb, (None, None))
+        if t is None or now - t > _OWNED_ASSETS_TTL_SEC:
+            owned_assets = {
+                asset
+                for asset, balance in adb.get_balance(adb.get_addresses(), asset_aware=True).items()
+                if asset and sum(balance) > 0
+            }
+            self._owned_assets[adb] = now, owned_assets
+        if asset in owned_assets:
+            return IPFSPrefetchScheduler.PRIORITY_OWNED
+        return IPFSPrefetchScheduler.PRIORITY_WATCHED
 
     @event_listener
     async def on_event_adb_added_verified_asset_metadata(
@@ -636,7 +1063,10 @@ class IPFSDB(JsonDB, EventListener):
         metadata = adb.db.get_verified_asset_metadata(asset)
         if metadata and metadata.is_associated_data_ipfs():
             await self.maybe_get_info_for_ipfs_hash(
-                adb.network, metadata.associated_data_as_ipfs(), asset
+                adb.network,
+                metadata.associated_data_as_ipfs(),
+                asset,
+                priority=self._get_priority_for_asset(adb, asset),
             )
 
     @event_listener
@@ -648,7 +1078,10 @@ class IPFSDB(JsonDB, EventListener):
             metadata = metadata_tup[0]
             if metadata.is_associated_data_ipfs():
                 await self.maybe_get_info_for_ipfs_hash(
-                    adb.network, metadata.associated_data_as_ipfs(), asset
+                    adb.network,
+                    metadata.associated_data_as_ipfs(),
+                    asset,
+                    priority=self._get_priority_for_asset(adb, asset),
                 )
 
     @event_listener
@@ -712,7 +1145,7 @@ class IPFSDB(JsonDB, EventListener):
         m = self.data.get(ipfs_hash, None)
         if m is None or not m.is_client_side:
             return None, None
-        path = self._local_path_for_ipfs_data(ipfs_hash)
-        if not os.path.exists(path):
+        path = self.blob_store.get_path(ipfs_hash)
+        if path is None:
             return None, None
         return path, m.known_mime
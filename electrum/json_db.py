@@ -25,14 +25,17 @@
 import threading
 import copy
 import json
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 from . import util
 from .util import WalletFileException, profiler
-from .logging import Logger
+from .logging import Logger, get_logger
 
 if TYPE_CHECKING:
     from .storage import WalletStorage
+    from .wallet_sql_db import WalletSqlStore, SqlDict
+
+_logger = get_logger(__name__)
 
 JsonDBJsonEncoder = util.MyEncoder
 
@@ -40,7 +43,14 @@ def modifier(func):
     def wrapper(self, *args, **kwargs):
         with self.lock:
             self._modified = True
-            return func(self, *args, **kwargs)
+            num_patches = self._num_patches
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                # nothing was journaled: the change, if any, was made in
+                # place, so it can only be saved by rewriting the file
+                if self._num_patches == num_patches:
+                    self._needs_full_write = True
     return wrapper
 
 def locked(func):
@@ -113,21 +123,29 @@ class StoredDict(dict):
         self.lock = self.db.lock if self.db else threading.RLock()
         self.path = path
         # recursively convert dicts to StoredDict
+        # the caller journals the dict as a whole, not its items
         for k, v in list(data.items()):
-            self.__setitem__(k, v)
+            self._setitem(k, v, journal=False)
 
     @locked
     def __setitem__(self, key, v):
+        self._setitem(key, v, journal=True)
+
+    def _setitem(self, key, v, *, journal: bool):
         is_new = key not in self
         # early return to prevent unnecessary disk writes
         if not is_new and self[key] == v:
+            # a list or set mutated in place and assigned back compares
+            # equal to itself, but its new content still has to be journaled
+            if self.db and journal and v is self[key] and isinstance(v, (list, set)):
+                self.db._add_patch('s', self.path + [key], v)
             return
         # recursively set db and path
         if isinstance(v, StoredDict):
             v.db = self.db
             v.path = self.path + [key]
             for k, vv in v.items():
-                v[k] = vv
+                v._setitem(k, vv, journal=False)
         # recursively convert dict to StoredDict.
         # _convert_dict is called breadth-first
         elif isinstance(v, dict):
@@ -144,35 +162,138 @@ class StoredDict(dict):
             v.set_db(self.db)
         # set item
         dict.__setitem__(self, key, v)
-        if self.db:
-            self.db.set_modified(True)
+        if self.db and journal:
+            self.db._add_patch('s', self.path + [key], v)
 
     @locked
     def __delitem__(self, key):
         dict.__delitem__(self, key)
         if self.db:
-            self.db.set_modified(True)
+            self.db._add_patch('d', self.path + [key])
 
     @locked
     def pop(self, key, v=_RaiseKeyError):
         if v is _RaiseKeyError:
             r = dict.pop(self, key)
+        elif key in self:
+            r = dict.pop(self, key)
         else:
-            r = dict.pop(self, key, v)
+            return v
         if self.db:
-            self.db.set_modified(True)
+            self.db._add_patch('d', self.path + [key])
         return r
 
+    @locked
+    def clear(self):
+        dict.clear(self)
+        if self.db:
+            if self.path:
+                self.db._add_patch('s', self.path, {})
+            else:
+                self.db.set_modified(True)
+
+    @locked
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    @locked
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    @locked
+    def touch(self, key):
+        """Journals the current value of 'key'.
+        To be called after a set or list value was mutated in place,
+        as such changes are not seen by __setitem__.
+        """
+        if self.db:
+            self.db._add_patch('s', self.path + [key], self[key])
+
+
+def _json_key(key) -> str:
+    # mirror how json.dumps converts dict keys
+    if isinstance(key, str):
+        return key
+    if isinstance(key, bool):
+        return 'true' if key else 'false'
+    if isinstance(key, int):
+        return str(int(key))
+    if key is None:
+        return 'null'
+    return str(key)
+
+
+def _apply_patches(data: dict, patches: List[list]) -> None:
+    for op, path, *value in patches:
+        d = data
+        for key in path[:-1]:
+            d = d[key]
+        if op == 's':
+            d[path[-1]] = value[0]
+        elif op == 'd':
+            d.pop(path[-1], None)
+        else:
+            raise ValueError(f'unknown journal op: {op!r}')
+
+
+def loads_journaled(s: str) -> Tuple[Any, int, int]:
+    """Parses a serialized JsonDB: a json document, optionally followed
+    by journal records, one per line, each a list of patches written by a
+    single save. Records are replayed in order. A record that cannot be
+    parsed was torn by a crash during append; it and anything after it
+    are discarded, so that every save is either applied fully or not at all.
+
+    Returns (data, base_size, journal_size), sizes in characters.
+    """
+    start = len(s) - len(s.lstrip())
+    data, end = json.JSONDecoder().raw_decode(s, start)
+    journal = s[end:]
+    journal_size = 0
+    for line in journal.split('\n'):
+        if not line.strip():
+            journal_size += len(line) + 1
+            continue
+        try:
+            patches = json.loads(line)
+            _apply_patches(data, patches)
+        except Exception as e:
+            _logger.warning(f'discarding torn journal record: {e!r}')
+            break
+        journal_size += len(line) + 1
+    return data, end, journal_size
+
 
 
 
 class JsonDB(Logger):
 
+    # rewrite the whole file once the journal outgrows the base document
+    JOURNAL_COMPACT_RATIO = 1.0
+    # top-level key listing the collections that live in an sql store
+    SQL_TABLES_KEY = 'sql_tables'
+
     def __init__(self, data, storage=None):
         Logger.__init__(self)
         self.lock = threading.RLock()
         self.storage = storage
         self._modified = False
+        # Changes made through StoredDict are journaled as patches, and
+        # appended to the file by the next write. A @modifier call that
+        # journals nothing sets _needs_full_write. The first write of a
+        # session is always a full rewrite, which folds any journal read
+        # from disk into the base.
+        self._patches = []  # type: List[str]
+        self._num_patches = 0  # patches added, to the journal or the sql store
+        self._needs_full_write = True
+        self._base_size = 0
+        self._journal_size = 0
+        # collections kept in an sql store, see _attach_sql_store
+        self._sql_store = None  # type: Optional[WalletSqlStore]
+        self._sql_tables = {}  # type: Dict[str, SqlDict]
+        self._sql_modified = False
         # load data
         if data:
             self.load_data(data)
@@ -181,7 +302,7 @@ class JsonDB(Logger):
 
     def load_data(self, s):
         try:
-            self.data = json.loads(s)
+            self.data, self._base_size, self._journal_size = loads_journaled(s)
         except Exception:
             raise WalletFileException("Cannot read wallet file. (parsing failed)")
         if not isinstance(self.data, dict):
@@ -190,6 +311,27 @@ class JsonDB(Logger):
     def set_modified(self, b):
         with self.lock:
             self._modified = b
+            if b:
+                self._needs_full_write = True
+                self._patches.clear()
+
+    def _add_patch(self, op: str, path: list, value=None) -> None:
+        with self.lock:
+            self._modified = True
+            self._num_patches += 1
+            table = self._sql_tables.get(path[0]) if path else None
+            if table is not None:
+                table.write_through(op, path[1:], value)
+                self._sql_modified = True
+                return
+            if self._needs_full_write or not self.storage:
+                return
+            path = json.dumps([_json_key(k) for k in path])
+            if op == 's':
+                value = json.dumps(value, cls=JsonDBJsonEncoder)
+                self._patches.append(f'["s",{path},{value}]')
+            else:
+                self._patches.append(f'["d",{path}]')
 
     def modified(self):
         return self._modified
@@ -230,14 +372,51 @@ class JsonDB(Logger):
     def dump(self, *, human_readable: bool = True) -> str:
         """Serializes the DB as a string.
         'human_readable': makes the json indented and sorted, but this is ~2x slower
+        The result is self-contained: collections in the sql store are included.
         """
+        data = self.data
+        if self._sql_tables:
+            data = dict(data)
+            data.pop(self.SQL_TABLES_KEY, None)
+            for name, table in self._sql_tables.items():
+                data[name] = table.load_all_raw()
+        return self._dump(data, human_readable=human_readable)
+
+    def _dump(self, data, *, human_readable: bool) -> str:
         return json.dumps(
-            self.data,
+            data,
             indent=4 if human_readable else None,
             sort_keys=bool(human_readable),
             cls=JsonDBJsonEncoder,
         )
 
+    def _attach_sql_store(self, store: 'WalletSqlStore') -> None:
+        """Serves the collections named by store.tables from the store.
+        Their contents in self.data, if any, are discarded.
+        """
+        from .wallet_sql_db import SqlDict
+        assert isinstance(self.data, StoredDict)
+        self._sql_store = store
+        self._sql_tables = {name: SqlDict(name, store, self) for name in store.tables}
+        for name, table in self._sql_tables.items():
+            dict.__setitem__(self.data, name, table)
+        dict.__setitem__(self.data, self.SQL_TABLES_KEY, list(store.tables))
+
+    def _detach_sql_store(self) -> 'WalletSqlStore':
+        """Moves the collections back into self.data.
+        Returns the store, which the caller should delete once written.
+        """
+        store = self._sql_store
+        rows = {name: table.load_all_raw() for name, table in self._sql_tables.items()}
+        self._sql_store = None
+        self._sql_tables = {}
+        for name, d in rows.items():
+            dict.__delitem__(self.data, name)
+            self.data[name] = d
+        self.data.pop(self.SQL_TABLES_KEY, None)
+        self.set_modified(True)
+        return store
+
     def _should_convert_to_stored_dict(self, key) -> bool:
         return True
 
@@ -280,6 +459,35 @@ class JsonDB(Logger):
             return
         if not self.modified():
             return
-        json_str = self.dump(human_readable=not self.storage.is_encrypted())
-        self.storage.write(json_str)
-        self.set_modified(False)
+        if self._sql_store:
+            self._sql_store.commit()
+            for table in self._sql_tables.values():
+                table.trim()
+        if self._sql_modified and not self._patches and not self._needs_full_write:
+            # all changes went to the sql store
+            pass
+        elif self._should_write_journal():
+            record = '[' + ','.join(self._patches) + ']'
+            self.storage.append(record)
+            self._journal_size += len(record) + 1
+        else:
+            data = self.data
+            if self._sql_tables:
+                data = {k: v for k, v in data.items() if k not in self._sql_tables}
+            json_str = self._dump(data, human_readable=not self.storage.is_encrypted())
+            self.storage.write(json_str)
+            self._base_size = len(json_str)
+            self._journal_size = 0
+            self._needs_full_write = False
+        self._patches.clear()
+        self._modified = False
+        self._sql_modified = False
+
+    def _should_write_journal(self) -> bool:
+        if self._needs_full_write or not self._patches:
+            return False
+        if not isinstance(self.data, StoredDict):
+            return False
+        if not self.storage.can_append():
+            return False
+        return self._journal_size <= self._base_size * self.JOURNAL_COMPACT_RATIO
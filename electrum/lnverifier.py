@@ -111,7 +111,7 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
         # we are verifying channel announcements as they are from untrusted ln peers.
         # we use electrum servers to do this. however we don't trust electrum servers either...
         try:
-            async with self._network_request_semaphore:
+            async with self._network_request_slot():
                 result = await self.network.get_txid_from_txpos(
                     block_height, short_channel_id.txpos, True)
         except aiorpcx.jsonrpc.RPCError:
@@ -130,7 +130,7 @@ class LNChannelVerifier(NetworkJobOnDefaultServer):
             # the electrum server sent an incorrect proof. blame is on server, not the ln peer
             raise GracefulDisconnect(e) from e
         try:
-            async with self._network_request_semaphore:
+            async with self._network_request_slot():
                 raw_tx = await self.network.get_transaction(tx_hash)
         except aiorpcx.jsonrpc.RPCError as e:
             # the electrum server can't find the tx; but it was the
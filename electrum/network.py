@@ -41,7 +41,7 @@ import urllib.parse
 from enum import IntEnum
 
 import aiorpcx
-from aiorpcx import ignore_after
+from aiorpcx import ignore_after, run_in_thread
 from aiohttp import ClientResponse, ClientResponseError
 
 from . import util
@@ -60,6 +60,8 @@ from .blockchain import Blockchain, HEADER_SIZE
 from .interface import (Interface, PREFERRED_NETWORK_PROTOCOL,
                         RequestTimedOut, NetworkTimeout, BUCKET_NAME_OF_ONION_SERVERS,
                         NetworkException, RequestCorrupted, ServerAddr)
+from .spv_cache import SPVCache
+from .server_scoreboard import ServerScoreboard
 from .version import PROTOCOL_VERSION
 from .i18n import _
 from .logging import get_logger, Logger
@@ -278,6 +280,7 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
     lngossip: Optional['LNGossip'] = None
     local_watchtower: Optional['WatchTower'] = None
     path_finder: Optional['LNPathFinder'] = None
+    spv_cache: Optional['SPVCache'] = None
 
     def __init__(self, config: 'SimpleConfig', *, daemon: 'Daemon' = None):
         global _INSTANCE
@@ -299,7 +302,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.config = config
         self.daemon = daemon
 
-        blockchain.read_blockchains(self.config)
+        # chains restored from a snapshot get checked in the background, see _verify_snapshot_chains
+        self._chains_from_snapshot = blockchain.read_blockchains(self.config)
         blockchain.init_headers_file_for_best_chain()
         self.logger.info(f"blockchains {list(map(lambda b: b.forkpoint, blockchain.blockchains.values()))}")
         self._blockchain_preferred_block = self.config.BLOCKCHAIN_PREFERRED_BLOCK  # type: Dict[str, Any]
@@ -321,6 +325,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
 
         self.server_peers = {}  # returned by interface (servers that the main interface knows about)
         self._recent_servers = self._read_recent_servers()  # note: needs self.recent_servers_lock
+        # observed latency and reliability of servers, persisted next to recent_servers
+        self.server_scores = ServerScoreboard(os.path.join(self.config.path, "server_scores") if self.config.path else None)
 
         self.banner = ''
         self.donation_address = ''
@@ -329,6 +335,10 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         dir_path = os.path.join(self.config.path, 'certs')
         util.make_dir(dir_path)
 
+        # raw txs and merkle proofs fetched by the verifiers, shared by all wallets
+        if self.config.NETWORK_SPV_CACHE_MAX_SIZE_MB > 0:
+            self.spv_cache = SPVCache(self)
+
         # the main server we are currently communicating with
         self.interface = None
         self.default_server_changed_event = asyncio.Event()
@@ -579,17 +589,16 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             recent_servers = list(self._recent_servers)
         recent_servers = [s for s in recent_servers if s.protocol in self._allowed_protocols]
         if len(connected_servers & set(recent_servers)) < NUM_STICKY_SERVERS:
-            for server in recent_servers:
+            for server in self.server_scores.weighted_shuffle(recent_servers):
                 if server in connected_servers:
                     continue
                 if not self._can_retry_addr(server, now=now):
                     continue
                 return server
-        # try all servers we know about, pick one at random
+        # try all servers we know about, pick one at random, weighted by score
         hostmap = self.get_servers()
         servers = list(set(filter_protocol(hostmap, allowed_protocols=self._allowed_protocols)) - connected_servers)
-        random.shuffle(servers)
-        for server in servers:
+        for server in self.server_scores.weighted_shuffle(servers):
             if not self._can_retry_addr(server, now=now):
                 continue
             return server
@@ -669,12 +678,12 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.num_server = NUM_TARGET_CONNECTED_SERVERS if not oneserver else 0
 
     async def _switch_to_random_interface(self):
-        '''Switch to a random connected server other than the current one'''
+        '''Switch to a random connected server other than the current one, weighted by score'''
         servers = self.get_interfaces()    # Those in connected state
         if self.default_server in servers:
             servers.remove(self.default_server)
         if servers:
-            await self.switch_to_interface(random.choice(servers))
+            await self.switch_to_interface(self.server_scores.weighted_choice(servers))
 
     async def switch_lagging_interface(self):
         """If auto_connect and lagging, switch interface (only within fork)."""
@@ -684,8 +693,12 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             with self.interfaces_lock: interfaces = list(self.interfaces.values())
             filtered = list(filter(lambda iface: iface.tip_header == best_header, interfaces))
             if filtered:
-                chosen_iface = random.choice(filtered)
-                await self.switch_to_interface(chosen_iface.server)
+                chosen_server = self.server_scores.weighted_choice([iface.server for iface in filtered])
+                lagging_server = self.default_server
+                # penalize actual lag only, not a height we do not know yet
+                if chosen_server != lagging_server and self.get_server_height():
+                    self.server_scores.record_lag(lagging_server)
+                await self.switch_to_interface(chosen_server)
 
     async def switch_unwanted_fork_interface(self) -> None:
         """If auto_connect, maybe switch to another fork/chain."""
@@ -709,8 +722,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
                         if iface.blockchain == chain]
             if filtered:
                 self.logger.info(f"switching to (more) preferred fork (rank {rank})")
-                chosen_iface = random.choice(filtered)
-                await self.switch_to_interface(chosen_iface.server)
+                chosen_server = self.server_scores.weighted_choice([iface.server for iface in filtered])
+                await self.switch_to_interface(chosen_server)
                 return
         self.logger.info("tried to switch to (more) preferred fork but no interfaces are on any")
 
@@ -817,6 +830,7 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self._trying_addr_now(server)
 
         interface = Interface(network=self, server=server, proxy=self.proxy)
+        interface.request_limiter.on_result = functools.partial(self.server_scores.record_request, server)
         # note: using longer timeouts here as DNS can sometimes be slow!
         timeout = self.get_network_timeout_seconds(NetworkTimeout.Generic)
         try:
@@ -886,8 +900,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
                     await iface.got_disconnected.wait()
                     continue  # try again
                 except RequestCorrupted as e:
-                    # TODO ban server?
                     iface.logger.exception(f"RequestCorrupted: {e}")
+                    self.server_scores.record_ban(iface.server)
                     await iface.close()
                     await iface.got_disconnected.wait()
                     continue  # try again
@@ -1360,6 +1374,31 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
 
         util.trigger_callback('network_updated')
 
+    @log_exceptions
+    async def _verify_snapshot_chains(self):
+        if not self._chains_from_snapshot:
+            return
+        # chains may get deleted; interfaces must not write to them meanwhile
+        async with self.bhi_lock:
+            await run_in_thread(blockchain.verify_snapshot_chains)
+            self._chains_from_snapshot = False
+            # move off deleted chains, onto the closest surviving ancestor
+            with blockchain.blockchains_lock:
+                chains = set(blockchain.blockchains.values())
+
+            def surviving_chain(chain: Optional[Blockchain]) -> Blockchain:
+                while chain is not None and chain not in chains:
+                    chain = chain.parent
+                return chain or blockchain.get_best_chain()
+
+            with self.interfaces_lock: interfaces = list(self.interfaces.values())
+            for interface in interfaces:
+                if interface.blockchain is not None and interface.blockchain not in chains:
+                    interface.blockchain = surviving_chain(interface.blockchain)
+            if self._blockchain not in chains:
+                self._blockchain = surviving_chain(self._blockchain)
+        util.trigger_callback('blockchain_updated')
+
     def start(self, jobs: Iterable = None):
         """Schedule starting the network, along with the given job co-routines.
 
@@ -1369,6 +1408,8 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self._was_started = True
         self._jobs = jobs or []
         asyncio.run_coroutine_threadsafe(self._start(), self.asyncio_loop)
+        # not part of the taskgroup, so that it runs only once, across restarts
+        asyncio.run_coroutine_threadsafe(self._verify_snapshot_chains(), self.asyncio_loop)
 
     @log_exceptions
     async def stop(self, *, full_shutdown: bool = True):
@@ -1388,6 +1429,15 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
         self.interfaces = {}
         self._connecting_ifaces.clear()
         self._closing_ifaces.clear()
+        if full_shutdown:
+            blockchain.shutdown_pow_executor()
+            self.server_scores.save()
+            if self.config.BLOCKCHAIN_FAST_START and not self._chains_from_snapshot:
+                blockchain.save_snapshot(self.config)
+            if self.spv_cache:
+                self.spv_cache.stop()
+                await self.spv_cache.stopped_event.wait()
+                self.spv_cache = None
         if not full_shutdown:
             util.trigger_callback('network_updated')
 
@@ -1428,6 +1478,7 @@ class Network(Logger, NetworkRetryManager[ServerAddr]):
             await maybe_start_new_interfaces()
             await maintain_healthy_spread_of_connected_servers()
             await maintain_main_interface()
+            self.server_scores.maybe_save()
             await asyncio.sleep(0.1)
 
     @classmethod
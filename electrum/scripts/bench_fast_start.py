@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+# Benchmarks the time it takes the daemon to get its chains ready, on the
+# local headers files: read_blockchains, init_headers_file_for_best_chain and
+# the chainwork of each fork and its parent, first with the full consistency checks, then
+# restored from the snapshot saved on shutdown (fast start). Also reports the
+# time of the background checks that follow a fast start.
+
+import os
+import time
+
+from electrum import blockchain
+from electrum.simple_config import SimpleConfig
+from electrum.util import print_msg
+
+
+config = SimpleConfig({'blockchain_fast_start': True})
+initial_chainwork_cache = dict(blockchain._CHAINWORK_CACHE)
+
+
+def time_to_ready() -> float:
+    blockchain.blockchains.clear()
+    blockchain._CHAINWORK_CACHE.clear()
+    blockchain._CHAINWORK_CACHE.update(initial_chainwork_cache)
+    t0 = time.monotonic()
+    from_snapshot = blockchain.read_blockchains(config)
+    blockchain.init_headers_file_for_best_chain()
+    if not from_snapshot:
+        for chain in list(blockchain.blockchains.values()):
+            if chain.parent is not None:
+                chain.get_chainwork()
+                chain.parent.get_chainwork()
+    return time.monotonic() - t0
+
+
+# without a snapshot, as after a crash; a new one is saved at the end
+if os.path.exists(blockchain.get_snapshot_path(config)):
+    os.unlink(blockchain.get_snapshot_path(config))
+dt = time_to_ready()
+print_msg(f"{len(blockchain.blockchains)} chain(s), best chain height {blockchain.get_best_chain().height()}")
+print_msg(f"full checks: {dt * 1000:.1f} ms")
+blockchain.save_snapshot(config)
+dt = time_to_ready()
+print_msg(f"fast start: {dt * 1000:.1f} ms")
+t0 = time.monotonic()
+blockchain.verify_snapshot_chains()
+print_msg(f"background checks: {(time.monotonic() - t0) * 1000:.1f} ms")
+blockchain.save_snapshot(config)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# Benchmarks the check that no inner node of a merkle proof parses as a
+# 64-byte transaction: the byte-level pre-check used by SPV against a
+# full Transaction.deserialize(), over a corpus of random proofs.
+# Reports inner nodes/sec for both, and checks that they agree.
+
+import os
+import sys
+import time
+
+from electrum.crypto import sha256d
+from electrum.transaction import Transaction, is_deserializable_tx
+from electrum.util import print_msg
+
+
+try:
+    num_proofs = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+except Exception:
+    print("usage: bench_merkle_inner_nodes.py [num_proofs] [depth]")
+    sys.exit(1)
+
+
+def deserializes(raw: bytes) -> bool:
+    try:
+        Transaction(raw.hex()).deserialize()
+    except Exception:
+        return False
+    return True
+
+
+# the inner nodes hashed while walking each proof up to its merkle root
+inner_nodes = []
+for _ in range(num_proofs):
+    h = os.urandom(32)
+    for item in (os.urandom(32) for _ in range(depth)):
+        inner_node = item + h
+        inner_nodes.append(inner_node)
+        h = sha256d(inner_node)
+print_msg(f"{len(inner_nodes)} inner nodes")
+
+results = {}
+for name, check in (('deserialize', deserializes), ('pre-check', is_deserializable_tx)):
+    t0 = time.monotonic()
+    results[name] = [check(node) for node in inner_nodes]
+    dt = time.monotonic() - t0
+    print_msg(f"{name}: {len(inner_nodes) / dt:.0f} nodes/sec")
+assert results['deserialize'] == results['pre-check']
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Benchmarks proof-of-work verification of headers that are already in the
+# local headers file: first on a single core, then sharded across the
+# process pool used by Blockchain.connect_chunk. Reports headers/sec.
+
+import sys
+import time
+import asyncio
+
+from electrum import blockchain, constants
+from electrum.blockchain import HEADER_SIZE, LEGACY_HEADER_SIZE
+from electrum.simple_config import SimpleConfig
+from electrum.util import print_msg
+
+
+try:
+    start_height = int(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2016
+except Exception:
+    print("usage: bench_pow_verify.py <start_height> [count]")
+    sys.exit(1)
+
+config = SimpleConfig()
+blockchain.read_blockchains(config)
+chain = blockchain.get_best_chain()
+if chain.height() < start_height + count - 1:
+    print_msg(f"local headers only go up to height {chain.height()}")
+    sys.exit(1)
+
+# re-create the chunk as the server would send it
+raw_headers = []
+for height in range(start_height, start_height + count):
+    raw = bytes(chain.read_raw_header(height))
+    raw_headers.append(raw[:LEGACY_HEADER_SIZE] if height < constants.net.KawpowActivationHeight else raw[:HEADER_SIZE])
+data = b''.join(raw_headers)
+
+
+async def bench(num_workers: int):
+    bench_config = SimpleConfig({'pow_verify_workers': num_workers})
+    # warm up the pool so that process start-up is not measured
+    await blockchain.hash_chunk_headers(bench_config, start_height, b''.join(raw_headers[:num_workers]))
+    t0 = time.monotonic()
+    hashes = await blockchain.hash_chunk_headers(bench_config, start_height, data)
+    dt = time.monotonic() - t0
+    assert len(hashes) == count
+    for i, h in enumerate(hashes):
+        assert chain.check_hash(start_height + i, h), start_height + i
+    print_msg(f"{num_workers} worker(s): {count / dt:.1f} headers/sec")
+
+
+async def main():
+    await bench(1)
+    await bench(blockchain.get_num_pow_workers(config))
+    blockchain.shutdown_pow_executor()
+
+
+asyncio.run(main())
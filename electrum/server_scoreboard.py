@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2024 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import random
+import time
+from typing import Optional, Sequence, List, Dict, TYPE_CHECKING
+
+from .logging import Logger
+
+if TYPE_CHECKING:
+    from .interface import ServerAddr
+
+
+class ServerScoreboard(Logger):
+    """Persistent per-server scores, used to prefer fast and reliable
+    servers when choosing which ones to connect to.
+
+    For each server, we keep EWMAs of the request latency and error
+    (timeout) rate, and counters of the times it lagged behind our chain
+    and sent corrupted data. The counters decay over time, so that a
+    server can redeem itself. Selection is random, weighted by score, so
+    that all servers keep a chance to be tried.
+    """
+
+    LATENCY_EWMA_ALPHA = 0.1
+    ERROR_EWMA_ALPHA = 0.05
+    REFERENCE_LATENCY = 0.5  # seconds; latency at which a server scores half
+    PENALTY_HALF_LIFE = 24 * 3600  # seconds
+    LAG_PENALTY = 0.5  # score multiplier per lag event
+    BAN_PENALTY = 0.1  # score multiplier per corrupted response
+    MIN_SCORE = 0.001
+    MAX_ENTRIES = 500
+    SAVE_INTERVAL = 60  # seconds
+
+    def __init__(self, path: Optional[str]):
+        Logger.__init__(self)
+        self.path = path
+        self._scores = self._read()  # type: Dict[str, dict]
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+    def _read(self) -> Dict[str, dict]:
+        if not self.path:
+            return {}
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                scores = json.loads(f.read())
+            assert isinstance(scores, dict)
+            return scores
+        except Exception:
+            return {}
+
+    def save(self) -> None:
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        if not self.path:
+            return
+        if len(self._scores) > self.MAX_ENTRIES:
+            by_age = sorted(self._scores, key=lambda k: self._scores[k]['last_seen'], reverse=True)
+            self._scores = {k: self._scores[k] for k in by_age[:self.MAX_ENTRIES]}
+        s = json.dumps(self._scores, indent=4, sort_keys=True)
+        try:
+            with open(self.path, "w", encoding='utf-8') as f:
+                f.write(s)
+        except Exception as e:
+            self.logger.info(f"failed to save server scores: {e!r}")
+
+    def maybe_save(self) -> None:
+        if self._dirty and time.monotonic() - self._last_saved > self.SAVE_INTERVAL:
+            self.save()
+
+    def _get_entry(self, server: 'ServerAddr') -> dict:
+        entry = self._scores.setdefault(str(server), {
+            'latency': None,
+            'error_rate': 0.0,
+            'lags': 0.0,
+            'bans': 0.0,
+            'penalties_time': time.time(),
+        })
+        entry['last_seen'] = time.time()
+        self._dirty = True
+        return entry
+
+    @classmethod
+    def _decay_penalties(cls, entry: dict, now: float) -> None:
+        decay = 0.5 ** ((now - entry['penalties_time']) / cls.PENALTY_HALF_LIFE)
+        entry['lags'] *= decay
+        entry['bans'] *= decay
+        entry['penalties_time'] = now
+
+    def record_request(self, server: 'ServerAddr', rtt: Optional[float]) -> None:
+        """Records the outcome of a request: its RTT, or None if it timed out."""
+        entry = self._get_entry(server)
+        if rtt is None:
+            entry['error_rate'] += self.ERROR_EWMA_ALPHA * (1 - entry['error_rate'])
+            return
+        entry['error_rate'] -= self.ERROR_EWMA_ALPHA * entry['error_rate']
+        if entry['latency'] is None:
+            entry['latency'] = rtt
+        else:
+            entry['latency'] += self.LATENCY_EWMA_ALPHA * (rtt - entry['latency'])
+
+    def record_lag(self, server: 'ServerAddr') -> None:
+        entry = self._get_entry(server)
+        self._decay_penalties(entry, time.time())
+        entry['lags'] += 1
+
+    def record_ban(self, server: 'ServerAddr') -> None:
+        entry = self._get_entry(server)
+        self._decay_penalties(entry, time.time())
+        entry['bans'] += 1
+
+    def get_score(self, server: 'ServerAddr') -> float:
+        """Returns a score in [MIN_SCORE, 1]; higher is better.
+        Servers we know nothing about score as if they had the reference latency.
+        """
+        entry = self._scores.get(str(server))
+        if entry is None:
+            return 1 / 2
+        latency = entry['latency'] if entry['latency'] is not None else self.REFERENCE_LATENCY
+        decay = 0.5 ** ((time.time() - entry['penalties_time']) / self.PENALTY_HALF_LIFE)
+        score = 1 / (1 + latency / self.REFERENCE_LATENCY)
+        score *= 1 - entry['error_rate']
+        score *= self.LAG_PENALTY ** (entry['lags'] * decay)
+        score *= self.BAN_PENALTY ** (entry['bans'] * decay)
+        return max(self.MIN_SCORE, score)
+
+    def weighted_shuffle(self, servers: Sequence['ServerAddr']) -> List['ServerAddr']:
+        """Returns servers in random order, with higher scores more likely first."""
+        # weighted random sampling without replacement (Efraimidis-Spirakis)
+        keys = {server: random.random() ** (1 / self.get_score(server)) for server in servers}
+        return sorted(servers, key=keys.__getitem__, reverse=True)
+
+    def weighted_choice(self, servers: Sequence['ServerAddr']) -> 'ServerAddr':
+        return random.choices(servers, weights=[self.get_score(server) for server in servers])[0]
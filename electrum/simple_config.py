@@ -876,6 +876,12 @@ class SimpleConfig(Logger):
     NETWORK_SERVERFINGERPRINT = ConfigVar('serverfingerprint', default=None, type_=str)
     NETWORK_MAX_INCOMING_MSG_SIZE = ConfigVar('network_max_incoming_msg_size', default=1_000_000, type_=int)  # in bytes
     NETWORK_TIMEOUT = ConfigVar('network_timeout', default=None, type_=int)
+    NETWORK_MAX_CHUNKS_IN_FLIGHT = ConfigVar('network_max_chunks_in_flight', default=4, type_=int)
+    NETWORK_MAX_REQUESTS_IN_FLIGHT = ConfigVar('network_max_requests_in_flight', default=500, type_=int)  # per server
+    NETWORK_SUBSCRIPTION_BATCH_SIZE_MAX = ConfigVar('network_subscription_batch_size_max', default=500, type_=int)
+    NETWORK_SPV_CACHE_MAX_SIZE_MB = ConfigVar('spv_cache_max_size_mb', default=50, type_=int)  # 0 disables the cache
+    NETWORK_SHARDED_SYNC = ConfigVar('sharded_sync', default=False, type_=bool)
+    NETWORK_SHARDED_SYNC_CROSSCHECK_FRACTION = ConfigVar('sharded_sync_crosscheck_fraction', default=0.05, type_=float)
 
     WALLET_BATCH_RBF = ConfigVar('batch_rbf', default=False, type_=bool)
     WALLET_SPEND_CONFIRMED_ONLY = ConfigVar('confirmed_only', default=False, type_=bool)
@@ -888,6 +894,8 @@ class SimpleConfig(Logger):
     WALLET_USE_SINGLE_PASSWORD = ConfigVar('single_password', default=False, type_=bool)
     # note: 'use_change' and 'multiple_change' are per-wallet settings
     WALLET_SEND_CHANGE_TO_LIGHTNING = ConfigVar('send_change_to_lightning', default=False, type_=bool)
+    WALLET_SQL_STORAGE = ConfigVar('wallet_sql_storage', default=False, type_=bool)
+    WALLET_TX_CACHE_BYTES = ConfigVar('tx_cache_size', default=16_000_000, type_=int)
 
     FX_USE_EXCHANGE_RATE = ConfigVar('use_exchange_rate', default=False, type_=bool)
     FX_CURRENCY = ConfigVar('currency', default='EUR', type_=str)
@@ -974,6 +982,9 @@ class SimpleConfig(Logger):
     GUI_ENABLE_DEBUG_LOGS = ConfigVar('gui_enable_debug_logs', default=False, type_=bool)
     LOCALIZATION_LANGUAGE = ConfigVar('language', default="", type_=str)
     BLOCKCHAIN_PREFERRED_BLOCK = ConfigVar('blockchain_preferred_block', default=None)
+    BLOCKCHAIN_DGW_SELF_CHECK = ConfigVar('dgw_self_check', default=False, type_=bool)
+    BLOCKCHAIN_POW_VERIFY_WORKERS = ConfigVar('pow_verify_workers', default=0, type_=int)  # 0: one per cpu
+    BLOCKCHAIN_FAST_START = ConfigVar('blockchain_fast_start', default=True, type_=bool)
     SHOW_CRASH_REPORTER = ConfigVar('show_crash_reporter', default=True, type_=bool)
     DONT_SHOW_TESTNET_WARNING = ConfigVar('dont_show_testnet_warning', default=False, type_=bool)
     DONT_SHOW_INTERNET_WARNING = ConfigVar('dont_show_internet_warning', default=False, type_=bool)
@@ -1009,6 +1020,8 @@ class SimpleConfig(Logger):
     DOWNLOAD_IPFS = ConfigVar('download_ipfs_preview', default=False, type_=bool)
     MAX_IPFS_DOWNLOAD_SIZE = ConfigVar('download_ipfs_max_size', default=10_000_000, type_=int)
     MAX_IPFS_DOWNLOAD_WAIT = ConfigVar('download_ipfs_timeout_sec', default=60, type_=int)
+    MAX_IPFS_CACHE_SIZE = ConfigVar('ipfs_cache_max_size', default=200_000_000, type_=int)  # 0: no limit
+    IPFS_MAX_CONCURRENT_LOOKUPS = ConfigVar('ipfs_max_concurrent_lookups', default=4, type_=int)
     SHOW_IPFS = ConfigVar('show_ipfs_preview', default=False, type_=bool)
     SHOW_CREATE_ASSET_PAY_TO = ConfigVar('show_create_asset_pay_to', default=False, type_=bool)
     SHOW_REISSUABLE_WARNING = ConfigVar('show_reissuable_warning', default=True, type_=bool)
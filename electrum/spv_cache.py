@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2024 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import json
+import time
+from typing import Optional, TYPE_CHECKING
+
+from .sql_db import SqlDB, sql
+from .util import get_headers_dir
+
+if TYPE_CHECKING:
+    from .network import Network
+    from .simple_config import SimpleConfig
+
+
+TX = 't'
+MERKLE = 'm'
+
+
+class SPVCache(SqlDB):
+    """Daemon-wide cache of raw transactions and merkle proofs fetched
+    by the verifiers, shared by all wallets and kept across restarts.
+
+    Entries are keyed by txid. Callers check transactions against their
+    txid when reading them back, and proofs are only returned for the
+    header hash they were verified against. The least recently used
+    entries are evicted once the cache grows over its size cap.
+    """
+
+    def __init__(self, network: 'Network'):
+        self.max_size = network.config.NETWORK_SPV_CACHE_MAX_SIZE_MB * 1_000_000
+        self.size = 0  # set in create_database, on the sql thread started below
+        path = self.get_file_path(network.config)
+        super().__init__(network.asyncio_loop, path, commit_interval=100)
+
+    @classmethod
+    def get_file_path(cls, config: 'SimpleConfig') -> str:
+        return os.path.join(get_headers_dir(config), 'spv_cache')
+
+    def create_database(self):
+        c = self.conn.cursor()
+        c.execute("""CREATE TABLE IF NOT EXISTS entries (kind TEXT NOT NULL, txid TEXT NOT NULL,
+                     data BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL,
+                     PRIMARY KEY (kind, txid))""")
+        c.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.size = c.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.conn.commit()
+
+    def _get(self, kind: str, txid: str) -> Optional[bytes]:
+        c = self.conn.cursor()
+        r = c.execute("SELECT data FROM entries WHERE kind=? AND txid=?", (kind, txid)).fetchone()
+        if r is None:
+            return None
+        c.execute("UPDATE entries SET last_used=? WHERE kind=? AND txid=?", (time.time(), kind, txid))
+        return r[0]
+
+    def _put(self, kind: str, txid: str, data: bytes) -> None:
+        c = self.conn.cursor()
+        r = c.execute("SELECT size FROM entries WHERE kind=? AND txid=?", (kind, txid)).fetchone()
+        if r is not None:
+            self.size -= r[0]
+        c.execute("INSERT OR REPLACE INTO entries (kind, txid, data, size, last_used) VALUES (?,?,?,?,?)",
+                  (kind, txid, data, len(data), time.time()))
+        self.size += len(data)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Removes the least recently used entries until the cache is 10% below its cap."""
+        if self.size <= self.max_size:
+            return
+        target = self.max_size * 9 // 10
+        c = self.conn.cursor()
+        evicted = []
+        for kind, txid, size in c.execute("SELECT kind, txid, size FROM entries ORDER BY last_used").fetchall():
+            if self.size <= target:
+                break
+            evicted.append((kind, txid))
+            self.size -= size
+        c.executemany("DELETE FROM entries WHERE kind=? AND txid=?", evicted)
+        self.logger.info(f'evicted {len(evicted)} entries')
+
+    @sql
+    def get_transaction(self, txid: str) -> Optional[str]:
+        data = self._get(TX, txid)
+        return data.hex() if data is not None else None
+
+    @sql
+    def add_transaction(self, txid: str, raw_tx: str) -> None:
+        self._put(TX, txid, bytes.fromhex(raw_tx))
+
+    @sql
+    def get_merkle(self, txid: str, header_hash: str) -> Optional[dict]:
+        """Returns the proof of txid if it was verified against this header."""
+        data = self._get(MERKLE, txid)
+        if data is None:
+            return None
+        merkle = json.loads(data)
+        if merkle.pop('header_hash') != header_hash:
+            return None
+        return merkle
+
+    @sql
+    def add_merkle(self, txid: str, merkle: dict, header_hash: str) -> None:
+        d = {
+            'block_height': merkle['block_height'],
+            'pos': merkle['pos'],
+            'merkle': merkle['merkle'],
+            'header_hash': header_hash,
+        }
+        self._put(MERKLE, txid, json.dumps(d).encode('ascii'))
+
+    @sql
+    def get_stats(self) -> dict:
+        count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            'entries': count,
+            'size_bytes': self.size,
+            'max_bytes': self.max_size,
+        }
@@ -64,6 +64,9 @@ class WalletStorage(Logger):
         self.logger.info(f"wallet path {self.path}")
         self.pubkey = None
         self.decrypted = ''
+        # journal records can only be appended to a file we wrote
+        # ourselves, with the current encryption settings
+        self._can_append = False
         try:
             test_read_write_permissions(self.path)
         except IOError as e:
@@ -98,8 +101,24 @@ class WalletStorage(Logger):
         os.replace(temp_path, self.path)
         os_chmod(self.path, mode)
         self._file_exists = True
+        self._can_append = True
         self.logger.info(f"saved {self.path}")
 
+    def can_append(self) -> bool:
+        return self._can_append and self.file_exists()
+
+    def append(self, data: str) -> None:
+        """Appends a journal record, on its own line, to the wallet file.
+        The write is fsynced; a record torn by a crash is discarded on load.
+        """
+        assert self.can_append()
+        s = self.encrypt_before_writing(data)
+        assert '\n' not in s
+        with open(self.path, "a", encoding='utf-8') as f:
+            f.write('\n' + s)
+            f.flush()
+            os.fsync(f.fileno())
+
     def file_exists(self) -> bool:
         return self._file_exists
 
@@ -135,7 +154,7 @@ class WalletStorage(Logger):
 
     def _init_encryption_version(self):
         try:
-            magic = base64.b64decode(self.raw)[0:4]
+            magic = base64.b64decode(self.raw.split('\n', 1)[0])[0:4]
             if magic == b'BIE1':
                 return StorageEncryptionVersion.USER_PASSWORD
             elif magic == b'BIE2':
@@ -169,8 +188,17 @@ class WalletStorage(Logger):
         ec_key = self.get_eckey_from_password(password)
         if self.raw:
             enc_magic = self._get_encryption_magic()
-            s = zlib.decompress(ec_key.decrypt_message(self.raw, enc_magic))
+            # the base document, followed by encrypted journal records
+            base, *records = self.raw.split('\n')
+            s = zlib.decompress(ec_key.decrypt_message(base, enc_magic))
             s = s.decode('utf8')
+            for record in records:
+                try:
+                    r = zlib.decompress(ec_key.decrypt_message(record, enc_magic))
+                except Exception as e:
+                    self.logger.warning(f"discarding torn journal record: {e!r}")
+                    break
+                s += '\n' + r.decode('utf8')
         else:
             s = ''
         self.pubkey = ec_key.get_public_key_hex()
@@ -212,6 +240,7 @@ class WalletStorage(Logger):
         else:
             self.pubkey = None
             self._encryption_version = StorageEncryptionVersion.PLAINTEXT
+        self._can_append = False
 
     def basename(self) -> str:
         return os.path.basename(self.path)
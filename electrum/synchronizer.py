@@ -24,7 +24,9 @@
 # SOFTWARE.
 import asyncio
 import hashlib
-from typing import Dict, List, TYPE_CHECKING, Tuple, Set, Callable, Optional
+import random
+import time
+from typing import Dict, List, TYPE_CHECKING, Tuple, Set, Callable, Optional, Awaitable, Any
 from collections import defaultdict
 import logging
 
@@ -36,11 +38,12 @@ from .util import make_aiohttp_session, NetworkJobOnDefaultServer, random_shuffl
 from .bitcoin import address_to_scripthash, is_address, is_b58_address, b58_address_to_hash160
 from .asset import StrictAssetMetadata, get_error_for_asset_name, get_error_for_asset_typed, AssetType
 from .logging import Logger
-from .interface import GracefulDisconnect, NetworkTimeout
+from .interface import GracefulDisconnect, NetworkTimeout, RequestCorrupted
 from .i18n import _
 
 if TYPE_CHECKING:
     from .network import Network
+    from .interface import Interface, ServerAddr, AdaptiveRequestLimiter
     from .address_synchronizer import AddressSynchronizer
 
 
@@ -101,6 +104,10 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     """Subscribe over the network to a set of addresses, and monitor their statuses.
     Every time a status changes, run a coroutine provided by the subclass.
     """
+    # subscriptions are sent as JSON-RPC batches, sized to answer within the target time
+    SUBSCRIPTION_BATCH_SIZE_MIN = 10
+    SUBSCRIPTION_BATCH_TARGET_TIME = 2.0  # seconds
+
     def __init__(self, network: 'Network'):
         self.asyncio_loop = network.asyncio_loop
 
@@ -149,6 +156,10 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         self._handling_qualifier_association_statuses = set()
         self._processed_some_qualifier_associations = False
 
+        self._pending_subscriptions = []  # type: List[Tuple[str, List, asyncio.Queue]]
+        self._pending_subscriptions_event = asyncio.Event()
+        self._subscription_batch_size = self.SUBSCRIPTION_BATCH_SIZE_MIN
+
         # Queues
         self.asset_status_queue = asyncio.Queue()
         self.status_queue = asyncio.Queue()
@@ -171,6 +182,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
                 await group.spawn(self.handle_restricted_for_freeze_update())
                 await group.spawn(self.handle_broadcast_status())
                 await group.spawn(self.handle_qualifier_associations_status())
+                await group.spawn(self._send_subscriptions())
                 await group.spawn(self.main())
         finally:
             # we are being cancelled now
@@ -223,7 +235,9 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             if not is_address(addr): raise ValueError(f"invalid bitcoin address {addr}")
             if addr in self.requested_addrs: return
             self.requested_addrs.add(addr)
-            await self.taskgroup.spawn(self._subscribe_to_address, addr)
+            h = address_to_scripthash(addr)
+            self.scripthash_to_address[h] = addr
+            self._queue_subscription('blockchain.scripthash.subscribe', [h], self.status_queue)
         finally:
             self._adding_addrs.discard(addr)  # ok for addr not to be present
 
@@ -232,7 +246,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
             if error := get_error_for_asset_name(asset): raise ValueError(f'invalid asset: {error}')
             if asset in self.requested_assets: return
             self.requested_assets.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_asset, asset)
+            self._queue_subscription('blockchain.asset.subscribe', [asset], self.asset_status_queue)
         finally:
             self._adding_assets.discard(asset)
 
@@ -240,7 +254,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if asset in self.requested_qualifiers_for_tags: return
             self.requested_qualifiers_for_tags.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_qualifier_for_tags, asset)
+            self._queue_subscription('blockchain.tag.qualifier.subscribe', [asset], self.qualifier_tags_status_queue)
         finally:
             self._adding_qualifiers_for_tags.discard(asset)
 
@@ -248,7 +262,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if h160 in self.requested_h160s_for_tags: return
             self.requested_h160s_for_tags.add(h160)
-            await self.taskgroup.spawn(self._subscribe_to_h160_for_tags, h160)
+            self._queue_subscription('blockchain.tag.h160.subscribe', [h160], self.h160_tags_status_queue)
         finally:
             self._adding_h160s_for_tags.discard(h160)
 
@@ -256,7 +270,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if asset in self.requested_restricted_for_verifier: return
             self.requested_restricted_for_verifier.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_restricted_for_verifier, asset)
+            self._queue_subscription('blockchain.asset.verifier_string.subscribe', [asset], self.restricted_verifier_queue)
         finally:
             self._adding_restricted_for_verifier.discard(asset)
 
@@ -264,7 +278,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if asset in self.requested_restricted_for_freeze: return
             self.requested_restricted_for_freeze.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_restricted_for_freeze, asset)
+            self._queue_subscription('blockchain.asset.is_frozen.subscribe', [asset], self.restricted_freeze_queue)
         finally:
             self._adding_restricted_for_freeze.discard(asset)
 
@@ -272,7 +286,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if asset in self.requested_broadcasts: return
             self.requested_broadcasts.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_broadcast, asset)
+            self._queue_subscription('blockchain.asset.broadcasts.subscribe', [asset], self.broadcast_status_queue)
         finally:
             self._adding_broadcasts.discard(asset)
 
@@ -280,7 +294,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         try:
             if asset in self.requested_qualifier_associations: return
             self.requested_qualifier_associations.add(asset)
-            await self.taskgroup.spawn(self._subscribe_to_qualifier_associations, asset)
+            self._queue_subscription('blockchain.asset.restricted_associations.subscribe', [asset], self.qualifier_association_status_queue)
         finally:
             self._adding_qualifier_associations.discard(asset)
 
@@ -311,60 +325,58 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     async def _on_qualifier_associations_status(self, asset, status):
         raise NotImplementedError()
 
-    async def _subscribe_to_address(self, addr):
-        h = address_to_scripthash(addr)
-        self.scripthash_to_address[h] = addr
-        self._requests_sent += 1
-        try:
-            async with self._network_request_semaphore:
-                await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
-        except RPCError as e:
-            if e.message == 'history too large':  # no unique error code
-                raise GracefulDisconnect(e, log_level=logging.ERROR) from e
-            raise
-        self._requests_answered += 1
-
-    async def _subscribe_to_asset(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.asset.subscribe', [asset], self.asset_status_queue)
-        self._requests_answered += 1
-
-    async def _subscribe_to_qualifier_for_tags(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.tag.qualifier.subscribe', [asset], self.qualifier_tags_status_queue)
-        self._requests_answered += 1
-
-    async def _subscribe_to_h160_for_tags(self, h160):
+    def _queue_subscription(self, method: str, params: List, queue: asyncio.Queue) -> None:
+        self._pending_subscriptions.append((method, params, queue))
         self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.tag.h160.subscribe', [h160], self.h160_tags_status_queue)
-        self._requests_answered += 1
+        self._pending_subscriptions_event.set()
 
-    async def _subscribe_to_restricted_for_verifier(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.asset.verifier_string.subscribe', [asset], self.restricted_verifier_queue)
-        self._requests_answered += 1
-
-    async def _subscribe_to_restricted_for_freeze(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.asset.is_frozen.subscribe', [asset], self.restricted_freeze_queue)
-        self._requests_answered += 1
+    async def _send_subscriptions(self):
+        """Sends the queued subscriptions in batches, concurrently, as long
+        as the request limiter of the interface allows.
+        """
+        while True:
+            await self._pending_subscriptions_event.wait()
+            self._pending_subscriptions_event.clear()
+            while self._pending_subscriptions:
+                size = min(self._subscription_batch_size, self._max_subscription_batch_size())
+                batch = self._pending_subscriptions[:size]
+                del self._pending_subscriptions[:len(batch)]
+                limiter = self.interface.request_limiter
+                await limiter.acquire(self)
+                await self.taskgroup.spawn(self._subscribe_batch, batch, limiter)
+
+    async def _subscribe_batch(self, batch: List[Tuple[str, List, asyncio.Queue]],
+                               limiter: 'AdaptiveRequestLimiter'):
+        # note: batches are sized separately, their RTTs are not fed to the limiter
+        try:
+            start = time.monotonic()
+            try:
+                if len(batch) == 1:
+                    await self.session.subscribe(*batch[0])
+                else:
+                    await self.session.subscribe_batch(batch)
+            except RPCError as e:
+                if e.message == 'history too large':  # no unique error code
+                    raise GracefulDisconnect(e, log_level=logging.ERROR) from e
+                raise
+            self._update_subscription_batch_size(len(batch), time.monotonic() - start)
+            self._requests_answered += len(batch)
+        finally:
+            limiter.release()
 
-    async def _subscribe_to_broadcast(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.asset.broadcasts.subscribe', [asset], self.broadcast_status_queue)
-        self._requests_answered += 1
+    def _update_subscription_batch_size(self, n: int, elapsed: float) -> None:
+        """Additive increase while full batches are answered fast enough,
+        halving when they are slow.
+        """
+        size = self._subscription_batch_size
+        if elapsed > self.SUBSCRIPTION_BATCH_TARGET_TIME:
+            size = max(self.SUBSCRIPTION_BATCH_SIZE_MIN, size // 2)
+        elif n >= size:
+            size = min(self._max_subscription_batch_size(), size + self.SUBSCRIPTION_BATCH_SIZE_MIN)
+        self._subscription_batch_size = size
 
-    async def _subscribe_to_qualifier_associations(self, asset):
-        self._requests_sent += 1
-        async with self._network_request_semaphore:
-            await self.session.subscribe('blockchain.asset.restricted_associations.subscribe', [asset], self.qualifier_association_status_queue)
-        self._requests_answered += 1
+    def _max_subscription_batch_size(self) -> int:
+        return max(1, self.network.config.NETWORK_SUBSCRIPTION_BATCH_SIZE_MAX)
 
     async def handle_status(self):
         while True:
@@ -470,6 +482,10 @@ class Synchronizer(SynchronizerBase):
         self._stale_broadcast_history = dict()
         self._stale_qualifier_associations = dict()
 
+        # sharded sync: history and tx requests spread over all connected servers
+        self._shard_requests_in_flight = defaultdict(int)  # type: Dict[ServerAddr, int]
+        self._distrusted_servers = set()  # type: Set[ServerAddr]
+
     def diagnostic_name(self):
         return self.adb.diagnostic_name()
 
@@ -618,7 +634,7 @@ class Synchronizer(SynchronizerBase):
         finally:
             self._handling_qualifier_association_statuses.discard(asset)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
+        async with self._network_request_slot():
             result = await self.interface.get_associations_for_qualifier(asset)
         self._requests_answered += 1
         self.logger.info(f'receiving associations for {asset}: {status}')
@@ -657,7 +673,7 @@ class Synchronizer(SynchronizerBase):
         finally:
             self._handling_broadcast_statuses.discard(asset)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
+        async with self._network_request_slot():
             result = await self.interface.get_broadcasts_for_asset(asset)
         self._requests_answered += 1
         self.logger.info(f'receiving broadcasts for {asset}: {status}')
@@ -685,7 +701,7 @@ class Synchronizer(SynchronizerBase):
         finally:
             self._handling_h160s_for_tags_statuses.discard(h160)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
+        async with self._network_request_slot():
             result = await self.interface.get_tags_for_h160(h160)
         self._requests_answered += 1
         self.logger.info(f'receiving tags for h160 {h160}: {result.keys()}')
@@ -727,7 +743,7 @@ class Synchronizer(SynchronizerBase):
         finally:
             self._handling_qualifiers_for_tags_statuses.discard(asset)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
+        async with self._network_request_slot():
             result = await self.interface.get_tags_for_qualifier(asset)
         self._requests_answered += 1
         self.logger.info(f'receiving tags for qualifier {asset}: {result.keys()}')
@@ -769,7 +785,7 @@ class Synchronizer(SynchronizerBase):
         finally:
             self._handling_asset_statuses.discard(asset)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
+        async with self._network_request_slot():
             result = await self.interface.get_asset_metadata(asset)
         self._requests_answered += 1
         self.logger.info(f'receiving metadata {asset}: {result}')
@@ -794,6 +810,79 @@ class Synchronizer(SynchronizerBase):
             self.adb.add_unverified_or_unconfirmed_asset_metadata(asset, result)
         self.requested_asset_metadata.discard((asset, status))
 
+    def _get_shard_interfaces(self) -> List['Interface']:
+        """Returns the interfaces history and tx requests may be sent to.
+        Without sharded sync, this is only the main interface. With it, it
+        also includes the other connected interfaces that follow the same
+        chain as the main one, are not behind it, and have not disagreed
+        with it in a status cross-check.
+        """
+        if not self.network.config.NETWORK_SHARDED_SYNC:
+            return [self.interface]
+        with self.network.interfaces_lock:
+            interfaces = list(self.network.interfaces.values())
+        return [self.interface] + [
+            iface for iface in interfaces
+            if iface is not self.interface
+            and iface.server not in self._distrusted_servers
+            and iface.is_connected_and_ready()
+            and iface.blockchain is self.interface.blockchain
+            and iface.tip >= self.interface.tip]
+
+    def _pick_shard_interface(self, *, exclude: 'Interface' = None) -> Optional['Interface']:
+        """Returns the shard interface with the fewest of our requests in flight
+        relative to its request window, preferring the main one on ties.
+        """
+        interfaces = [iface for iface in self._get_shard_interfaces() if iface is not exclude]
+        if not interfaces:
+            return None
+        return min(interfaces, key=lambda iface: self._shard_requests_in_flight[iface.server] / iface.request_limiter.window)
+
+    async def _send_to_interface(self, iface: 'Interface', request: Callable[['Interface'], Awaitable]) -> Any:
+        self._shard_requests_in_flight[iface.server] += 1
+        try:
+            async with self._network_request_slot(iface):
+                return await request(iface)
+        finally:
+            self._shard_requests_in_flight[iface.server] -= 1
+
+    async def _send_sharded(self, request: Callable[['Interface'], Awaitable]) -> Tuple['Interface', Any]:
+        """Sends request to the least busy shard interface, and returns that
+        interface with the result. If a server other than the main one
+        fails to answer, the request is retried on the main interface.
+        """
+        iface = self._pick_shard_interface()
+        if iface is not self.interface:
+            try:
+                return iface, await self._send_to_interface(iface, request)
+            except Exception as e:
+                self.logger.info(f"request to {iface.server} failed, retrying on main server: {e!r}")
+                if isinstance(e, RequestCorrupted):
+                    self._distrusted_servers.add(iface.server)
+        return self.interface, await self._send_to_interface(self.interface, request)
+
+    async def _crosscheck_status(self, addr: str, status: str, iface: 'Interface') -> None:
+        """Checks the announced status of addr against the history
+        of another server than iface, the one that served it.
+        """
+        other = self._pick_shard_interface(exclude=iface)
+        if other is None:
+            return
+        h = address_to_scripthash(addr)
+        try:
+            result = await self._send_to_interface(other, lambda i: i.get_history_for_scripthash(h))
+        except Exception as e:
+            self.logger.info(f"status cross-check of {addr} on {other.server} failed: {e!r}")
+            return
+        hist = [(item['tx_hash'], item['height']) for item in result]
+        if history_status(hist) == status:
+            return
+        # could also be a race with a new tx. Either way, we follow the main server,
+        # so we stop sharding to servers that disagree with it.
+        self.logger.warning(f"status cross-check mismatch for {addr} on {other.server}")
+        if other is not self.interface:
+            self._distrusted_servers.add(other.server)
+
     async def _on_address_status(self, addr, status):
         try:
             history = self.adb.db.get_addr_history(addr)
@@ -810,11 +899,16 @@ class Synchronizer(SynchronizerBase):
             self._handling_addr_statuses.discard(addr)
         h = address_to_scripthash(addr)
         self._requests_sent += 1
-        async with self._network_request_semaphore:
-            result = await self.interface.get_history_for_scripthash(h)
+        iface, result = await self._send_sharded(lambda i: i.get_history_for_scripthash(h))
+        hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
+        if iface is not self.interface and history_status(hist) != status:
+            # the status was announced by the main server, which might be ahead of this one
+            self.logger.info(f"status mismatch on {iface.server}: {addr}. retrying on main server")
+            iface = self.interface
+            result = await self._send_to_interface(iface, lambda i: i.get_history_for_scripthash(h))
+            hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
         self._requests_answered += 1
         self.logger.info(f"receiving history {addr} {len(result)}")
-        hist = list(map(lambda item: (item['tx_hash'], item['height']), result))
         # tx_fees
         tx_fees = [(item['tx_hash'], item.get('fee')) for item in result]
         tx_fees = dict(filter(lambda x:x[1] is not None, tx_fees))
@@ -831,6 +925,9 @@ class Synchronizer(SynchronizerBase):
             self._stale_histories[addr] = await self.taskgroup.spawn(disconnect_if_still_stale)
         else:
             self._stale_histories.pop(addr, asyncio.Future()).cancel()
+            if (self.network.config.NETWORK_SHARDED_SYNC
+                    and random.random() < self.network.config.NETWORK_SHARDED_SYNC_CROSSCHECK_FRACTION):
+                await self.taskgroup.spawn(self._crosscheck_status(addr, status, iface))
             # Store received history
             self.adb.receive_history_callback(addr, hist, tx_fees)
             # Request transactions we don't have
@@ -859,8 +956,7 @@ class Synchronizer(SynchronizerBase):
     async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False):
         self._requests_sent += 1
         try:
-            async with self._network_request_semaphore:
-                raw_tx = await self.interface.get_transaction(tx_hash)
+            _, raw_tx = await self._send_sharded(lambda i: i.get_transaction(tx_hash))
         except RPCError as e:
             # most likely, "No such mempool or blockchain transaction"
             if allow_server_not_finding_tx:
@@ -0,0 +1,97 @@
+from unittest import mock
+
+from electrum import asset, bitcoin
+from electrum.asset import (get_asset_info_from_script, asset_vout_info_to_json, asset_vout_info_from_json,
+                            AssetVoutType, AssetMemo, generate_create_script, generate_reissue_script,
+                            generate_owner_script, generate_transfer_script_from_base, generate_null_tag,
+                            generate_verifier_tag)
+from electrum.transaction import PartialTxOutput
+
+from . import ElectrumTestCase
+
+
+H160 = '12' * 20
+IPFS = bytes.fromhex('1220' + '34' * 32)
+
+
+class TestAssetScripts(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.p2pkh_addr = bitcoin.hash160_to_p2pkh(bytes.fromhex(H160))
+        self.p2sh_addr = bitcoin.hash160_to_p2sh(bytes.fromhex(H160))
+
+    def _scripts(self):
+        scripts = []
+        for addr in (self.p2pkh_addr, self.p2sh_addr):
+            base = bitcoin.address_to_script(addr)
+            scripts += [
+                base,
+                generate_transfer_script_from_base('ASSET', 1234, base),
+                generate_transfer_script_from_base('ASSET', 1234, base, memo=AssetMemo(IPFS)),
+                generate_transfer_script_from_base('ASSET', 1234, base, memo=AssetMemo(IPFS, 1700000000)),
+                generate_transfer_script_from_base('A' * 30 + '/' + 'B' * 9, 1, base, memo=AssetMemo(IPFS, 1)),
+                generate_create_script(addr, 'ASSET', 10 * bitcoin.COIN, 2, True, None),
+                generate_create_script(addr, 'ASSET', 10 * bitcoin.COIN, 2, False, IPFS),
+                generate_reissue_script(addr, 'ASSET', 0, 0xff, True, None),
+                generate_reissue_script(addr, 'ASSET', 5, 3, True, IPFS),
+                generate_owner_script(addr, 'ASSET'),
+                # not well-formed: non-minimal push, trailing data, truncated payload
+                base + 'c0' + '4c04' + '72767174' + '75',
+                base + generate_transfer_script_from_base('ASSET', 1, '')[:-2] + '00',
+                base + 'c0' + '0a' + '7276717403' + '75',
+                base + 'c0' + '03' + '72767475',
+                base + '00',
+            ]
+        scripts += [
+            generate_null_tag('#TAG', H160, True),
+            generate_verifier_tag('TAG'),
+            '6a' + '04deadbeef',
+        ]
+        return [bytes.fromhex(s) for s in scripts]
+
+    @staticmethod
+    def _info_fields(asset_info):
+        if asset_info is None:
+            return None
+        return (type(asset_info), vars(asset_info))
+
+    def test_fast_decoder_matches_script_getop(self):
+        scripts = self._scripts()
+        fast = [self._info_fields(get_asset_info_from_script(s)) for s in scripts]
+        with mock.patch.object(asset, '_decode_standard_asset_script', return_value=None):
+            slow = [self._info_fields(get_asset_info_from_script(s)) for s in scripts]
+        self.assertEqual(slow, fast)
+
+    def test_fast_decoder_skips_script_getop(self):
+        base = bytes.fromhex(bitcoin.address_to_script(self.p2pkh_addr))
+        transfer = bytes.fromhex(generate_transfer_script_from_base('ASSET', 1234, base.hex()))
+        with mock.patch.object(asset, 'script_GetOp', side_effect=AssertionError):
+            self.assertEqual(AssetVoutType.NONE, get_asset_info_from_script(base).get_type())
+            asset_info = get_asset_info_from_script(transfer)
+        self.assertEqual(AssetVoutType.TRANSFER, asset_info.get_type())
+        self.assertEqual(('ASSET', 1234), (asset_info.asset, asset_info.amount))
+        self.assertTrue(asset_info.well_formed_script)
+
+    def test_asset_vout_info_json_roundtrip(self):
+        for script in self._scripts():
+            asset_info = get_asset_info_from_script(script)
+            if asset_info is None:
+                continue
+            d = asset_vout_info_to_json(asset_info)
+            if not asset_info.is_transferable():
+                self.assertIsNone(d)
+                continue
+            self.assertEqual(self._info_fields(asset_info), self._info_fields(asset_vout_info_from_json(d)))
+        self.assertEqual(AssetVoutType.NONE, asset_vout_info_from_json(None).get_type())
+
+    def test_txoutput_decodes_script_once(self):
+        base = bitcoin.address_to_script(self.p2pkh_addr)
+        o = PartialTxOutput(scriptpubkey=bytes.fromhex(generate_transfer_script_from_base('ASSET', 7, base)), value=0)
+        with mock.patch.object(asset, 'get_asset_info_from_script', wraps=get_asset_info_from_script) as m:
+            self.assertEqual('ASSET', o.asset)
+            self.assertEqual(7, o.asset_aware_value())
+            self.assertEqual(1, m.call_count)
+            o.scriptpubkey = bytes.fromhex(base)
+            self.assertIsNone(o.asset)
+            self.assertEqual(2, m.call_count)
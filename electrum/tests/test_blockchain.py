@@ -1,10 +1,15 @@
+import json
 import shutil
 import tempfile
 import os
+import random
+from unittest import mock
 
 from electrum import constants, blockchain
 from electrum.simple_config import SimpleConfig
-from electrum.blockchain import Blockchain, deserialize_header, hash_header, InvalidHeader
+from electrum.blockchain import (Blockchain, deserialize_header, serialize_header, hash_header,
+                                 InvalidHeader, HEADER_SIZE, LEGACY_HEADER_SIZE, DGW_PASTBLOCKS, DGWWindow,
+                                 header_offset, height_at_offset, convert_headers_file_to_v2)
 from electrum.util import bfh, make_dir
 
 from . import ElectrumTestCase
@@ -197,7 +202,7 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(None, chain_u.parent)
         self.assertEqual(constants.net.GENESIS, chain_u._forkpoint_hash)
         self.assertEqual(None, chain_u._prev_hash)
-        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers"), chain_u.path())
+        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers_v2"), chain_u.path())
         self.assertEqual(10 * 80, os.stat(chain_u.path()).st_size)
         self.assertEqual(6, chain_l.forkpoint)
         self.assertEqual(chain_u, chain_l.parent)
@@ -221,7 +226,7 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(None, chain_l.parent)
         self.assertEqual(constants.net.GENESIS, chain_l._forkpoint_hash)
         self.assertEqual(None, chain_l._prev_hash)
-        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers"), chain_l.path())
+        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers_v2"), chain_l.path())
         self.assertEqual(11 * 80, os.stat(chain_l.path()).st_size)
         for b in (chain_u, chain_l):
             self.assertTrue(all([b.can_connect(b.read_header(i), False) for i in range(b.height())]))
@@ -244,7 +249,7 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(None, chain_z.parent)
         self.assertEqual(constants.net.GENESIS, chain_z._forkpoint_hash)
         self.assertEqual(None, chain_z._prev_hash)
-        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers"), chain_z.path())
+        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers_v2"), chain_z.path())
         self.assertEqual(14 * 80, os.stat(chain_z.path()).st_size)
         self.assertEqual(9, chain_l.forkpoint)
         self.assertEqual(chain_z, chain_l.parent)
@@ -311,7 +316,7 @@ class TestBlockchain(ElectrumTestCase):
         self.assertEqual(None, chain_z.parent)
         self.assertEqual(constants.net.GENESIS, chain_z._forkpoint_hash)
         self.assertEqual(None, chain_z._prev_hash)
-        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers"), chain_z.path())
+        self.assertEqual(os.path.join(self.data_dir, "blockchain_headers_v2"), chain_z.path())
         self.assertEqual(12 * 80, os.stat(chain_z.path()).st_size)
         self.assertEqual(9, chain_l.forkpoint)
         self.assertEqual(chain_z, chain_l.parent)
@@ -458,3 +463,226 @@ class TestVerifyHeader(ElectrumTestCase):
         with self.assertRaises(InvalidHeader):
             self.header["nonce"] = 42
             Blockchain.verify_header(self.header, self.prev_hash, self.target)
+
+
+class TestHeaderStore(ElectrumTestCase):
+
+    # Bitcoin block header #100, re-used here with various nonces as pre-KAWPOW headers
+    legacy_header = TestVerifyHeader.valid_header
+
+    def setUp(self):
+        super().setUp()
+        make_dir(os.path.join(self.electrum_path, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                                forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(self.chain.path(), 'w+').close()
+
+    def _make_header(self, height: int, nonce: int) -> dict:
+        header = deserialize_header(bfh(self.legacy_header), height)
+        header['nonce'] = nonce
+        return header
+
+    @staticmethod
+    def _serialize(header: dict) -> bytes:
+        return bfh(serialize_header(header))[:LEGACY_HEADER_SIZE]
+
+    def test_read_header_roundtrip(self):
+        headers = [self._make_header(i, 1000 + i) for i in range(5)]
+        data = b''.join(self._serialize(h) for h in headers)
+        self.chain.write(data, 0)
+        self.assertEqual(4, self.chain.height())
+        for h in headers:
+            self.assertEqual(h, self.chain.read_header(h['block_height']))
+        raw = self.chain.read_raw_header(2)
+        self.assertIsInstance(raw, memoryview)
+        self.assertEqual(self._serialize(headers[2]), bytes(raw))
+        del raw
+        self.assertIsNone(self.chain.read_header(5))
+        self.assertIsNone(self.chain.read_header(-1))
+
+    def test_remap_after_truncating_write(self):
+        headers = [self._make_header(i, 1000 + i) for i in range(5)]
+        self.chain.write(b''.join(self._serialize(h) for h in headers), 0)
+        self.assertEqual(headers[4], self.chain.read_header(4))
+        # overwrite from height 2, which truncates the file
+        new_header = self._make_header(2, 42)
+        self.chain.write(self._serialize(new_header), 2 * LEGACY_HEADER_SIZE)
+        self.assertEqual(2, self.chain.height())
+        self.assertEqual(new_header, self.chain.read_header(2))
+        self.assertIsNone(self.chain.read_header(3))
+        # append beyond the tip without truncating leaves a hole of empty headers
+        self.chain.write(self._serialize(self._make_header(5, 7)), 5 * LEGACY_HEADER_SIZE, truncate=False)
+        self.assertEqual(5, self.chain.height())
+        self.assertIsNone(self.chain.read_header(3))
+        self.assertIsNone(self.chain.read_header(4))
+        self.assertEqual(self._make_header(5, 7), self.chain.read_header(5))
+
+    def test_hash_index(self):
+        headers = [self._make_header(i, 1000 + i) for i in range(5)]
+        hashes = [hash_header(h) for h in headers]
+        self.chain.write(b''.join(self._serialize(h) for h in headers[:3]), 0,
+                         hashes=b''.join(bfh(h) for h in hashes[:3]))
+        self.chain.write(b''.join(self._serialize(h) for h in headers[3:]), 3 * LEGACY_HEADER_SIZE)
+        self.assertEqual(hashes[2], self.chain.read_cached_hash(2))
+        self.assertEqual(hashes[2], self.chain.get_header_hash(headers[2]))
+        # not indexed yet: get_hash computes it, and remembers it
+        self.assertIsNone(self.chain.read_cached_hash(4))
+        self.assertEqual(hashes[4], self.chain.get_hash(4))
+        self.assertEqual(hashes[4], self.chain.read_cached_hash(4))
+        # survives re-opening the chain
+        self.chain.write(self._serialize(headers[4]), 4 * LEGACY_HEADER_SIZE, hashes=bfh(hashes[4]))
+        chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                           forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        self.assertEqual(hashes[1:3] + [None, hashes[4]], [chain.read_cached_hash(i) for i in range(1, 5)])
+        # overwriting headers invalidates their hashes
+        new_header = self._make_header(2, 42)
+        self.chain.write(self._serialize(new_header), 2 * LEGACY_HEADER_SIZE)
+        self.assertIsNone(self.chain.read_cached_hash(2))
+        self.assertIsNone(self.chain.read_cached_hash(3))
+        self.assertEqual(hash_header(new_header), self.chain.get_hash(2))
+        self.assertEqual(hash_header(headers[2]), self.chain.get_header_hash(headers[2]))
+
+    def _read_blockchains(self) -> bool:
+        blockchain.blockchains.clear()
+        return blockchain.read_blockchains(self.config)
+
+    def test_snapshot(self):
+        headers = [self._make_header(i, 1000 + i) for i in range(5)]
+        self.chain.write(b''.join(self._serialize(h) for h in headers), 0)
+        self.assertFalse(self._read_blockchains())
+        blockchain.save_snapshot(self.config)
+        snapshot_path = blockchain.get_snapshot_path(self.config)
+        self.assertTrue(os.path.exists(snapshot_path))
+        # restored without the consistency checks, which are left to verify_snapshot_chains
+        with mock.patch.object(blockchain, '_check_best_chain') as check:
+            self.assertTrue(self._read_blockchains())
+            check.assert_not_called()
+        self.assertEqual(4, blockchain.get_best_chain().height())
+        # the snapshot is only used once
+        self.assertFalse(os.path.exists(snapshot_path))
+        self.assertFalse(self._read_blockchains())
+        blockchain.verify_snapshot_chains()
+        self.assertEqual(4, blockchain.get_best_chain().height())
+
+    def test_snapshot_ignored_if_headers_changed(self):
+        headers = [self._make_header(i, 1000 + i) for i in range(5)]
+        self.chain.write(b''.join(self._serialize(h) for h in headers[:4]), 0)
+        self._read_blockchains()
+        blockchain.save_snapshot(self.config)
+        blockchain.get_best_chain().save_header(headers[4])
+        self.assertFalse(self._read_blockchains())
+        # corrupted
+        blockchain.save_snapshot(self.config)
+        with open(blockchain.get_snapshot_path(self.config), 'r+') as f:
+            f.write(f.read().replace('"version": 1', '"version": 2'))
+        self.assertFalse(self._read_blockchains())
+        self.assertEqual(4, blockchain.get_best_chain().height())
+
+    def test_header_offsets(self):
+        k = constants.net.KawpowActivationHeight
+        self.assertEqual(10 * LEGACY_HEADER_SIZE, header_offset(10))
+        self.assertEqual(k * LEGACY_HEADER_SIZE + 10 * HEADER_SIZE, header_offset(k + 10))
+        for height in (0, 1, k - 1, k, k + 1, k + 1000):
+            self.assertEqual(height, height_at_offset(header_offset(height)))
+            self.assertEqual(height, height_at_offset(header_offset(height + 1) - 1))
+
+    def test_convert_v1_headers_file(self):
+        k = 5
+        records = [os.urandom(LEGACY_HEADER_SIZE) for _ in range(k)] + [os.urandom(HEADER_SIZE) for _ in range(3)]
+        records[2] = bytes(LEGACY_HEADER_SIZE)  # missing header
+        v1_path = os.path.join(self.electrum_path, 'blockchain_headers')
+        with open(v1_path, 'wb') as f:
+            f.write(b''.join(r.ljust(HEADER_SIZE, b'\x00') for r in records))
+        os.unlink(self.chain.path())
+        with mock.patch.object(constants.net, 'KawpowActivationHeight', k):
+            convert_headers_file_to_v2(self.config)
+            self.assertFalse(os.path.exists(v1_path))
+            with open(self.chain.path(), 'rb') as f:
+                self.assertEqual(b''.join(records), f.read())
+            self.chain.update_size()
+            self.assertEqual(7, self.chain.height())
+            self.assertIsNone(self.chain.read_raw_header(2))
+            for height in (0, 4, 5, 7):
+                self.assertEqual(records[height], bytes(self.chain.read_raw_header(height)))
+
+
+class TestDGWWindow(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        make_dir(os.path.join(self.electrum_path, 'forks'))
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.chain = Blockchain(config=self.config, forkpoint=0, parent=None,
+                                forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        rand = random.Random(42)
+        self.headers = {}
+        timestamp = 1_600_000_000
+        for height in range(2_000_000, 2_000_000 + 3 * DGW_PASTBLOCKS):
+            timestamp += rand.randint(-30, 200)
+            bits = Blockchain.target_to_bits(rand.randint(1 << 200, 1 << 220))
+            self.headers[height] = {'block_height': height, 'timestamp': timestamp, 'bits': bits}
+
+    def test_matches_full_rescan(self):
+        window = DGWWindow()
+        for height in range(2_000_000 + DGW_PASTBLOCKS + 1, 2_000_000 + 3 * DGW_PASTBLOCKS):
+            self.assertEqual(self.chain.get_target_dgwv3(height, self.headers),
+                             self.chain.get_target_dgwv3(height, self.headers, window))
+            window.push(self.headers[height])
+
+    def test_restarts_on_gap(self):
+        window = DGWWindow()
+        for height in range(2_000_000, 2_000_000 + DGW_PASTBLOCKS):
+            window.push(self.headers[height])
+        self.assertTrue(window.is_ready_for(2_000_000 + DGW_PASTBLOCKS))
+        window.push(self.headers[2_000_000 + DGW_PASTBLOCKS + 5])
+        self.assertFalse(window.is_ready_for(2_000_000 + DGW_PASTBLOCKS + 6))
+
+    def test_json_roundtrip(self):
+        window = DGWWindow()
+        for height in range(2_000_001, 2_000_001 + DGW_PASTBLOCKS):
+            window.push(self.headers[height])
+        height = 2_000_001 + DGW_PASTBLOCKS
+        restored = DGWWindow.from_json(json.loads(json.dumps(window.to_json())))
+        self.assertTrue(restored.is_ready_for(height))
+        self.assertEqual(self.chain.get_target_dgwv3(height, self.headers),
+                         self.chain.get_target_dgwv3(height, self.headers, restored))
+
+    def test_self_check(self):
+        self.config.BLOCKCHAIN_DGW_SELF_CHECK = True
+        height = 2_000_000 + 2 * DGW_PASTBLOCKS
+        window = DGWWindow()
+        self.assertEqual(self.chain.get_target_dgwv3(height, self.headers),
+                         self.chain.get_target_dgwv3(height, self.headers, window))
+        # corrupt the window; the self-check should catch it
+        window._timestamps[0] -= 1000
+        with self.assertRaises(Exception):
+            self.chain.get_target_dgwv3(height, self.headers, window)
+
+
+class TestHashChunkHeaders(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.start_height = 100
+        header = deserialize_header(bfh(TestVerifyHeader.valid_header), self.start_height)
+        self.headers = []
+        for i in range(10):
+            h = dict(header, nonce=i, block_height=self.start_height + i)
+            self.headers.append(h)
+        self.data = b''.join(bfh(serialize_header(h))[:80] for h in self.headers)
+
+    def tearDown(self):
+        blockchain.shutdown_pow_executor()
+        super().tearDown()
+
+    async def test_serial_and_pool_agree(self):
+        expected = [hash_header(h) for h in self.headers]
+        for num_workers in (1, 3):
+            config = SimpleConfig({'electrum_path': self.electrum_path, 'pow_verify_workers': num_workers})
+            self.assertEqual(expected, await blockchain.hash_chunk_headers(config, self.start_height, self.data))
+
+    def test_split_chunk_rejects_truncated_data(self):
+        self.assertEqual(10, len(blockchain.split_chunk(self.start_height, self.data)))
+        with self.assertRaises(Exception):
+            blockchain.split_chunk(self.start_height, self.data[:-1])
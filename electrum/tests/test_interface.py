@@ -1,4 +1,11 @@
-from electrum.interface import ServerAddr
+import asyncio
+import json
+import time
+from unittest import mock
+
+from aiorpcx import RPCError
+
+from electrum.interface import ServerAddr, NotificationSession, AdaptiveRequestLimiter, RequestTimedOut
 
 from . import ElectrumTestCase
 
@@ -46,3 +53,121 @@ class TestServerAddr(ElectrumTestCase):
                          ServerAddr(host="2400:6180:0:d1::86b:e001", port=50002, protocol="s").to_friendly_name())
         self.assertEqual("[2400:6180:0:d1::86b:e001]:50001:t",
                          ServerAddr(host="2400:6180:0:d1::86b:e001", port=50001, protocol="t").to_friendly_name())
+
+
+class TestNotificationSession(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.session = NotificationSession(mock.Mock(), interface=mock.Mock())
+        self.sent = []
+
+        async def send_message(message):
+            requests = json.loads(message)
+            self.sent.append(requests)
+            responses = []
+            for r in requests:
+                if r['params'][0] == 'bad':
+                    responses.append({'jsonrpc': '2.0', 'id': r['id'], 'error': {'code': 1, 'message': 'bad'}})
+                else:
+                    responses.append({'jsonrpc': '2.0', 'id': r['id'], 'result': r['params'][0] + '_status'})
+            self.session.connection.receive_message(json.dumps(responses).encode())
+            return time.time()
+        self.session._send_message = send_message
+
+    async def test_send_request_batch(self):
+        results = await self.session.send_request_batch([('m', ['a']), ('m', ['bad']), ('m', ['c'])])
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(['a', 'bad', 'c'], [r['params'][0] for r in self.sent[0]])
+        self.assertEqual('a_status', results[0])
+        self.assertIsInstance(results[1], RPCError)
+        self.assertEqual('c_status', results[2])
+
+    async def test_subscribe_batch(self):
+        q1, q2 = asyncio.Queue(), asyncio.Queue()
+        await self.session.subscribe_batch([('m', ['a'], q1), ('m', ['b'], q2)])
+        self.assertEqual(1, len(self.sent))
+        self.assertEqual(['a', 'a_status'], q1.get_nowait())
+        self.assertEqual(['b', 'b_status'], q2.get_nowait())
+        # cached results are not requested again
+        await self.session.subscribe_batch([('m', ['a'], q1), ('m', ['c'], q2)])
+        self.assertEqual(['c'], [r['params'][0] for r in self.sent[1]])
+        self.assertEqual(['a', 'a_status'], q1.get_nowait())
+        self.assertEqual(['c', 'c_status'], q2.get_nowait())
+        # errors are raised after the other results are delivered
+        with self.assertRaises(RPCError):
+            await self.session.subscribe_batch([('m', ['bad'], q1), ('m', ['d'], q2)])
+        self.assertTrue(q1.empty())
+        self.assertEqual(['d', 'd_status'], q2.get_nowait())
+
+
+class TestAdaptiveRequestLimiter(ElectrumTestCase):
+
+    def test_window_grows_while_rtt_flat(self):
+        limiter = AdaptiveRequestLimiter(max_window=40)
+        for _ in range(1000):
+            limiter.on_response(0.010)
+        self.assertEqual(40, limiter.get_stats()['window'])
+
+    def test_window_shrinks_on_inflated_rtt_and_timeouts(self):
+        limiter = AdaptiveRequestLimiter(max_window=100)
+        limiter.on_response(0.010)
+        limiter.on_response(0.050)
+        self.assertEqual(int(32 * limiter.DECREASE_FACTOR), limiter.get_stats()['window'])
+        # at most one decrease per round trip
+        limiter.on_response(0.050)
+        self.assertEqual(int(32 * limiter.DECREASE_FACTOR), limiter.get_stats()['window'])
+        limiter._last_decrease = 0
+        limiter.on_timeout(30)
+        self.assertEqual(int(32 * limiter.DECREASE_FACTOR * limiter.TIMEOUT_DECREASE_FACTOR),
+                         limiter.get_stats()['window'])
+        self.assertEqual(1, limiter.get_stats()['timeouts'])
+        for _ in range(10):
+            limiter._last_decrease = 0
+            limiter.on_timeout(30)
+        self.assertEqual(limiter.WINDOW_MIN, limiter.get_stats()['window'])
+
+    def test_stats(self):
+        limiter = AdaptiveRequestLimiter(max_window=100)
+        self.assertEqual({'p50': None, 'p90': None, 'p99': None}, limiter.get_stats()['rtt_ms'])
+        for i in range(1, 101):
+            limiter.on_response(i / 1000)
+        self.assertEqual({'p50': 51, 'p90': 91, 'p99': 100}, limiter.get_stats()['rtt_ms'])
+
+    async def test_slot_measures_requests(self):
+        limiter = AdaptiveRequestLimiter(max_window=100)
+        async with limiter.slot():
+            self.assertEqual(1, limiter.in_flight)
+        with self.assertRaises(RPCError):
+            async with limiter.slot():
+                raise RPCError(1, 'no such tx')
+        async with limiter.slot(measure_rtt=False):
+            pass
+        with self.assertRaises(RequestTimedOut):
+            async with limiter.slot():
+                raise RequestTimedOut()
+        self.assertEqual(0, limiter.in_flight)
+        self.assertEqual(2, len(limiter._rtts))
+        self.assertEqual(1, limiter.num_timeouts)
+
+    async def test_waiters_served_round_robin(self):
+        limiter = AdaptiveRequestLimiter(max_window=4)
+        for _ in range(4):
+            await limiter.acquire('big')
+        order = []
+
+        async def request(owner):
+            await limiter.acquire(owner)
+            order.append(owner)
+
+        tasks = [asyncio.create_task(request('big')) for _ in range(3)]
+        tasks.append(asyncio.create_task(request('small')))
+        cancelled = asyncio.create_task(request('small'))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        for _ in range(4):
+            limiter.release()
+        await asyncio.gather(*tasks)
+        self.assertEqual(['big', 'small', 'big', 'big'], order)
+        self.assertEqual(4, limiter.in_flight)
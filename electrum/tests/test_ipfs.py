@@ -1,9 +1,22 @@
 import asyncio
+import os
+import time
+from unittest import mock
+
+import dag_cbor
+from multiformats import CID, multihash, varint
+from ipfs_car_decoder import stream_bytes, ChunkedMemoryByteStream, CarDecodeException
 
 from electrum import SimpleConfig
 from electrum import Network
 from electrum import util
+from electrum.util import OldTaskGroup
 from electrum import ipfs_db
+from electrum.ipfs_db import (IPFSBlobStore, IPFSBlobTooLarge, IPFSGatewayStats, race_gateways, CARResponseStream,
+                              IPFSPrefetchScheduler, IPFSMetadata, IPFSDB,
+                              cidv0_to_base32_cidv1, base32_cidv1_to_cidv0)
+
+from . import ElectrumTestCase
 
 if __name__ == 'x__main__':
     loop, stop_loop, loop_thread = util.create_and_start_event_loop()
@@ -22,3 +35,264 @@ if __name__ == 'x__main__':
     #loop.call_soon_threadsafe(stop_loop.set_result, 1)
     #loop_thread.join(timeout=1)
 
+
+IPFS_HASHES = ['QmUuSYPSULsPxW15gs4LPYpei78tZ1EZ5jiLQL13huoPzi',
+               'QmaSxufBEa9nGaoC5XTtECMmT8t5YNGcJrNcj7uWFqTkSD',
+               'QmQPeNsJPyVWPFDVHb77w8G42Fvo15z4bG2X8D2GhfbSXc']
+
+
+async def chunks_of(data: bytes, chunk_size: int = 100):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+
+def make_car(data: bytes, *, other_blocks=()):
+    """Returns a CAR with data as a raw block, after other_blocks, and the CID of that block."""
+    car = b''
+    for block_data in list(other_blocks) + [data]:
+        cid = CID('base32', 1, 'raw', multihash.digest(block_data, 'sha2-256'))
+        block = bytes(cid) + block_data
+        car += varint.encode(len(block)) + block
+    header = dag_cbor.encode({'version': 1, 'roots': [cid]})
+    return cid, varint.encode(len(header)) + header + car
+
+
+class TestIPFSBlobStore(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.evicted = []
+        self.store = self._make_store(max_size=2500)
+
+    def _make_store(self, max_size: int) -> IPFSBlobStore:
+        return IPFSBlobStore(self.electrum_path, max_size, on_evict=self.evicted.append)
+
+    def test_cid_conversion(self):
+        for ipfs_hash in IPFS_HASHES:
+            self.assertEqual(ipfs_hash, base32_cidv1_to_cidv0(cidv0_to_base32_cidv1(ipfs_hash)))
+
+    async def test_lru_eviction(self):
+        for ipfs_hash in IPFS_HASHES[:2]:
+            await self.store.add_from_stream(ipfs_hash, chunks_of(bytes(1000)), max_size=10_000)
+        self.assertEqual(2000, self.store.total_size)
+        # make the first one the most recently used
+        self.assertIsNotNone(self.store.get_path(IPFS_HASHES[0]))
+        await self.store.add_from_stream(IPFS_HASHES[2], chunks_of(bytes(1000)), max_size=10_000)
+        self.assertEqual([IPFS_HASHES[1]], self.evicted)
+        self.assertEqual(2000, self.store.total_size)
+        self.assertIsNone(self.store.get_path(IPFS_HASHES[1]))
+        self.assertFalse(os.path.exists(self.store.path_for(IPFS_HASHES[1])))
+        self.store.set_max_size(1000)
+        self.assertEqual([IPFS_HASHES[1], IPFS_HASHES[0]], self.evicted)
+
+    async def test_rescan(self):
+        for ipfs_hash in IPFS_HASHES[:2]:
+            await self.store.add_from_stream(ipfs_hash, chunks_of(bytes(1000)), max_size=10_000)
+        # access order is kept as mtimes
+        os.utime(self.store.path_for(IPFS_HASHES[1]), (time.time() - 100,) * 2)
+        open(os.path.join(self.electrum_path, 'x.dat.part'), 'wb').close()
+        store = self._make_store(max_size=1000)
+        self.assertEqual(2000, store.total_size)
+        self.assertEqual(IPFS_HASHES[1::-1], store.get_hashes())
+        self.assertFalse(os.path.exists(os.path.join(self.electrum_path, 'x.dat.part')))
+        store.set_max_size(1000)
+        self.assertEqual([IPFS_HASHES[1]], self.evicted)
+
+    async def test_too_large(self):
+        with self.assertRaises(IPFSBlobTooLarge):
+            await self.store.add_from_stream(IPFS_HASHES[0], chunks_of(bytes(1000)), max_size=999)
+        self.assertNotIn(IPFS_HASHES[0], self.store)
+        self.assertEqual(0, self.store.total_size)
+        self.assertEqual([], os.listdir(self.electrum_path))
+
+    async def test_verified_car_stream(self):
+        data = os.urandom(1000)
+        cid, car = make_car(data)
+
+        async def add(car: bytes):
+            stream = ChunkedMemoryByteStream()
+            await stream.append_bytes(car)
+            await stream.mark_complete()
+            await self.store.add_from_stream(IPFS_HASHES[0], stream_bytes(cid, stream), max_size=10_000)
+
+        with self.assertRaises(CarDecodeException):
+            await add(car[:-1] + bytes([car[-1] ^ 1]))
+        self.assertNotIn(IPFS_HASHES[0], self.store)
+        await add(car)
+        with open(self.store.get_path(IPFS_HASHES[0]), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    async def test_decode_while_receiving(self):
+        data = os.urandom(5000)
+        cid, car = make_car(data, other_blocks=[os.urandom(1000)])
+        stream = CARResponseStream(max_size=len(car))
+
+        async def receive_car():
+            for i in range(0, len(car), 300):
+                await asyncio.sleep(0.001)
+                await stream.append_bytes(car[i:i + 300])
+            await stream.mark_complete()
+
+        decode = asyncio.create_task(
+            self.store.add_from_stream(IPFS_HASHES[0], stream_bytes(cid, stream), max_size=10_000))
+        await receive_car()
+        self.assertEqual(len(data), await decode)
+        with open(self.store.get_path(IPFS_HASHES[0]), 'rb') as f:
+            self.assertEqual(data, f.read())
+        with self.assertRaises(IPFSBlobTooLarge):
+            await CARResponseStream(max_size=10).append_bytes(bytes(11))
+
+
+class TestGatewayRace(ElectrumTestCase):
+
+    def test_gateway_stats(self):
+        stats = IPFSGatewayStats()
+        self.assertEqual(['a', 'b', 'c'], stats.rank(['a', 'b', 'c']))
+        self.assertEqual(IPFSGatewayStats.DEFAULT_HEDGE_DELAY, stats.get_hedge_delay(60))
+        stats.record_first_byte('a', 1.0)
+        stats.record_first_byte('b', 0.5)
+        # gateways we know nothing about get tried first
+        self.assertEqual(['c', 'b', 'a'], stats.rank(['a', 'b', 'c']))
+        for _ in range(5):
+            stats.record_result('b', False)
+        self.assertEqual(['a', 'b'], stats.rank(['a', 'b']))
+        for i in range(100):
+            stats.record_first_byte('a', 0.01 * i)
+        self.assertAlmostEqual(0.89, stats.get_hedge_delay(60))
+        self.assertEqual(0.5, stats.get_hedge_delay(0.5))
+
+    async def test_hedges_slow_gateway(self):
+        calls = []
+
+        async def fetch(gateway, url, first_byte, started):
+            started.set()
+            calls.append(gateway)
+            if gateway == 'slow':
+                await asyncio.sleep(10)
+            await asyncio.sleep(0.01)
+
+        winner = await race_gateways([('slow', 'u1'), ('fast', 'u2'), ('other', 'u3')], fetch, hedge_delay=0.05)
+        self.assertEqual('fast', winner)
+        self.assertEqual(['slow', 'fast'], calls)
+
+    async def test_no_hedge_after_first_byte(self):
+        calls = []
+
+        async def fetch(gateway, url, first_byte, started):
+            started.set()
+            calls.append(gateway)
+            first_byte.set()
+            await asyncio.sleep(0.2)
+
+        winner = await race_gateways([('a', 'u1'), ('b', 'u2')], fetch, hedge_delay=0.01)
+        self.assertEqual('a', winner)
+        self.assertEqual(['a'], calls)
+
+    async def test_no_hedge_while_waiting_for_gateway(self):
+        calls = []
+        gateway_free = asyncio.Event()
+
+        async def fetch(gateway, url, first_byte, started):
+            calls.append(gateway)
+            await gateway_free.wait()
+            started.set()
+            first_byte.set()
+            await asyncio.sleep(0.01)
+
+        async def free_gateway():
+            await asyncio.sleep(0.1)
+            gateway_free.set()
+
+        asyncio.create_task(free_gateway())
+        winner = await race_gateways([('busy', 'u1'), ('other', 'u2')], fetch, hedge_delay=0.02)
+        self.assertEqual('busy', winner)
+        self.assertEqual(['busy'], calls)
+
+    async def test_failures_move_on(self):
+        calls = []
+
+        async def fetch(gateway, url, first_byte, started):
+            started.set()
+            calls.append(gateway)
+            raise Exception('bad gateway')
+
+        self.assertIsNone(await race_gateways([('a', 'u1'), ('b', 'u2')], fetch, hedge_delay=10))
+        self.assertEqual(['a', 'b'], calls)
+
+
+class TestPrefetchScheduler(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.network = mock.Mock()
+        self.network.taskgroup = OldTaskGroup()
+        self.network.config.IPFS_MAX_CONCURRENT_LOOKUPS = 2
+        self.started = []
+        self.release = asyncio.Event()
+        self.scheduler = IPFSPrefetchScheduler(self._lookup)
+
+    async def asyncTearDown(self):
+        await self.network.taskgroup.cancel_remaining()
+        await super().asyncTearDown()
+
+    async def _lookup(self, network, ipfs_hash):
+        self.started.append(ipfs_hash)
+        await self.release.wait()
+
+    async def test_priorities_and_budget(self):
+        P = IPFSPrefetchScheduler
+        self.assertTrue(await self.scheduler.schedule(self.network, 'w1', P.PRIORITY_WATCHED))
+        self.assertTrue(await self.scheduler.schedule(self.network, 'w2', P.PRIORITY_WATCHED))
+        self.assertTrue(await self.scheduler.schedule(self.network, 'o1', P.PRIORITY_OWNED))
+        # requested again by another wallet
+        self.assertFalse(await self.scheduler.schedule(self.network, 'o1', P.PRIORITY_WATCHED))
+        self.assertTrue(await self.scheduler.schedule(self.network, 'w2', P.PRIORITY_VISIBLE))
+        self.assertEqual(3, len(self.scheduler))
+        await asyncio.sleep(P.BATCH_DELAY + 0.05)
+        # at most 2 at a time, best first
+        self.assertEqual(['w2', 'o1'], self.started)
+        self.assertFalse(await self.scheduler.schedule(self.network, 'w2', P.PRIORITY_VISIBLE))
+        self.assertTrue(self.scheduler.is_pending('w1'))
+        self.release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(['w2', 'o1', 'w1'], self.started)
+        self.assertFalse(self.scheduler.is_pending('w1'))
+
+    async def test_discard(self):
+        await self.scheduler.schedule(self.network, 'a', IPFSPrefetchScheduler.PRIORITY_WATCHED)
+        await self.scheduler.schedule(self.network, 'b', IPFSPrefetchScheduler.PRIORITY_WATCHED)
+        self.scheduler.discard('a')
+        await asyncio.sleep(IPFSPrefetchScheduler.BATCH_DELAY + 0.05)
+        self.assertEqual(['b'], self.started)
+
+    async def test_worker_respawned_after_restart(self):
+        P = IPFSPrefetchScheduler
+        self.release.set()
+        await self.scheduler.schedule(self.network, 'a', P.PRIORITY_WATCHED)
+        # the network restarts before the queue is processed
+        await self.network.taskgroup.cancel_remaining()
+        self.network.taskgroup = OldTaskGroup()
+        self.assertFalse(await self.scheduler.schedule(self.network, 'a', P.PRIORITY_WATCHED))
+        await asyncio.sleep(P.BATCH_DELAY + 0.05)
+        self.assertEqual(['a'], self.started)
+
+    def test_owned_assets_computed_once_per_burst(self):
+        db = mock.Mock()
+        db._owned_assets = {}
+        adb = mock.Mock()
+        adb.get_balance.return_value = {None: (5, 0, 0), 'OWNED': (1, 0, 0), 'SPENT': (0, 0, 0)}
+        get_priority = lambda asset: IPFSDB._get_priority_for_asset(db, adb, asset)
+        self.assertEqual(IPFSPrefetchScheduler.PRIORITY_OWNED, get_priority('OWNED'))
+        self.assertEqual(IPFSPrefetchScheduler.PRIORITY_WATCHED, get_priority('SPENT'))
+        self.assertEqual(IPFSPrefetchScheduler.PRIORITY_WATCHED, get_priority('OTHER'))
+        adb.get_balance.assert_called_once()
+
+    def test_info_query_backoff(self):
+        m = IPFSMetadata()
+        cooldown = IPFSDB._get_info_query_cooldown
+        self.assertEqual(ipfs_db._LOOKUP_COOLDOWN_SEC, cooldown(m, IPFSPrefetchScheduler.PRIORITY_WATCHED))
+        m.failed_info_queries = 3
+        self.assertEqual(4 * ipfs_db._LOOKUP_COOLDOWN_SEC, cooldown(m, IPFSPrefetchScheduler.PRIORITY_WATCHED))
+        self.assertEqual(ipfs_db._LOOKUP_COOLDOWN_SEC, cooldown(m, IPFSPrefetchScheduler.PRIORITY_VISIBLE))
+        m.failed_info_queries = 100
+        self.assertEqual(ipfs_db._MAX_LOOKUP_BACKOFF_SEC, cooldown(m, IPFSPrefetchScheduler.PRIORITY_OWNED))
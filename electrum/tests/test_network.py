@@ -1,11 +1,14 @@
 import asyncio
 import tempfile
 import unittest
+from unittest import mock
 
 from electrum import constants
 from electrum.simple_config import SimpleConfig
 from electrum import blockchain
 from electrum.interface import Interface, ServerAddr
+from electrum.network import Network
+from electrum.server_scoreboard import ServerScoreboard
 from electrum.crypto import sha256
 from electrum.util import OldTaskGroup
 from electrum import util
@@ -127,6 +130,121 @@ class TestNetwork(ElectrumTestCase):
         self.assertEqual(self.interface.q.qsize(), 0)
 
 
+class MockChunkSession:
+
+    def __init__(self):
+        self.requests = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+
+    async def send_request(self, method, params):
+        assert method == 'blockchain.block.headers', method
+        height, size = params
+        self.requests.append(height)
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            # answer earlier chunks later, so that responses arrive out of order
+            await asyncio.sleep(0.05 if len(self.requests) % 2 else 0.01)
+        finally:
+            self._in_flight -= 1
+        return {'count': size, 'hex': '00' * blockchain.HEADER_SIZE * size, 'max': 2016}
+
+
+class TestRequestChunks(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.interface = MockInterface(self.config)
+        self.interface.session = MockChunkSession()
+        self.connected = []
+        self.start = constants.net.max_checkpoint() + 1
+        self.tip = self.start + 4 * 2016 + 99
+
+    async def _connect_chunk(self, height, hexdata):
+        self.connected.append((height, len(hexdata) // (2 * blockchain.HEADER_SIZE)))
+        return True
+
+    async def test_chunks_connected_in_order(self):
+        self.interface.blockchain.connect_chunk = self._connect_chunk
+        conn, num_headers = await self.interface.request_chunks(self.start, self.tip)
+        self.assertTrue(conn)
+        self.assertEqual(self.tip - self.start + 1, num_headers)
+        self.assertEqual([(self.start + i * 2016, 2016) for i in range(4)] + [(self.start + 4 * 2016, 100)],
+                         self.connected)
+        self.assertEqual(self.config.NETWORK_MAX_CHUNKS_IN_FLIGHT, self.interface.session.max_in_flight)
+
+    async def test_stops_at_first_chunk_that_does_not_connect(self):
+        async def connect_chunk(height, hexdata):
+            await self._connect_chunk(height, hexdata)
+            return height < self.start + 2016
+        self.interface.blockchain.connect_chunk = connect_chunk
+        conn, num_headers = await self.interface.request_chunks(self.start, self.tip)
+        self.assertFalse(conn)
+        self.assertEqual(2016, num_headers)
+        self.assertEqual([self.start, self.start + 2016], [h for h, _ in self.connected])
+
+
+class TestSwitchLaggingInterface(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.lagging = ServerAddr.from_str('lagging.example.com:50002:s')
+        self.other = ServerAddr.from_str('other.example.com:50002:s')
+        network = mock.Mock()
+        network.auto_connect = True
+        network.default_server = self.lagging
+        network._server_is_lagging = mock.AsyncMock(return_value=True)
+        network.blockchain.return_value.header_at_tip.return_value = 'tip'
+        network.interfaces_lock = mock.MagicMock()
+        network.interfaces = {
+            server: mock.Mock(server=server, tip_header='tip' if server == self.other else 'old')
+            for server in (self.lagging, self.other)
+        }
+        network.server_scores = ServerScoreboard(None)
+        network.switch_to_interface = mock.AsyncMock()
+        self.network = network
+
+    async def test_lag_recorded_on_switch(self):
+        self.network.get_server_height.return_value = 100
+        await Network.switch_lagging_interface(self.network)
+        self.network.switch_to_interface.assert_awaited_once_with(self.other)
+        self.assertEqual(1, self.network.server_scores._scores[str(self.lagging)]['lags'])
+
+    async def test_unknown_height_is_not_lag(self):
+        self.network.get_server_height.return_value = 0
+        await Network.switch_lagging_interface(self.network)
+        self.network.switch_to_interface.assert_awaited_once_with(self.other)
+        self.assertNotIn(str(self.lagging), self.network.server_scores._scores)
+
+
+class TestVerifySnapshotChains(ElectrumTestCase):
+
+    async def test_interfaces_moved_off_deleted_chains(self):
+        best, fork, fork_of_fork = mock.Mock(parent=None), mock.Mock(), mock.Mock()
+        fork.parent = best
+        fork_of_fork.parent = fork
+        chains = {'best': best, 'fork': fork, 'fork_of_fork': fork_of_fork}
+        network = mock.Mock()
+        network._chains_from_snapshot = True
+        network.bhi_lock = asyncio.Lock()
+        network.interfaces_lock = mock.MagicMock()
+        network.interfaces = {i: mock.Mock(blockchain=chain) for i, chain in enumerate([best, fork_of_fork])}
+        network._blockchain = fork_of_fork
+
+        def verify_snapshot_chains():
+            chains.pop('fork')
+            chains.pop('fork_of_fork')
+        with mock.patch.object(blockchain, 'blockchains', chains), \
+                mock.patch.object(blockchain, 'verify_snapshot_chains', verify_snapshot_chains), \
+                mock.patch.object(blockchain, 'get_best_chain', lambda: best):
+            await Network._verify_snapshot_chains(network)
+        self.assertEqual([best, best], [iface.blockchain for iface in network.interfaces.values()])
+        self.assertIs(best, network._blockchain)
+        self.assertFalse(network._chains_from_snapshot)
+
+
 if __name__=="__main__":
     constants.set_regtest()
     unittest.main()
@@ -0,0 +1,61 @@
+import os
+from unittest import mock
+
+from electrum.interface import ServerAddr
+from electrum.server_scoreboard import ServerScoreboard
+
+from . import ElectrumTestCase
+
+
+FAST = ServerAddr.from_str('fast.example.com:50002:s')
+SLOW = ServerAddr.from_str('slow.example.com:50002:s')
+NEW = ServerAddr.from_str('new.example.com:50002:s')
+
+
+class TestServerScoreboard(ElectrumTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.electrum_path, 'server_scores')
+        self.scores = ServerScoreboard(self.path)
+
+    def test_latency_and_errors(self):
+        for _ in range(20):
+            self.scores.record_request(FAST, 0.05)
+            self.scores.record_request(SLOW, 2.0)
+        self.assertGreater(self.scores.get_score(FAST), self.scores.get_score(NEW))
+        self.assertGreater(self.scores.get_score(NEW), self.scores.get_score(SLOW))
+        score = self.scores.get_score(FAST)
+        self.scores.record_request(FAST, None)
+        self.assertLess(self.scores.get_score(FAST), score)
+
+    def test_penalties_decay(self):
+        self.scores.record_request(FAST, 0.05)
+        score = self.scores.get_score(FAST)
+        self.scores.record_lag(FAST)
+        self.assertAlmostEqual(score * ServerScoreboard.LAG_PENALTY, self.scores.get_score(FAST))
+        self.scores.record_ban(FAST)
+        self.assertLess(self.scores.get_score(FAST), score * ServerScoreboard.BAN_PENALTY)
+        later = self.scores._scores[str(FAST)]['penalties_time'] + 10 * ServerScoreboard.PENALTY_HALF_LIFE
+        with mock.patch('electrum.server_scoreboard.time.time', return_value=later):
+            self.assertAlmostEqual(score, self.scores.get_score(FAST), places=2)
+
+    def test_persistence(self):
+        self.scores.record_request(SLOW, 2.0)
+        self.scores.record_ban(SLOW)
+        self.scores.maybe_save()  # throttled
+        self.assertFalse(os.path.exists(self.path))
+        self.scores.save()
+        scores = ServerScoreboard(self.path)
+        self.assertAlmostEqual(self.scores.get_score(SLOW), scores.get_score(SLOW))
+        self.assertEqual(0.5, ServerScoreboard(None).get_score(SLOW))
+
+    def test_weighted_selection_prefers_high_scores(self):
+        for _ in range(20):
+            self.scores.record_request(SLOW, 5.0)
+        self.scores.record_ban(SLOW)
+        firsts = [self.scores.weighted_shuffle([SLOW, FAST])[0] for _ in range(200)]
+        self.assertGreater(firsts.count(FAST), 180)
+        self.assertEqual({SLOW, FAST}, set(self.scores.weighted_shuffle([SLOW, FAST])))
+        choices = [self.scores.weighted_choice([SLOW, FAST]) for _ in range(200)]
+        self.assertGreater(choices.count(FAST), 180)
@@ -0,0 +1,59 @@
+from electrum import util
+from electrum.simple_config import SimpleConfig
+from electrum.spv_cache import SPVCache
+
+from . import ElectrumTestCase
+
+
+class MockNetwork:
+
+    def __init__(self, config):
+        self.config = config
+        self.asyncio_loop = util.get_asyncio_loop()
+
+
+class TestSPVCache(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_path})
+        self.cache = SPVCache(MockNetwork(self.config))
+
+    async def asyncTearDown(self):
+        self.cache.stop()
+        await self.cache.stopped_event.wait()
+        await super().asyncTearDown()
+
+    async def test_transactions(self):
+        self.assertIsNone(await self.cache.get_transaction('aa' * 32))
+        await self.cache.add_transaction('aa' * 32, '0100ff')
+        self.assertEqual('0100ff', await self.cache.get_transaction('aa' * 32))
+        await self.cache.add_transaction('aa' * 32, '0200')
+        self.assertEqual('0200', await self.cache.get_transaction('aa' * 32))
+        self.assertEqual(2, (await self.cache.get_stats())['size_bytes'])
+
+    async def test_merkle_checked_against_header_hash(self):
+        merkle = {'block_height': 10, 'pos': 1, 'merkle': ['bb' * 32]}
+        await self.cache.add_merkle('aa' * 32, merkle, 'cc' * 32)
+        self.assertEqual(merkle, await self.cache.get_merkle('aa' * 32, 'cc' * 32))
+        # after a reorg, the proof is not returned
+        self.assertIsNone(await self.cache.get_merkle('aa' * 32, 'dd' * 32))
+
+    async def test_evicts_least_recently_used(self):
+        self.cache.max_size = 100
+        for i in range(2):
+            await self.cache.add_transaction('%064x' % i, '00' * 40)
+        # touch the first tx, so the second one is the oldest
+        await self.cache.get_transaction('%064x' % 0)
+        await self.cache.add_transaction('%064x' % 2, '00' * 40)
+        self.assertIsNone(await self.cache.get_transaction('%064x' % 1))
+        self.assertIsNotNone(await self.cache.get_transaction('%064x' % 0))
+        self.assertEqual({'entries': 2, 'size_bytes': 80, 'max_bytes': 100}, await self.cache.get_stats())
+
+    async def test_persists(self):
+        await self.cache.add_transaction('aa' * 32, '0100ff')
+        self.cache.stop()
+        await self.cache.stopped_event.wait()
+        self.cache = SPVCache(MockNetwork(self.config))
+        self.assertEqual('0100ff', await self.cache.get_transaction('aa' * 32))
+        self.assertEqual(3, (await self.cache.get_stats())['size_bytes'])
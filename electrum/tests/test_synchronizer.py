@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from unittest import mock
+
+from electrum.bitcoin import address_to_scripthash
+from electrum.interface import AdaptiveRequestLimiter, RequestCorrupted, ServerAddr
+from electrum.synchronizer import Synchronizer, history_status
+
+from . import ElectrumTestCase
+
+
+ADDR = 'R9HC5WtHbpoa51NCUAz86XLCmGTbkf45NT'
+HIST = [{'tx_hash': '11' * 32, 'height': 10}, {'tx_hash': '22' * 32, 'height': 12}]
+
+
+class TestShardedSync(ElectrumTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.blockchain = mock.Mock()
+        self.interfaces = [self._make_interface(i) for i in range(3)]
+        network = mock.Mock()
+        network.interface = None
+        network.asyncio_loop = asyncio.get_running_loop()
+        network.interfaces_lock = threading.Lock()
+        network.interfaces = {iface.server: iface for iface in self.interfaces}
+        network.config.NETWORK_SHARDED_SYNC = True
+        network.config.NETWORK_SHARDED_SYNC_CROSSCHECK_FRACTION = 0
+        adb = mock.Mock()
+        adb.network = network
+        adb.db.get_addr_history.return_value = []
+        self.adb = adb
+        self.sync = Synchronizer(adb)
+        self.sync.interface = self.interfaces[0]
+
+    async def asyncTearDown(self):
+        await self.sync.stop()
+        await super().asyncTearDown()
+
+    def _make_interface(self, i: int):
+        iface = mock.Mock()
+        iface.server = ServerAddr(host=f'server{i}', port=50002)
+        iface.is_connected_and_ready.return_value = True
+        iface.blockchain = self.blockchain
+        iface.tip = 100
+        iface.request_limiter = AdaptiveRequestLimiter(max_window=10)
+        return iface
+
+    async def test_requests_spread_over_interfaces(self):
+        release = asyncio.Event()
+
+        async def request(iface):
+            await release.wait()
+            return iface.server
+
+        tasks = [asyncio.create_task(self.sync._send_sharded(request)) for _ in range(6)]
+        await asyncio.sleep(0)
+        release.set()
+        servers = [server for _, server in await asyncio.gather(*tasks)]
+        for iface in self.interfaces:
+            self.assertEqual(2, servers.count(iface.server))
+
+    async def test_only_main_interface_when_disabled(self):
+        self.sync.network.config.NETWORK_SHARDED_SYNC = False
+        self.assertEqual([self.interfaces[0]], self.sync._get_shard_interfaces())
+
+    async def test_skips_lagging_interfaces(self):
+        self.interfaces[1].tip = 99
+        self.interfaces[2].blockchain = mock.Mock()
+        self.assertEqual([self.interfaces[0]], self.sync._get_shard_interfaces())
+
+    async def test_falls_back_to_main_interface(self):
+        main, other = self.interfaces[0], self.interfaces[1]
+        self.sync.network.interfaces.pop(self.interfaces[2].server)
+        self.sync._shard_requests_in_flight[main.server] = 1
+
+        async def request(iface):
+            if iface is other:
+                raise RequestCorrupted('garbage')
+            return 'ok'
+
+        self.assertEqual((main, 'ok'), await self.sync._send_sharded(request))
+        self.assertIn(other.server, self.sync._distrusted_servers)
+        self.assertEqual([main], self.sync._get_shard_interfaces())
+
+    async def test_history_status_mismatch_retries_main_interface(self):
+        main, other = self.interfaces[0], self.interfaces[1]
+        self.sync.network.interfaces.pop(self.interfaces[2].server)
+        self.sync._shard_requests_in_flight[main.server] = 1
+        main.get_history_for_scripthash = mock.AsyncMock(return_value=HIST)
+        other.get_history_for_scripthash = mock.AsyncMock(return_value=HIST[:1])
+        hist = [(item['tx_hash'], item['height']) for item in HIST]
+        await self.sync._on_address_status(ADDR, history_status(hist))
+        other.get_history_for_scripthash.assert_awaited_once_with(address_to_scripthash(ADDR))
+        main.get_history_for_scripthash.assert_awaited_once_with(address_to_scripthash(ADDR))
+        self.adb.receive_history_callback.assert_called_once_with(ADDR, hist, {})
+        # a server lagging behind the main one is not distrusted
+        self.assertNotIn(other.server, self.sync._distrusted_servers)
+
+    async def test_crosscheck_mismatch_distrusts_server(self):
+        main, other = self.interfaces[0], self.interfaces[1]
+        self.sync.network.interfaces.pop(self.interfaces[2].server)
+        other.get_history_for_scripthash = mock.AsyncMock(return_value=HIST[:1])
+        hist = [(item['tx_hash'], item['height']) for item in HIST]
+        await self.sync._crosscheck_status(ADDR, history_status(hist), main)
+        self.assertIn(other.server, self.sync._distrusted_servers)
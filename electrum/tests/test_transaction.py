@@ -127,6 +127,26 @@ class TestTransaction(ElectrumTestCase):
 
         self.assertEqual(tx.serialize(), signed_blob)
 
+    def test_tx_outputs_parsed_without_inputs(self):
+        for blob in (signed_blob, signed_segwit_blob):
+            tx = transaction.Transaction(blob)
+            outputs = tx.outputs()
+            self.assertIsNone(tx._inputs)
+            full = transaction.Transaction(blob)
+            full.deserialize()
+            self.assertEqual(full.outputs(), outputs)
+            # full deserialization keeps the outputs already handed out
+            tx.deserialize()
+            self.assertIs(outputs, tx.outputs())
+            self.assertEqual(tx.serialize(), blob)
+
+    def test_tx_setting_locktime_after_parsing_outputs(self):
+        tx = transaction.Transaction(signed_blob)
+        tx.outputs()
+        tx.locktime = 5
+        self.assertEqual(1, len(tx.inputs()))
+        self.assertEqual(5, tx.locktime)
+
     def test_estimated_tx_size(self):
         tx = transaction.Transaction(signed_blob)
 
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
+import asyncio
+from unittest import mock
+
+from aiorpcx import RPCError
 
 from electrum.bitcoin import hash_encode
-from electrum.transaction import Transaction
+from electrum.crypto import sha256d
+from electrum.interface import AdaptiveRequestLimiter
+from electrum.transaction import Transaction, is_deserializable_tx
 from electrum.util import bfh
 from electrum.verifier import SPV, InnerNodeOfSpvProofIsValidTx
 
@@ -49,3 +55,65 @@ class VerifierTestCase(ElectrumTestCase):
         f_tx_hash = hash_encode(bfh(VALID_64_BYTE_TX[:64]))
         with self.assertRaises(InnerNodeOfSpvProofIsValidTx):
             SPV.hash_merkle_root(fake_mbranch, f_tx_hash, 6)
+
+    def test_inner_node_check_matches_deserialize(self):
+        def deserializes(raw: bytes) -> bool:
+            try:
+                Transaction(raw.hex()).deserialize()
+            except Exception:
+                return False
+            return True
+        valid = bfh(VALID_64_BYTE_TX)
+        # version, marker, 1 input with empty script_sig, 1 output with a 1-byte script, empty witness, locktime
+        segwit = (bytes.fromhex('02000000' '0001' '01') + bytes(range(36)) + bytes.fromhex('00' 'ffffffff' '01')
+                  + (1000).to_bytes(8, 'little') + bytes.fromhex('0151' '00' '00000000'))
+        assert len(segwit) == 64
+        corpus = [valid, segwit, valid[:63], valid + b'\x00']
+        for raw in (valid, segwit):
+            for i in range(len(raw)):
+                for v in (0x00, 0x01, 0x02, 0x40, 0xfc, 0xfd, 0xfe, 0xff):
+                    corpus.append(raw[:i] + bytes([v]) + raw[i + 1:])
+        results = [is_deserializable_tx(raw) for raw in corpus]
+        self.assertEqual([deserializes(raw) for raw in corpus], results)
+        self.assertTrue(results[0] and results[1])
+        self.assertGreater(sum(results), 50)
+        self.assertGreater(len(results) - sum(results), 50)
+
+
+class TestBatchedProofs(ElectrumTestCase):
+
+    async def test_verify_unverified_transactions(self):
+        txids = [hash_encode(sha256d(bytes([i]))) for i in range(4)]
+        headers = {
+            10: {'merkle_root': SPV.hash_merkle_root([txids[1]], txids[0], 0)},
+            11: {'merkle_root': txids[2]},
+        }
+        network = mock.Mock()
+        network.interface = None
+        network.spv_cache = None
+        network.bhi_lock = asyncio.Lock()
+        network.config.NETWORK_SKIPMERKLECHECK = False
+        network.asyncio_loop = asyncio.get_running_loop()
+        network.blockchain().read_header = mock.Mock(side_effect=lambda height: headers.get(height))
+        wallet = mock.Mock()
+        spv = SPV(network, wallet)
+        spv.interface = mock.Mock()
+        spv.interface.request_limiter = AdaptiveRequestLimiter(max_window=10)
+        spv.interface.get_merkles_for_transactions = mock.AsyncMock(return_value=[
+            {'block_height': 10, 'pos': 0, 'merkle': [txids[1]]},
+            {'block_height': 10, 'pos': 1, 'merkle': [txids[0]]},
+            {'block_height': 11, 'pos': 0, 'merkle': []},
+            RPCError(1, 'tx not in block'),
+        ])
+        txs = [(txids[0], 10), (txids[1], 10), (txids[2], 11), (txids[3], 12)]
+        network.blockchain().get_header_hash = mock.Mock(side_effect=lambda header: header['merkle_root'])
+        await spv._verify_unverified_transactions(txs)
+        # one request for all proofs, and one header read per block
+        spv.interface.get_merkles_for_transactions.assert_awaited_once_with(txs)
+        self.assertEqual([10, 11, 12], sorted(c.args[0] for c in network.blockchain().read_header.call_args_list))
+        self.assertEqual([(txids[0], 10, 0), (txids[1], 10, 1), (txids[2], 11, 0)],
+                         [(c.args[0], c.args[1].height, c.args[1].txpos) for c in wallet.add_verified_tx.call_args_list])
+        wallet.remove_unverified_tx.assert_called_once_with(txids[3], 12)
+        self.assertEqual(3, spv.get_verification_progress()['verified'])
+        self.assertEqual((4, 4), spv.num_requests_sent_and_answered())
+        await spv.stop()
@@ -7,17 +7,22 @@ from decimal import Decimal
 import time
 from io import StringIO
 import asyncio
+from unittest import mock
 
-from electrum.storage import WalletStorage
+from electrum.storage import WalletStorage, StorageEncryptionVersion
 from electrum.wallet_db import FINAL_SEED_VERSION
 from electrum.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
                              restore_wallet_from_text, Imported_Wallet, Wallet)
 from electrum.exchange_rate import ExchangeBase, FxThread
 from electrum.util import TxMinedInfo, InvalidPassword
 from electrum.bitcoin import COIN
-from electrum.wallet_db import WalletDB
+from electrum.wallet_db import WalletDB, ParsedTxCache
+from electrum.transaction import (Transaction, PartialTransaction, PartialTxInput, PartialTxOutput,
+                                  TxOutpoint)
+from electrum.json_db import StoredDict, modifier
 from electrum.simple_config import SimpleConfig
-from electrum import util
+from electrum.blockchain import MissingHeader
+from electrum import util, bitcoin
 
 from . import ElectrumTestCase
 
@@ -84,6 +89,327 @@ class TestWalletStorage(WalletTestCase):
         for key, value in some_dict.items():
             self.assertEqual(d[key], value)
 
+    def _create_db_with_stored_dict(self):
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB('', storage=storage, manual_upgrades=True)
+        db.data = StoredDict(db.data, db, [])
+        db.write()
+        return db
+
+    def test_write_appends_journal(self):
+        db = self._create_db_with_stored_dict()
+        size_after_full_write = os.path.getsize(self.wallet_path)
+        db.get_dict('labels')['abc'] = 'some label'
+        db.put('a', 'b')
+        db.write()
+        db.data.pop('a')
+        db.get_dict('labels')[1] = 'int key'
+        db.write()
+        with open(self.wallet_path, "r") as f:
+            contents = f.read()
+        self.assertEqual(2, contents[size_after_full_write:].count('\n'))
+
+        storage = WalletStorage(self.wallet_path)
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual({'abc': 'some label', '1': 'int key'}, db2.get('labels'))
+        self.assertEqual(None, db2.get('a'))
+        self.assertEqual(FINAL_SEED_VERSION, db2.get('seed_version'))
+
+    def test_journal_list_mutated_in_place(self):
+        db = self._create_db_with_stored_dict()
+        d = db.get_dict('unacked')
+        d['1'] = ['aa']
+        db.write()
+        l = d['1']
+        l.append('bb')
+        d['1'] = l
+        db.put('other', 'x')
+        db.write()
+
+        storage = WalletStorage(self.wallet_path)
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual({'1': ['aa', 'bb']}, db2.get('unacked'))
+        self.assertEqual('x', db2.get('other'))
+
+    def test_modifier_without_patch_rewrites_file(self):
+        db = self._create_db_with_stored_dict()
+        db.put('plain', ['aa'])
+        db.write()
+
+        @modifier
+        def append_in_place(db):
+            db.get('plain').append('bb')
+        append_in_place(db)
+        db.put('other', 'x')
+        db.write()
+
+        storage = WalletStorage(self.wallet_path)
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual(['aa', 'bb'], db2.get('plain'))
+        self.assertEqual('x', db2.get('other'))
+
+    def test_torn_journal_record_is_discarded(self):
+        db = self._create_db_with_stored_dict()
+        db.put('a', 'b')
+        db.write()
+        db.put('c', 'd')
+        db.write()
+        with open(self.wallet_path, "r") as f:
+            contents = f.read()
+        with open(self.wallet_path, "w") as f:
+            f.write(contents[:-5])
+
+        storage = WalletStorage(self.wallet_path)
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual('b', db2.get('a'))
+        self.assertEqual(None, db2.get('c'))
+        # the next write folds the journal back into a single json document
+        db2.data = StoredDict(db2.data, db2, [])
+        db2.put('e', 'f')
+        db2.write()
+        with open(self.wallet_path, "r") as f:
+            d = json.loads(f.read())
+        self.assertEqual('b', d['a'])
+        self.assertEqual('f', d['e'])
+
+    def test_journal_is_compacted(self):
+        db = self._create_db_with_stored_dict()
+        for i in range(100):
+            db.put('key', 'x' * 100 + str(i))
+            db.write()
+        with open(self.wallet_path, "r") as f:
+            contents = f.read()
+        self.assertLess(len(contents), 2 * len(db.dump()) + 1000)
+        storage = WalletStorage(self.wallet_path)
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual('x' * 100 + '99', db2.get('key'))
+
+    def test_encrypted_journal(self):
+        db = self._create_db_with_stored_dict()
+        db.storage.set_password('secret', enc_version=StorageEncryptionVersion.USER_PASSWORD)
+        db.set_modified(True)
+        db.write()
+        db.put('a', 'b')
+        db.write()
+        with open(self.wallet_path, "r") as f:
+            self.assertEqual(1, f.read().count('\n'))
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_encrypted_with_user_pw())
+        storage.decrypt('secret')
+        db2 = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        self.assertEqual('b', db2.get('a'))
+
+
+class TestWalletSqlStorage(WalletTestCase):
+
+    def _open_db(self):
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB(storage.read(), storage=storage, manual_upgrades=True)
+        db._load_assets()
+        return db
+
+    def _create_db(self):
+        storage = WalletStorage(self.wallet_path)
+        db = WalletDB('', storage=storage, manual_upgrades=True)
+        db._load_assets()
+        db.add_txo_addr('aa' * 32, 'addr1', 0, 1000, None, False)
+        db.add_txo_addr('aa' * 32, 'addr1', 1, 2000, 'ASSET', False)
+        db.set_addr_history('addr1', [('aa' * 32, 100)])
+        db.add_verified_tx('aa' * 32, TxMinedInfo(height=100, timestamp=1, txpos=2, header_hash='00' * 32))
+        db.add_verified_broadcast('ASSET', 'bb' * 32, {'tx_pos': 0, 'height': 100, 'data': 'x'})
+        db.write()
+        return db
+
+    def test_migrate_and_reopen(self):
+        db = self._create_db()
+        db.migrate_to_sql()
+        db.write()
+        self.assertTrue(os.path.exists(self.wallet_path + '.sqlite'))
+        with open(self.wallet_path, "r") as f:
+            d = json.loads(f.read())
+        self.assertNotIn('txo', d)
+        self.assertNotIn('addr_history', d)
+
+        db2 = self._open_db()
+        self.assertTrue(db2.is_sql_backed())
+        self.assertEqual({0: (1000, None, False), 1: (2000, 'ASSET', False)},
+                         db2.get_txo_addr('aa' * 32, 'addr1'))
+        self.assertEqual([['aa' * 32, 100]], db2.get_addr_history('addr1'))
+        self.assertEqual(100, db2.get_verified_tx('aa' * 32).height)
+        self.assertEqual('x', db2.get_verified_broadcast('ASSET', 'bb' * 32)['data'])
+        self.assertEqual(['aa' * 32], db2.list_txo())
+
+        # nested changes to a stored row, and removals
+        db2.add_txo_addr('aa' * 32, 'addr1', 2, 3000, None, False)
+        db2.remove_verified_tx('aa' * 32)
+        db2.write()
+        db3 = self._open_db()
+        self.assertEqual(3000, db3.get_txo_addr('aa' * 32, 'addr1')[2][0])
+        self.assertIsNone(db3.get_verified_tx('aa' * 32))
+
+    def test_dump_is_self_contained(self):
+        db = self._create_db()
+        db.migrate_to_sql()
+        db.write()
+        d = json.loads(db.dump())
+        self.assertNotIn(WalletDB.SQL_TABLES_KEY, d)
+        self.assertEqual({'addr1': {'0': [1000, None, False], '1': [2000, 'ASSET', False]}}, d['txo']['aa' * 32])
+
+    def test_migrate_from_sql(self):
+        db = self._create_db()
+        db.migrate_to_sql()
+        db.write()
+        db.migrate_from_sql()
+        self.assertFalse(os.path.exists(self.wallet_path + '.sqlite'))
+        db2 = self._open_db()
+        self.assertFalse(db2.is_sql_backed())
+        self.assertEqual(2000, db2.get_txo_addr('aa' * 32, 'addr1')[1][0])
+        self.assertEqual('x', db2.get_verified_broadcast('ASSET', 'bb' * 32)['data'])
+
+class TestParsedTxCache(ElectrumTestCase):
+
+    def test_lru_byte_budget(self):
+        cache = ParsedTxCache(max_bytes=250)
+        txs = [Transaction(SIGNED_TX_HEX) for i in range(3)]  # 193 bytes each
+        cache.put('a', txs[0])
+        self.assertIs(txs[0], cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        cache.put('b', txs[1])
+        self.assertIsNone(cache.get('a'))
+        self.assertIs(txs[1], cache.get('b'))
+        self.assertEqual({'hits': 2, 'misses': 2, 'entries': 1, 'size_bytes': 193, 'max_bytes': 250},
+                         cache.get_stats())
+
+    def test_get_transaction_keeps_stored_tx_unparsed(self):
+        db = WalletDB('', storage=None, manual_upgrades=True)
+        tx = Transaction(SIGNED_TX_HEX)
+        db.add_transaction(tx.txid(), tx)
+        db.tx_cache.clear()
+        tx2 = db.get_transaction(tx.txid())
+        self.assertEqual(tx.outputs(), tx2.outputs())
+        self.assertIs(tx2, db.get_transaction(tx.txid()))
+        self.assertIsNone(db.transactions[tx.txid()]._outputs)
+        db.remove_transaction(tx.txid())
+        self.assertIsNone(db.get_transaction(tx.txid()))
+
+
+SIGNED_TX_HEX = '01000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000006c493046022100a82bbc57a0136751e5433f41cf000b3f1a99c6744775e76ec764fb78c54ee100022100f9e80b7de89de861dc6fb0c1429d5da72c2b6b2ee2406bc9bfb1beedd729d985012102e61d176da16edd1d258a200ad9759ef63adf8e14cd97f53227bae35cdb84d2f6ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000'
+
+
+class TestAddrBalanceIndex(WalletTestCase):
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.addr1 = bitcoin.hash160_to_p2pkh(bytes.fromhex('11' * 20))
+        self.addr2 = bitcoin.hash160_to_p2pkh(bytes.fromhex('22' * 20))
+        d = restore_wallet_from_text(f'{self.addr1} {self.addr2}', path=self.wallet_path, config=self.config)
+        self.adb = d['wallet'].adb
+        self.adb.synchronizer = mock.Mock()
+
+    @staticmethod
+    def _make_tx(prevouts, outputs) -> Transaction:
+        inputs = []
+        for prevout in prevouts:
+            txin = PartialTxInput(prevout=TxOutpoint.from_str(prevout))
+            txin.script_sig = b'\x51'
+            inputs.append(txin)
+        tx = PartialTransaction.from_io(inputs, outputs, locktime=0, version=2)
+        return Transaction(tx.serialize_to_network())
+
+    def _balances(self):
+        domain = [self.addr1, self.addr2]
+        return self.adb.get_balance(domain), dict(self.adb.get_balance(domain, asset_aware=True))
+
+    async def test_balance_follows_history(self):
+        tx1 = self._make_tx(['aa' * 32 + ':0'], [
+            PartialTxOutput.from_address_and_value(self.addr1, 1000),
+            PartialTxOutput.from_address_and_value(self.addr1, 5, asset='ASSET')])
+        self.adb.add_transaction(tx1)
+        self.assertEqual(((0, 1000, 0), {None: (0, 1000, 0), 'ASSET': (0, 5, 0)}), self._balances())
+
+        # getting mined moves the coins of tx1 to confirmed
+        self.adb.add_unverified_or_unconfirmed_tx(tx1.txid(), 100)
+        self.assertEqual(((1000, 0, 0), {None: (1000, 0, 0), 'ASSET': (5, 0, 0)}), self._balances())
+        asset_coin = tx1.txid() + ':%d' % [o.asset for o in tx1.outputs()].index('ASSET')
+        self.assertEqual((1000, 0, 0), self.adb.get_balance([self.addr1], excluded_coins={asset_coin}))
+        self.assertEqual({None: (1000, 0, 0)},
+                         dict(self.adb.get_balance([self.addr1], excluded_coins={asset_coin}, asset_aware=True)))
+
+        # an unconfirmed spend of confirmed coins counts its change as confirmed
+        tx2 = self._make_tx([tx1.txid() + ':0', tx1.txid() + ':1'], [
+            PartialTxOutput.from_address_and_value(self.addr2, 600),
+            PartialTxOutput.from_address_and_value(self.addr2, 2, asset='ASSET'),
+            PartialTxOutput.from_address_and_value(bitcoin.hash160_to_p2pkh(bytes.fromhex('33' * 20)), 3, asset='ASSET')])
+        self.adb.add_transaction(tx2)
+        self.assertEqual(((600, 0, 0), {None: (600, 0, 0), 'ASSET': (2, 0, 0)}), self._balances())
+        self.assertEqual({'ASSET', None}, self.adb.get_assets_in_mempool([self.addr1, self.addr2]))
+        # ... unless the spent coins are outside the domain
+        self.assertEqual({None: (0, 600, 0), 'ASSET': (0, 2, 0)},
+                         dict(self.adb.get_balance([self.addr2], asset_aware=True)))
+
+        # undoing the spend restores the coins of addr1
+        self.adb.remove_transaction(tx2.txid())
+        self.assertEqual(((1000, 0, 0), {None: (1000, 0, 0), 'ASSET': (5, 0, 0)}), self._balances())
+        self.adb.remove_unverified_tx(tx1.txid(), 100)
+        self.assertEqual(((0, 1000, 0), {None: (0, 1000, 0), 'ASSET': (0, 5, 0)}), self._balances())
+
+
+class TestVerifiedHeightIndex(WalletTestCase):
+
+    def _mined_info(self, height):
+        return TxMinedInfo(height=height, conf=None, timestamp=0, txpos=0, header_hash='%064x' % height)
+
+    def test_after_height_queries(self):
+        db = WalletDB('', storage=None, manual_upgrades=True)
+        db._load_assets()
+        db.add_verified_tx('aa' * 32, self._mined_info(10))
+        db.add_verified_tx('bb' * 32, self._mined_info(20))
+        db.add_verified_restricted_freeze('$RES', {'tx_hash': 'bb' * 32, 'tx_pos': 0, 'height': 20, 'frozen': True})
+        # the index is built on first use ...
+        self.assertEqual(['bb' * 32], db.list_verified_tx_after_height(10))
+        self.assertEqual({'$RES'}, db.get_verified_restricted_freezes_after_height(19))
+        # ... and kept up to date afterwards
+        db.add_verified_tx('cc' * 32, self._mined_info(30))
+        db.add_verified_tx('aa' * 32, self._mined_info(25))
+        db.add_verified_broadcast('ASSET', 'cc' * 32, {'tx_pos': 0, 'height': 30, 'data': 'ff'})
+        db.add_verified_qualifier_tag('#TAG', '11' * 20, {'tx_hash': 'cc' * 32, 'tx_pos': 0, 'height': 30, 'flag': True})
+        self.assertEqual(['aa' * 32, 'cc' * 32], db.list_verified_tx_after_height(20))
+        self.assertEqual({'ASSET': {'cc' * 32}}, db.get_verified_broadcasts_after_height(29))
+        self.assertEqual({'#TAG': {'11' * 20}}, db.get_verified_qualifier_tags_after_height(29))
+        db.remove_verified_tx('cc' * 32)
+        db.remove_verified_broadcast('ASSET', 'cc' * 32)
+        db.remove_verified_restricted_freeze('$RES')
+        self.assertEqual(['aa' * 32], db.list_verified_tx_after_height(20))
+        self.assertEqual({}, db.get_verified_broadcasts_after_height(0))
+        self.assertEqual(set(), db.get_verified_restricted_freezes_after_height(0))
+        db.clear_history()
+        self.assertEqual([], db.list_verified_tx_after_height(0))
+
+    async def test_undo_verifications(self):
+        d = restore_wallet_from_text(bitcoin.hash160_to_p2pkh(bytes.fromhex('11' * 20)),
+                                     path=self.wallet_path, config=self.config)
+        adb = d['wallet'].adb
+        for i, height in enumerate((10, 20, 20, 30)):
+            adb.db.add_verified_tx('%064x' % i, self._mined_info(height))
+        adb.db.add_verified_h160_tag('11' * 20, '#TAG', {'tx_hash': '%064x' % 3, 'tx_pos': 0, 'height': 30, 'flag': True})
+        # the new chain forks off after height 20
+        headers = {10: '%064x' % 10, 20: '%064x' % 20, 30: 'ff' * 32}
+        def get_hash(height):
+            if height not in headers:
+                raise MissingHeader(height)
+            return headers[height]
+        blockchain = mock.Mock()
+        blockchain.get_hash = mock.Mock(side_effect=get_hash)
+        txs = adb.undo_verifications(blockchain, 15)
+        self.assertEqual({'%064x' % 3}, txs)
+        self.assertEqual(['%064x' % 0, '%064x' % 1, '%064x' % 2], sorted(adb.db.list_verified_tx()))
+        self.assertEqual({}, adb.db.get_verified_h160_tags('11' * 20))
+        self.assertEqual(30, adb.unverified_tx['%064x' % 3])
+        # each header hash is read once
+        self.assertEqual([20, 30], sorted(c.args[0] for c in blockchain.get_hash.call_args_list))
+
+
 class FakeExchange(ExchangeBase):
     def __init__(self, rate):
         super().__init__(lambda self: None, lambda self: None)
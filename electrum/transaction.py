@@ -59,6 +59,7 @@ from .json_db import stored_in
 if TYPE_CHECKING:
     from .wallet import Abstract_Wallet
     from .network import Network
+    from .asset import BaseAssetVoutInformation
 
 
 _logger = get_logger(__name__)
@@ -143,11 +144,16 @@ class TxOutput:
         self._asset_value = _NEEDS_RECALC
         self._value = value
 
+    def get_asset_vout_info(self) -> 'BaseAssetVoutInformation':
+        if self._asset_vout_info is _NEEDS_RECALC:
+            from .asset import get_asset_info_from_script
+            self._asset_vout_info = get_asset_info_from_script(self.scriptpubkey)
+        return self._asset_vout_info
+
     @property
     def asset(self):
         if self._asset == _NEEDS_RECALC:
-            from .asset import get_asset_info_from_script
-            asset_data = get_asset_info_from_script(self.scriptpubkey)
+            asset_data = self.get_asset_vout_info()
             if asset_data.is_transferable():
                 self._asset = asset_data.asset
             else:
@@ -156,8 +162,7 @@ class TxOutput:
 
     def asset_aware_value(self):
         if self._asset_value == _NEEDS_RECALC:
-            from .asset import get_asset_info_from_script
-            asset_data = get_asset_info_from_script(self.scriptpubkey)
+            asset_data = self.get_asset_vout_info()
             if asset_data.is_transferable():
                 self._asset_value = asset_data.amount
             else:
@@ -214,6 +219,7 @@ class TxOutput:
         self._address = _NEEDS_RECALC
         self._asset_value = _NEEDS_RECALC
         self._asset = _NEEDS_RECALC
+        self._asset_vout_info = _NEEDS_RECALC
 
     @property
     def address(self) -> Optional[str]:
@@ -324,6 +330,8 @@ class TxInput:
         self.__asset = None  # type: Optional[str]
         self.__value_sats = None  # type: Optional[int]
         self.__asset_value_sats = None  # type: Optional[int]
+        # decoded from scriptpubkey, or set by the wallet from its db
+        self._asset_vout_info = None  # type: Optional[BaseAssetVoutInformation]
 
     @property
     def short_id(self):
@@ -373,11 +381,16 @@ class TxInput:
         """
         return self._is_coinbase_output
 
+    def get_asset_vout_info(self) -> Optional['BaseAssetVoutInformation']:
+        if self._asset_vout_info is None and self.scriptpubkey is not None:
+            from .asset import get_asset_info_from_script
+            self._asset_vout_info = get_asset_info_from_script(self.scriptpubkey)
+        return self._asset_vout_info
+
     def value_sats(self, *, asset_aware=False) -> Optional[int]:
         if asset_aware:
             if self.__asset_value_sats is _NEEDS_RECALC:
-                from .asset import get_asset_info_from_script
-                asset_data = get_asset_info_from_script(self.scriptpubkey)
+                asset_data = self.get_asset_vout_info()
                 if asset_data.is_transferable():
                     self.__asset_value_sats = asset_data.amount
                 else:
@@ -394,8 +407,7 @@ class TxInput:
     @property
     def asset(self) -> Optional[str]:
         if self.__asset is _NEEDS_RECALC:
-            from .asset import get_asset_info_from_script
-            asset_data = get_asset_info_from_script(self.scriptpubkey)
+            asset_data = self.get_asset_vout_info()
             if asset_data.is_transferable():
                 self.__asset = asset_data.asset
             else:
@@ -793,6 +805,70 @@ def parse_output(vds: BCDataStream) -> TxOutput:
     return TxOutput(value=value, scriptpubkey=scriptpubkey)
 
 
+def is_deserializable_tx(raw: bytes) -> bool:
+    """Returns whether Transaction(raw).deserialize() would succeed,
+    with bounds checks over the bytes instead of building the tx.
+    """
+    n = len(raw)
+
+    def compact_size(i: int) -> Tuple[int, int]:
+        # returns -1 as size if truncated
+        if i >= n:
+            return -1, i
+        size = raw[i]
+        if size < 253:
+            return size, i + 1
+        width = {253: 2, 254: 4, 255: 8}[size]
+        if i + 1 + width > n:
+            return -1, i
+        return int.from_bytes(raw[i + 1:i + 1 + width], 'little'), i + 1 + width
+
+    if n < 4:
+        return False
+    n_vin, i = compact_size(4)
+    is_segwit = n_vin == 0
+    if is_segwit:
+        if i >= n or raw[i] != 1:
+            return False
+        n_vin, i = compact_size(i + 1)
+    # an input takes at least 41 bytes, an output at least 9
+    if n_vin < 1 or i + 41 * n_vin > n:
+        return False
+    for _ in range(n_vin):
+        script_len, i = compact_size(i + 36)
+        if script_len < 0:
+            return False
+        i += script_len + 4
+        if i > n:
+            return False
+    n_vout, i = compact_size(i)
+    if n_vout < 1 or i + 9 * n_vout > n:
+        return False
+    for _ in range(n_vout):
+        value = int.from_bytes(raw[i:i + 8], 'little', signed=True)
+        if not 0 <= value <= TOTAL_COIN_SUPPLY_LIMIT_IN_BTC * COIN:
+            return False
+        script_len, i = compact_size(i + 8)
+        if script_len < 0:
+            return False
+        i += script_len
+        if i > n:
+            return False
+    if is_segwit:
+        for _ in range(n_vin):
+            n_items, i = compact_size(i)
+            if n_items < 0 or i + n_items > n:
+                return False
+            for _ in range(n_items):
+                item_len, i = compact_size(i)
+                if item_len < 0:
+                    return False
+                i += item_len
+                if i > n:
+                    return False
+    return i + 4 == n
+
+
 # pay & redeem scripts
 
 def multisig_script(public_keys: Sequence[str], m: int) -> str:
@@ -834,6 +910,7 @@ class Transaction:
     @locktime.setter
     def locktime(self, value: int):
         assert isinstance(value, int), f"locktime must be int, not {value!r}"
+        self.deserialize()  # before the serialization is dropped
         self._locktime = value
         self.invalidate_ser_cache()
 
@@ -844,6 +921,7 @@ class Transaction:
 
     @version.setter
     def version(self, value):
+        self.deserialize()
         self._version = value
         self.invalidate_ser_cache()
 
@@ -863,9 +941,37 @@ class Transaction:
 
     def outputs(self) -> Sequence[TxOutput]:
         if self._outputs is None:
-            self.deserialize()
+            if self._cached_network_ser is not None:
+                self._deserialize_outputs()
+            else:
+                self.deserialize()
         return self._outputs
 
+    def _deserialize_outputs(self) -> None:
+        """Parses only the outputs, skipping over the inputs.
+        Most callers of outputs() never look at the inputs.
+        """
+        raw_bytes = bfh(self._cached_network_ser)
+        vds = BCDataStream()
+        vds.write(raw_bytes)
+        vds.read_int32()  # version
+        n_vin = vds.read_compact_size()
+        if n_vin == 0:  # segwit
+            marker = vds.read_bytes(1)
+            if marker != b'\x01':
+                raise SerializationError('invalid txn marker byte: {}'.format(marker))
+            n_vin = vds.read_compact_size()
+        if n_vin < 1:
+            raise SerializationError('tx needs to have at least 1 input')
+        for i in range(n_vin):
+            vds.read_bytes(32 + 4)  # prevout
+            vds.read_bytes(vds.read_compact_size())  # scriptSig
+            vds.read_bytes(4)  # nsequence
+        n_vout = vds.read_compact_size()
+        if n_vout < 1:
+            raise SerializationError('tx needs to have at least 1 output')
+        self._outputs = [parse_output(vds) for i in range(n_vout)]
+
     def deserialize(self) -> None:
         if self._cached_network_ser is None:
             return
@@ -889,7 +995,9 @@ class Transaction:
         n_vout = vds.read_compact_size()
         if n_vout < 1:
             raise SerializationError('tx needs to have at least 1 output')
-        self._outputs = [parse_output(vds) for i in range(n_vout)]
+        txouts = [parse_output(vds) for i in range(n_vout)]
+        if self._outputs is None:  # keep those handed out by _deserialize_outputs
+            self._outputs = txouts
         if is_segwit:
             for txin in txins:
                 parse_witness(vds, txin)
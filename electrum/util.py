@@ -1588,9 +1588,6 @@ class NetworkJobOnDefaultServer(Logger, ABC):
         self.network = network
         self.interface = None  # type: Interface
         self._restart_lock = asyncio.Lock()
-        # Ensure fairness between NetworkJobs. e.g. if multiple wallets
-        # are open, a large wallet's Synchronizer should not starve the small wallets:
-        self._network_request_semaphore = asyncio.Semaphore(100)
 
         self._reset()
         # every time the main interface changes, restart:
@@ -1650,6 +1647,14 @@ class NetworkJobOnDefaultServer(Logger, ABC):
             self._reset()
             await self._start(interface)
 
+    def _network_request_slot(self, interface: "Interface" = None, *, measure_rtt: bool = True):
+        """Holds a slot of the request limiter of the interface (by default
+        the main one) while a request is in flight. The limiter is shared by
+        all jobs on that interface, and fair between them.
+        """
+        interface = interface or self.interface
+        return interface.request_limiter.slot(owner=self, measure_rtt=measure_rtt)
+
     def reset_request_counters(self):
         self._requests_sent = 0
         self._requests_answered = 0
@@ -23,17 +23,17 @@
 from __future__ import annotations
 import asyncio
 import re
-from typing import Sequence, Optional, TYPE_CHECKING, Tuple
+import time
+from typing import Sequence, Optional, TYPE_CHECKING, Tuple, Dict
 
 import aiorpcx
 
 from .util import TxMinedInfo, NetworkJobOnDefaultServer
 from .crypto import sha256d
-from .asset import (get_asset_info_from_script, StrictAssetMetadata, AssetException, MetadataAssetVoutInformation, OwnerAssetVoutInformation,
+from .asset import (StrictAssetMetadata, AssetException, MetadataAssetVoutInformation, OwnerAssetVoutInformation,
                     AssetVoutType)
 from .bitcoin import hash_decode, hash_encode, base_decode
-from .transaction import Transaction, TxOutpoint
-from .blockchain import hash_header
+from .transaction import Transaction, TxOutpoint, is_deserializable_tx
 from .interface import GracefulDisconnect, RequestCorrupted
 from . import constants
 
@@ -51,6 +51,9 @@ class InnerNodeOfSpvProofIsValidTx(MerkleVerificationFailure): pass
 class SPV(NetworkJobOnDefaultServer):
     """ Simple Payment Verification """
 
+    # merkle proofs of wallet txs are requested in batches of this many txs
+    MERKLE_BATCH_SIZE = 100
+
     def __init__(self, network: 'Network', wallet: 'AddressSynchronizer'):
         self.wallet = wallet
         NetworkJobOnDefaultServer.__init__(self, network)
@@ -60,6 +63,8 @@ class SPV(NetworkJobOnDefaultServer):
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
         self.requested_merkle = set()  # txid set of pending requests
         self.verifying = set()
+        self._proofs_verified = 0
+        self._progress_start_time = time.monotonic()
 
     async def _run_tasks(self, *, taskgroup):
         await super()._run_tasks(taskgroup=taskgroup)
@@ -125,9 +130,14 @@ class SPV(NetworkJobOnDefaultServer):
 
     async def _request_proofs(self):
         unverified = self.wallet.get_unverified_txs()
+        to_verify = []
         for tx_hash, tx_height in unverified.items():
             if await self._maybe_defer(tx_hash, tx_height, for_tx=True): continue
-            await self.taskgroup.spawn(self._verify_unverified_transaction, tx_hash, tx_height)
+            to_verify.append((tx_hash, tx_height))
+        # group by block, so that each batch needs few headers
+        to_verify.sort(key=lambda item: item[1])
+        for i in range(0, len(to_verify), self.MERKLE_BATCH_SIZE):
+            await self.taskgroup.spawn(self._verify_unverified_transactions, to_verify[i:i + self.MERKLE_BATCH_SIZE])
 
         unverified_assets = self.wallet.get_unverified_asset_metadatas()
         for asset, (metadata, source_tuple, divisions_tuple, associated_data_tuple) in unverified_assets.items():
@@ -223,18 +233,10 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(tx_hash, height, quick_return=True)
-            tx = self.wallet.get_transaction(tx_hash)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(tx_hash)
-                finally:
-                    self._requests_answered += 1
-                tx = Transaction(raw_tx)
+            tx = await self._get_transaction(tx_hash)
             qual_idx = d['qualifying_tx_pos']
             res_idx = d['restricted_tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[qual_idx].scriptpubkey)
+            asset_info = tx.outputs()[qual_idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.VERIFIER:
                 raise AssetException(f'bad asset type: {_type}')
             main_qualifier = asset.split('/')[0]
@@ -245,7 +247,7 @@ class SPV(NetworkJobOnDefaultServer):
                 if main_qualifier[1:] in re.findall(r'([A-Z0-9_.]+)', asset_info.verifier_string):
                     raise AssetException(f'qualifier in verifier string {asset} {res}: {asset_info.verifier_string} ({main_qualifier[1:]})')
             
-            asset_info = get_asset_info_from_script(tx.outputs()[res_idx].scriptpubkey)
+            asset_info = tx.outputs()[res_idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) not in (AssetVoutType.REISSUE, AssetVoutType.CREATE):
                 raise AssetException(f'bad asset type: {_type}')
             if asset_info.asset != res:
@@ -274,17 +276,9 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(tx_hash, height, quick_return=True)
-            tx = self.wallet.get_transaction(tx_hash)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(tx_hash)
-                finally:
-                    self._requests_answered += 1
-                tx = Transaction(raw_tx)
+            tx = await self._get_transaction(tx_hash)
             idx = d['tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx].scriptpubkey)
+            asset_info = tx.outputs()[idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.TRANSFER:
                 raise AssetException(f'bad asset type: {_type}')
             if asset_info.asset != asset:
@@ -296,15 +290,7 @@ class SPV(NetworkJobOnDefaultServer):
             for input in tx.inputs():
 
                 in_txid = input.prevout.txid.hex()
-                in_tx = self.wallet.get_transaction(in_txid)
-                if not in_tx:
-                    self._requests_sent += 1
-                    try:
-                        async with self._network_request_semaphore:
-                            raw_tx = await self.interface.get_transaction(in_txid)
-                    finally:
-                        self._requests_answered += 1
-                    in_tx = Transaction(raw_tx)
+                in_tx = await self._get_transaction(in_txid)
 
                 if in_tx.outputs()[input.prevout.out_idx].address == tx.outputs()[idx].address and \
                     in_tx.outputs()[input.prevout.out_idx].asset == tx.outputs()[idx].asset:
@@ -328,17 +314,9 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(txid, height, quick_return=True)
-            tx = self.wallet.get_transaction(txid)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(txid)
-                    tx = Transaction(raw_tx)
-                finally:
-                    self._requests_answered += 1
+            tx = await self._get_transaction(txid)
             idx = d['tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx].scriptpubkey)
+            asset_info = tx.outputs()[idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.FREEZE:
                 raise AssetException(f'bad asset type: {_type}')
             if asset_info.asset != asset:
@@ -369,23 +347,15 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(txid, height, quick_return=True)
-            tx = self.wallet.get_transaction(txid)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(txid)
-                    tx = Transaction(raw_tx)
-                finally:
-                    self._requests_answered += 1
+            tx = await self._get_transaction(txid)
             idx_qual = d['qualifying_tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx_qual].scriptpubkey)
+            asset_info = tx.outputs()[idx_qual].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.VERIFIER:
                 raise AssetException(f'bad asset type: {_type}')
             if d['string'] != asset_info.verifier_string:
                 raise AssetException(f'verifier string mismatch: {d["string"]} vs {asset_info.verifier_string}')
             idx_restricted = d['restricted_tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx_restricted].scriptpubkey)
+            asset_info = tx.outputs()[idx_restricted].get_asset_vout_info()
             if (_type := asset_info.get_type()) not in (AssetVoutType.CREATE, AssetVoutType.REISSUE):
                 raise AssetException(f'bad asset type: {_type}')
             if asset_info.asset != asset:
@@ -444,16 +414,8 @@ class SPV(NetworkJobOnDefaultServer):
             source_height = divisions_source[1]
             try:
                 await self._request_and_verify_single_proof(source_txid, source_height, quick_return=True)
-                tx = self.wallet.get_transaction(source_txid)
-                if not tx:
-                    self._requests_sent += 1
-                    try:
-                        async with self._network_request_semaphore:
-                            raw_tx = await self.interface.get_transaction(source_txid)
-                        tx = Transaction(raw_tx)
-                    finally:
-                        self._requests_answered += 1
-                asset_info = get_asset_info_from_script(tx.outputs()[source_idx].scriptpubkey)
+                tx = await self._get_transaction(source_txid)
+                asset_info = tx.outputs()[source_idx].get_asset_vout_info()
                 if not isinstance(asset_info, MetadataAssetVoutInformation):
                     raise AssetException('No metadata at this outpoint!(1)')
                 if asset_info.asset != asset:
@@ -470,16 +432,8 @@ class SPV(NetworkJobOnDefaultServer):
             source_height = associated_data_source[1]
             try:
                 await self._request_and_verify_single_proof(source_txid, source_height, quick_return=True)
-                tx = self.wallet.get_transaction(source_txid)
-                if not tx:
-                    self._requests_sent += 1
-                    try:
-                        async with self._network_request_semaphore:
-                            raw_tx = await self.interface.get_transaction(source_txid)
-                        tx = Transaction(raw_tx)
-                    finally:
-                        self._requests_answered += 1
-                asset_info = get_asset_info_from_script(tx.outputs()[source_idx].scriptpubkey)
+                tx = await self._get_transaction(source_txid)
+                asset_info = tx.outputs()[source_idx].get_asset_vout_info()
                 if not isinstance(asset_info, MetadataAssetVoutInformation):
                     raise AssetException('No metadata at this outpoint!(2)')
                 if asset_info.asset != asset:
@@ -495,17 +449,9 @@ class SPV(NetworkJobOnDefaultServer):
         source_height = source[1]
         try:
             await self._request_and_verify_single_proof(source_txid, source_height, quick_return=True)
-            tx = self.wallet.get_transaction(source_txid)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(source_txid)
-                    tx = Transaction(raw_tx)
-                finally:
-                    self._requests_answered += 1
+            tx = await self._get_transaction(source_txid)
 
-            asset_info = get_asset_info_from_script(tx.outputs()[source_idx].scriptpubkey)
+            asset_info = tx.outputs()[source_idx].get_asset_vout_info()
             if not isinstance(asset_info, MetadataAssetVoutInformation):
                 if not isinstance(asset_info, OwnerAssetVoutInformation):
                     raise AssetException('No metadata at this outpoint!(3)')
@@ -562,17 +508,9 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(txid, height, quick_return=True)
-            tx = self.wallet.get_transaction(txid)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(txid)
-                    tx = Transaction(raw_tx)
-                finally:
-                    self._requests_answered += 1
+            tx = await self._get_transaction(txid)
             idx = d['tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx].scriptpubkey)
+            asset_info = tx.outputs()[idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.NULL:
                 raise AssetException(f'bad asset type: {_type}')
             if h160 != asset_info.h160:
@@ -605,17 +543,9 @@ class SPV(NetworkJobOnDefaultServer):
 
         try:
             await self._request_and_verify_single_proof(txid, height, quick_return=True)
-            tx = self.wallet.get_transaction(txid)
-            if not tx:
-                self._requests_sent += 1
-                try:
-                    async with self._network_request_semaphore:
-                        raw_tx = await self.interface.get_transaction(txid)
-                    tx = Transaction(raw_tx)
-                finally:
-                    self._requests_answered += 1
+            tx = await self._get_transaction(txid)
             idx = d['tx_pos']
-            asset_info = get_asset_info_from_script(tx.outputs()[idx].scriptpubkey)
+            asset_info = tx.outputs()[idx].get_asset_vout_info()
             if (_type := asset_info.get_type()) != AssetVoutType.NULL:
                 raise AssetException(f'bad asset type: {_type}')
             if h160 != asset_info.h160:
@@ -635,57 +565,154 @@ class SPV(NetworkJobOnDefaultServer):
         self.wallet.add_verified_tag_for_h160(h160, asset, d)
 
 
-    async def _verify_unverified_transaction(self, tx_hash, tx_height):
+    async def _get_transaction(self, txid: str) -> Transaction:
+        """Returns a tx from the wallet, the spv cache or the server."""
+        tx = self.wallet.get_transaction(txid)
+        if tx:
+            return tx
+        spv_cache = self.network.spv_cache
+        if spv_cache:
+            raw_tx = await spv_cache.get_transaction(txid)
+            if raw_tx:
+                tx = Transaction(raw_tx)
+                if tx.txid() == txid:
+                    return tx
+                self.logger.warning(f'cached tx does not match its txid {txid}')
+        self._requests_sent += 1
         try:
-            pos, header = await self._request_and_verify_single_proof(tx_hash, tx_height)
-        except aiorpcx.jsonrpc.RPCError:
-            self.logger.info(f'tx {tx_hash} not at height {tx_height}')
-            self.wallet.remove_unverified_tx(tx_hash, tx_height)
-            return
-        
-        header_hash = hash_header(header)
-        tx_info = TxMinedInfo(height=tx_height,
-                            timestamp=header.get('timestamp'),
-                            txpos=pos,
-                            header_hash=header_hash)
-        self.wallet.add_verified_tx(tx_hash, tx_info)
-
+            async with self._network_request_slot():
+                raw_tx = await self.interface.get_transaction(txid)
+        finally:
+            self._requests_answered += 1
+        if spv_cache:
+            await spv_cache.add_transaction(txid, raw_tx)
+        return Transaction(raw_tx)
 
-    async def _request_and_verify_single_proof(self, tx_hash, tx_height, *, quick_return=False):
-        if quick_return and (tx_hash in self.merkle_roots or self.wallet.db.get_verified_tx(tx_hash)):
-            return
-        self.logger.info(f'requesting merkle {tx_hash}')
+    async def _read_headers(self, heights) -> Dict[int, Optional[dict]]:
+        # we need to wait if header sync/reorg is still ongoing, hence lock:
+        async with self.network.bhi_lock:
+            blockchain = self.network.blockchain()
+            return {height: blockchain.read_header(height) for height in set(heights)}
+
+    async def _verify_unverified_transactions(self, txs: Sequence[Tuple[str, int]]):
+        """Verifies wallet txs, requesting their merkle proofs in one batch
+        and reading the header of each block once.
+        """
+        spv_cache = self.network.spv_cache
+        proofs = {}  # tx_hash -> merkle
+        to_request, results = [], []
         try:
-            self._requests_sent += 1
-            async with self._network_request_semaphore:
-                merkle = await self.interface.get_merkle_for_transaction(tx_hash, tx_height)
+            headers = await self._read_headers(tx_height for _, tx_height in txs)
+            if spv_cache:
+                for tx_hash, tx_height in txs:
+                    if header := headers[tx_height]:
+                        merkle = await spv_cache.get_merkle(tx_hash, self._get_header_hash(header))
+                        if merkle is not None:
+                            proofs[tx_hash] = merkle
+            to_request = [(tx_hash, tx_height) for tx_hash, tx_height in txs if tx_hash not in proofs]
+            if to_request:
+                self.logger.info(f'requesting {len(to_request)} merkle proofs')
+                self._requests_sent += len(to_request)
+                try:
+                    async with self._network_request_slot(measure_rtt=False):
+                        results = await self.interface.get_merkles_for_transactions(to_request)
+                finally:
+                    self._requests_answered += len(to_request)
         finally:
-            self.requested_merkle.discard(tx_hash)
-            self._requests_answered += 1
-        # Verify the hash of the server-provided merkle branch to a
-        # transaction matches the merkle root of its block
+            for tx_hash, _ in txs:
+                self.requested_merkle.discard(tx_hash)
+        fetched = set()
+        for (tx_hash, tx_height), merkle in zip(to_request, results):
+            if isinstance(merkle, aiorpcx.jsonrpc.RPCError):
+                self.logger.info(f'tx {tx_hash} not at height {tx_height}')
+                self.wallet.remove_unverified_tx(tx_hash, tx_height)
+                continue
+            proofs[tx_hash] = merkle
+            fetched.add(tx_hash)
+        # the server may have returned proofs for other blocks
+        missing = [merkle['block_height'] for merkle in proofs.values() if merkle['block_height'] not in headers]
+        if missing:
+            headers.update(await self._read_headers(missing))
+        for tx_hash, tx_height in txs:
+            merkle = proofs.get(tx_hash)
+            if merkle is None:
+                continue
+            header = headers[merkle['block_height']]
+            verified = self._verify_merkle(tx_hash, tx_height, merkle, header)
+            header_hash = self._get_header_hash(header)
+            if verified and tx_hash in fetched and spv_cache:
+                await spv_cache.add_merkle(tx_hash, merkle, header_hash)
+            tx_info = TxMinedInfo(height=tx_height,
+                                  timestamp=header.get('timestamp'),
+                                  txpos=merkle['pos'],
+                                  header_hash=header_hash)
+            self.wallet.add_verified_tx(tx_hash, tx_info)
+
+    def _get_header_hash(self, header: dict) -> str:
+        # from the header hash index, saves hashing the header again
+        return self.network.blockchain().get_header_hash(header)
+
+    def _verify_merkle(self, tx_hash: str, tx_height: int, merkle: dict, header: Optional[dict]) -> bool:
+        """Checks the merkle branch of a tx against the merkle root of its block.
+        Returns whether it was checked, raises GracefulDisconnect if wrong.
+        """
         if tx_height != merkle.get('block_height'):
             self.logger.info('requested tx_height {} differs from received tx_height {} for txid {}'
                              .format(tx_height, merkle.get('block_height'), tx_hash))
-        tx_height = merkle.get('block_height')
-        pos = merkle.get('pos')
-        merkle_branch = merkle.get('merkle')
-        # we need to wait if header sync/reorg is still ongoing, hence lock:
-        async with self.network.bhi_lock:
-            header = self.network.blockchain().read_header(tx_height)
         try:
-            verify_tx_is_in_block(tx_hash, merkle_branch, pos, header, tx_height)
+            verify_tx_is_in_block(tx_hash, merkle.get('merkle'), merkle.get('pos'), header, merkle.get('block_height'))
         except MerkleVerificationFailure as e:
             if self.network.config.NETWORK_SKIPMERKLECHECK:
                 self.logger.info(f"skipping merkle proof check {tx_hash}")
+                checked = False
             else:
                 self.logger.info(repr(e))
                 raise GracefulDisconnect(e) from e
+        else:
+            checked = True
         # we passed all the tests
         self.merkle_roots[tx_hash] = header.get('merkle_root')
-        self.logger.info(f"verified {tx_hash}")    
+        self._proofs_verified += 1
+        self.logger.info(f"verified {tx_hash}")
+        return checked
+
+    def get_verification_progress(self) -> dict:
+        """Counters for showing the verification throughput, since the last
+        server switch.
+        """
+        elapsed = time.monotonic() - self._progress_start_time
+        return {
+            'verified': self._proofs_verified,
+            'pending': len(self.requested_merkle),
+            'per_second': self._proofs_verified / elapsed if elapsed > 0 else 0,
+        }
 
-        return pos, header
+    async def _request_and_verify_single_proof(self, tx_hash, tx_height, *, quick_return=False):
+        if quick_return and (tx_hash in self.merkle_roots or self.wallet.db.get_verified_tx(tx_hash)):
+            return
+        spv_cache = self.network.spv_cache
+        merkle = None
+        if spv_cache:
+            if header := (await self._read_headers([tx_height]))[tx_height]:
+                merkle = await spv_cache.get_merkle(tx_hash, self._get_header_hash(header))
+        from_cache = merkle is not None
+        if from_cache:
+            self.requested_merkle.discard(tx_hash)
+        else:
+            self.logger.info(f'requesting merkle {tx_hash}')
+            try:
+                self._requests_sent += 1
+                async with self._network_request_slot():
+                    merkle = await self.interface.get_merkle_for_transaction(tx_hash, tx_height)
+            finally:
+                self.requested_merkle.discard(tx_hash)
+                self._requests_answered += 1
+        # Verify the hash of the server-provided merkle branch to a
+        # transaction matches the merkle root of its block
+        header = (await self._read_headers([merkle['block_height']]))[merkle['block_height']]
+        if self._verify_merkle(tx_hash, tx_height, merkle, header) and spv_cache and not from_cache:
+            await spv_cache.add_merkle(tx_hash, merkle, self._get_header_hash(header))
+        return merkle['pos'], header
         
     @classmethod
     def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int):
@@ -703,7 +730,7 @@ class SPV(NetworkJobOnDefaultServer):
             if len(item) != 32:
                 raise MerkleVerificationFailure('all merkle branch items have to 32 bytes long')
             inner_node = (item + h) if (index & 1) else (h + item)
-            cls._raise_if_valid_tx(inner_node.hex())
+            cls._raise_if_valid_tx(inner_node)
             h = sha256d(inner_node)
             index >>= 1
         if index != 0:
@@ -711,17 +738,13 @@ class SPV(NetworkJobOnDefaultServer):
         return hash_encode(h)
 
     @classmethod
-    def _raise_if_valid_tx(cls, raw_tx: str):
+    def _raise_if_valid_tx(cls, raw_tx: bytes):
         # If an inner node of the merkle proof is also a valid tx, chances are, this is an attack.
         # https://lists.linuxfoundation.org/pipermail/bitcoin-dev/2018-June/016105.html
         # https://lists.linuxfoundation.org/pipermail/bitcoin-dev/attachments/20180609/9f4f5b1f/attachment-0001.pdf
         # https://bitcoin.stackexchange.com/questions/76121/how-is-the-leaf-node-weakness-in-merkle-trees-exploitable/76122#76122
-        tx = Transaction(raw_tx)
-        try:
-            tx.deserialize()
-        except Exception:
-            pass
-        else:
+        # note: accepts exactly what Transaction.deserialize accepts, without parsing
+        if is_deserializable_tx(raw_tx):
             raise InnerNodeOfSpvProofIsValidTx()
 
     async def _maybe_undo_verifications(self):
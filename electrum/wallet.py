@@ -345,6 +345,10 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         # load addresses needs to be called before constructor for sanity checks
         db.load_addresses(self.wallet_type)
         db._load_assets()
+        db.tx_cache.max_bytes = config.WALLET_TX_CACHE_BYTES
+        if (config.WALLET_SQL_STORAGE and not db.is_sql_backed()
+                and self.storage and not self.storage.is_encrypted()):
+            db.migrate_to_sql()
         self.keystore = None  # type: Optional[KeyStore]  # will be set by load_keystore
         self._password_in_memory = None  # see self.unlock
         Logger.__init__(self)
@@ -1966,13 +1970,13 @@ class Abstract_Wallet(ABC, Logger, EventListener):
                 for j, (op, _, _) in enumerate(ops):
                     if op == opcodes.OP_ASSET:
                         base_script = outputs[i].scriptpubkey[:ops[j-1][2]]
-                asset_info: TransferAssetVoutInformation = get_asset_info_from_script(outputs[i].scriptpubkey)
+                asset_info: TransferAssetVoutInformation = outputs[i].get_asset_vout_info()
                 assert isinstance(asset_info, TransferAssetVoutInformation)
                 outputs[i].scriptpubkey = bytes.fromhex(generate_transfer_script_from_base(asset, val, base_script.hex(), memo = AssetMemo(asset_info.asset_memo, asset_info.asset_memo_timestamp) if asset_info.asset_memo else None))
                 distr_amount += val
 
         assert all(output.value == 0 for output in outputs if output.asset)
-        assert all(get_asset_info_from_script(output.scriptpubkey).well_formed_script for output in outputs)
+        assert all(output.get_asset_vout_info().well_formed_script for output in outputs)
 
         if fee is None and self.config.fee_per_kb() is None:
             raise NoDynamicFeeEstimates()
@@ -2603,6 +2607,8 @@ class Abstract_Wallet(ABC, Logger, EventListener):
         # note: we add input utxos regardless of is_mine
         if txin.utxo is None:
             txin.utxo = self.db.get_transaction(txin.prevout.txid.hex())
+        if txin._asset_vout_info is None:
+            txin._asset_vout_info = self.db.get_txo_asset_info(txin.prevout.txid.hex(), txin.prevout.out_idx)
         if not isinstance(txin, PartialTxInput):
             return
         address = self.adb.get_txin_address(txin)
@@ -3081,6 +3087,9 @@ class Abstract_Wallet(ABC, Logger, EventListener):
                 enc_version = self.get_available_storage_encryption_version()
             else:
                 enc_version = StorageEncryptionVersion.PLAINTEXT
+            if new_pw and enc_version != StorageEncryptionVersion.PLAINTEXT and self.db.is_sql_backed():
+                # the sqlite file is not encrypted
+                self.db.migrate_from_sql()
             self.storage.set_password(new_pw, enc_version)
         # make sure next storage.write() saves changes
         self.db.set_modified(True)
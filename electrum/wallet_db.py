@@ -29,15 +29,17 @@ import datetime
 import json
 import copy
 import threading
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from typing import Dict, Optional, List, Tuple, Set, Iterable, NamedTuple, Sequence, TYPE_CHECKING, Union, Any
 import binascii
 import time
+from bisect import bisect_left, bisect_right, insort
 
 import attr
 
 from . import util, bitcoin, constants
-from .asset import StrictAssetMetadata, get_error_for_asset_name
+from .asset import (StrictAssetMetadata, get_error_for_asset_name, BaseAssetVoutInformation,
+                    asset_vout_info_to_json, asset_vout_info_from_json)
 from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, bfh
 from .invoices import Invoice, Request
 from .keystore import bip44_derivation
@@ -47,6 +49,7 @@ from .logging import Logger
 from .lnutil import LOCAL, REMOTE, HTLCOwner, ChannelType
 from . import json_db
 from .json_db import StoredDict, JsonDB, locked, modifier, StoredObject, stored_in, stored_as
+from .wallet_sql_db import WalletSqlStore
 from .plugin import run_hook, plugin_loaders
 from .version import ELECTRUM_VERSION
 from .atomic_swap import AtomicSwap
@@ -84,6 +87,27 @@ class DBMetadata(StoredObject):
 #       separate tracking issues
 class WalletFileExceptionVersion51(WalletFileException): pass
 
+# collections that can be kept in an sqlite file next to the wallet file,
+# see WalletDB.migrate_to_sql. table name -> WalletDB attribute
+SQL_TABLES = {
+    'transactions': 'transactions',
+    'txi': 'txi',
+    'txo': 'txo',
+    'txo_asset_info': 'txo_asset_info',
+    'spent_outpoints': 'spent_outpoints',
+    'addr_history': 'history',
+    'verified_tx3': 'verified_tx',
+    'tx_fees': 'tx_fees',
+    'prevouts_by_scripthash': '_prevouts_by_scripthash',
+    'verified_asset_metadata': 'verified_asset_metadata',
+    'verified_qualifier_tags': 'verified_tags_for_qualifiers',
+    'verified_h160_tags': 'verified_tags_for_h160s',
+    'verified_verifier_strings': 'verified_restricted_verifiers',
+    'verified_freezes': 'verified_restricted_freezes',
+    'verified_broadcasts': 'verified_broadcasts',
+    'verified_associations': 'verified_associations',
+}
+
 # register dicts that require value conversions not handled by constructor
 json_db.register_dict('transactions', lambda x: tx_from_any(x, deserialize=False), None)
 json_db.register_dict('prevouts_by_scripthash', lambda x: set(tuple(k) for k in x), None)
@@ -106,9 +130,104 @@ for key in ['locked_in', 'fails', 'settles']:
 for key in ('assets_to_watch', 'asset_blacklist', 'broadcasts_to_watch', 'non_deterministic_txo_scriptpubkey'):
     json_db.register_name(key, set, None)
 
+class ParsedTxCache:
+    """LRU of parsed transactions, bounded by their serialized size.
+
+    WalletDB keeps transactions unparsed; get_transaction hands out
+    parsed copies from here.
+    """
+
+    def __init__(self, max_bytes: int = 16_000_000):
+        self.max_bytes = max_bytes
+        self._txs = OrderedDict()  # type: OrderedDict[str, Tuple[Transaction, int]]
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, txid: str) -> Optional[Transaction]:
+        item = self._txs.get(txid)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._txs.move_to_end(txid)
+        return item[0]
+
+    def put(self, txid: str, tx: Transaction) -> None:
+        self.pop(txid)
+        size = len(tx.serialize()) // 2
+        self._txs[txid] = (tx, size)
+        self.size += size
+        while self.size > self.max_bytes and self._txs:
+            _, (_, evicted_size) = self._txs.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, txid: str) -> None:
+        item = self._txs.pop(txid, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def clear(self) -> None:
+        self._txs.clear()
+        self.size = 0
+
+    def get_stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._txs),
+            'size_bytes': self.size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class HeightIndex:
+    """Keys ordered by block height, so that the keys above a given
+    height can be listed without scanning all of them.
+    """
+
+    def __init__(self):
+        self._heights = []  # type: List[int]  # sorted, distinct
+        self._keys_at = {}  # type: Dict[int, Set]
+        self._height_of = {}  # type: Dict[Any, int]
+
+    def add(self, key, height: int) -> None:
+        self.remove(key)
+        keys = self._keys_at.get(height)
+        if keys is None:
+            insort(self._heights, height)
+            keys = self._keys_at[height] = set()
+        keys.add(key)
+        self._height_of[key] = height
+
+    def remove(self, key) -> None:
+        height = self._height_of.pop(key, None)
+        if height is None:
+            return
+        keys = self._keys_at[height]
+        keys.discard(key)
+        if not keys:
+            del self._keys_at[height]
+            del self._heights[bisect_left(self._heights, height)]
+
+    def keys_above(self, height: int) -> List:
+        i = bisect_right(self._heights, height)
+        return [key for h in self._heights[i:] for key in self._keys_at[h]]
+
+    def clear(self) -> None:
+        self._heights.clear()
+        self._keys_at.clear()
+        self._height_of.clear()
+
+    def __len__(self):
+        return len(self._height_of)
+
+
 class WalletDB(JsonDB):
 
     def __init__(self, data, *, storage=None, manual_upgrades: bool):
+        self.tx_cache = ParsedTxCache()
+        self._height_indexes = None  # type: Optional[Dict[str, HeightIndex]]
         JsonDB.__init__(self, data, storage)
         if not data:
             # create new DB
@@ -309,6 +428,24 @@ class WalletDB(JsonDB):
             d[addr] = {}
         d[addr][n] = (v, asset, is_coinbase)
 
+    @locked
+    def get_txo_asset_info(self, tx_hash: str, n: Union[int, str]) -> Optional[BaseAssetVoutInformation]:
+        """Returns the decoded asset info of an output, or None if the
+        outputs of tx_hash have not been classified."""
+        assert isinstance(tx_hash, str)
+        d = self.txo_asset_info.get(tx_hash)
+        if d is None:
+            return None
+        return asset_vout_info_from_json(d.get(str(n)))
+
+    @modifier
+    def set_txo_asset_info(self, tx_hash: str, d: Dict[int, BaseAssetVoutInformation]) -> None:
+        """Records the decoded asset outputs of a tx. Outputs that are
+        not in d carry no asset."""
+        assert isinstance(tx_hash, str)
+        self.txo_asset_info[tx_hash] = {str(n): asset_vout_info_to_json(asset_info)
+                                        for n, asset_info in d.items()}
+
     @locked
     def list_txi(self) -> Sequence[str]:
         return list(self.txi.keys())
@@ -326,6 +463,7 @@ class WalletDB(JsonDB):
     def remove_txo(self, tx_hash: str) -> None:
         assert isinstance(tx_hash, str)
         self.txo.pop(tx_hash, None)
+        self.txo_asset_info.pop(tx_hash, None)
 
     @locked
     def list_spent_outpoints(self) -> Sequence[Tuple[str, str]]:
@@ -370,6 +508,7 @@ class WalletDB(JsonDB):
         if scripthash not in self._prevouts_by_scripthash:
             self._prevouts_by_scripthash[scripthash] = set()
         self._prevouts_by_scripthash[scripthash].add((prevout.to_str(), value, asset))
+        self._prevouts_by_scripthash.touch(scripthash)
 
     @modifier
     def remove_prevout_by_scripthash(self, scripthash: str, *, prevout: TxOutpoint, value: int) -> None:
@@ -379,6 +518,8 @@ class WalletDB(JsonDB):
         self._prevouts_by_scripthash[scripthash].discard((prevout.to_str(), value))
         if not self._prevouts_by_scripthash[scripthash]:
             self._prevouts_by_scripthash.pop(scripthash)
+        else:
+            self._prevouts_by_scripthash.touch(scripthash)
 
     @locked
     def get_prevouts_by_scripthash(self, scripthash: str) -> Set[Tuple[TxOutpoint, int, Optional[str]]]:
@@ -400,11 +541,17 @@ class WalletDB(JsonDB):
         # don't allow overwriting complete tx with partial tx
         tx_we_already_have = self.transactions.get(tx_hash, None)
         if tx_we_already_have is None or isinstance(tx_we_already_have, PartialTransaction):
-            self.transactions[tx_hash] = tx
+            if isinstance(tx, PartialTransaction):
+                self.transactions[tx_hash] = tx
+            else:
+                # store it unparsed, the parsed one goes to the cache
+                self.transactions[tx_hash] = Transaction(tx.serialize())
+                self.tx_cache.put(tx_hash, tx)
 
     @modifier
     def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
         assert isinstance(tx_hash, str)
+        self.tx_cache.pop(tx_hash)
         return self.transactions.pop(tx_hash, None)
 
     @locked
@@ -412,7 +559,17 @@ class WalletDB(JsonDB):
         if tx_hash is None:
             return None
         assert isinstance(tx_hash, str), tx_hash
-        return self.transactions.get(tx_hash)
+        tx = self.tx_cache.get(tx_hash)
+        if tx is not None:
+            return tx
+        tx = self.transactions.get(tx_hash)
+        if tx is None or isinstance(tx, PartialTransaction):
+            return tx
+        # parse a copy, so that the stored tx stays unparsed
+        tx = Transaction(tx.serialize())
+        tx._cached_txid = tx_hash
+        self.tx_cache.put(tx_hash, tx)
+        return tx
 
     @locked
     def list_transactions(self) -> Sequence[str]:
@@ -446,6 +603,54 @@ class WalletDB(JsonDB):
     def list_verified_tx(self) -> Sequence[str]:
         return list(self.verified_tx.keys())
 
+    @locked
+    def list_verified_tx_after_height(self, height: int) -> Sequence[str]:
+        assert isinstance(height, int)
+        return self._get_height_index('tx').keys_above(height)
+
+    def _build_height_indexes(self) -> Dict[str, HeightIndex]:
+        indexes = {kind: HeightIndex() for kind in (
+            'tx', 'asset', 'verifier', 'freeze', 'broadcast', 'association', 'qualifier_tag', 'h160_tag')}
+        for txid, (height, _, _, _) in self.verified_tx.items():
+            indexes['tx'].add(txid, height)
+        for asset, (_, (_, height), _, _) in self.verified_asset_metadata.items():
+            indexes['asset'].add(asset, height)
+        for asset, d in self.verified_restricted_verifiers.items():
+            indexes['verifier'].add(asset, d['height'])
+        for asset, d in self.verified_restricted_freezes.items():
+            indexes['freeze'].add(asset, d['height'])
+        for asset, d1 in self.verified_broadcasts.items():
+            for tx_hash, d2 in d1.items():
+                indexes['broadcast'].add((asset, tx_hash), d2['height'])
+        for asset, res_dict in self.verified_associations.items():
+            for res, d1 in res_dict.items():
+                indexes['association'].add((asset, res), d1['height'])
+        for asset, h160_dict in self.verified_tags_for_qualifiers.items():
+            for h160, d1 in h160_dict.items():
+                indexes['qualifier_tag'].add((asset, h160), d1['height'])
+        for h160, asset_dict in self.verified_tags_for_h160s.items():
+            for asset, d1 in asset_dict.items():
+                indexes['h160_tag'].add((h160, asset), d1['height'])
+        return indexes
+
+    @locked
+    def _get_height_index(self, kind: str) -> HeightIndex:
+        """Returns the index by block height of a kind of verified item.
+        The indexes are built on first use and then kept up to date, so
+        that a reorg only has to look at the items above the fork point.
+        """
+        if self._height_indexes is None:
+            self._height_indexes = self._build_height_indexes()
+        return self._height_indexes[kind]
+
+    def _add_to_height_index(self, kind: str, key, height: int) -> None:
+        if self._height_indexes is not None:
+            self._height_indexes[kind].add(key, height)
+
+    def _remove_from_height_index(self, kind: str, key) -> None:
+        if self._height_indexes is not None:
+            self._height_indexes[kind].remove(key)
+
     @locked
     def get_verified_tx(self, txid: str) -> Optional[TxMinedInfo]:
         assert isinstance(txid, str)
@@ -463,11 +668,13 @@ class WalletDB(JsonDB):
         assert isinstance(txid, str)
         assert isinstance(info, TxMinedInfo)
         self.verified_tx[txid] = (info.height, info.timestamp, info.txpos, info.header_hash)
+        self._add_to_height_index('tx', txid, info.height)
 
     @modifier
     def remove_verified_tx(self, txid: str):
         assert isinstance(txid, str)
         self.verified_tx.pop(txid, None)
+        self._remove_from_height_index('tx', txid)
 
     def is_in_verified_tx(self, txid: str) -> bool:
         assert isinstance(txid, str)
@@ -555,12 +762,14 @@ class WalletDB(JsonDB):
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (1, len(self.change_addresses))
         self.change_addresses.append(addr)
+        self.data['addresses'].touch('change')
 
     @modifier
     def add_receiving_address(self, addr: str) -> None:
         assert isinstance(addr, str)
         self._addr_to_addr_index[addr] = (0, len(self.receiving_addresses))
         self.receiving_addresses.append(addr)
+        self.data['addresses'].touch('receiving')
 
     @locked
     def get_address_index(self, address: str) -> Optional[Sequence[int]]:
@@ -673,10 +882,12 @@ class WalletDB(JsonDB):
     @modifier
     def remove_broadcast_to_watch(self, asset):
         self.broadcasts_to_watch.discard(asset)
+        self.data.touch('broadcasts_to_watch')
 
     @modifier
     def add_broadcast_to_watch(self, asset):
         self.broadcasts_to_watch.add(asset)
+        self.data.touch('broadcasts_to_watch')
 
     @locked
     def get_asset_blacklist_regex_list(self) -> Sequence[str]:
@@ -686,10 +897,12 @@ class WalletDB(JsonDB):
     def update_asset_blacklist_regex_list(self, l):
         self.asset_blacklist.clear()
         self.asset_blacklist.update(l)
+        self.data.touch('asset_blacklist')
 
     @modifier
     def add_asset_blacklist_regex(self, r):
         self.asset_blacklist.add(r)
+        self.data.touch('asset_blacklist')
 
     @locked
     def is_non_deterministic_txo_lockingscript(self, outpoint: TxOutpoint) -> bool:
@@ -700,11 +913,13 @@ class WalletDB(JsonDB):
     def add_non_deterministic_txo_lockingscript(self, outpoint: TxOutpoint):
         assert isinstance(outpoint, TxOutpoint)
         self.non_deterministic_vouts.add(outpoint.to_str())
+        self.data.touch('non_deterministic_txo_scriptpubkey')
 
     @modifier
     def remove_non_deterministic_txo_lockingscript(self, outpoint: TxOutpoint):
         assert isinstance(outpoint, TxOutpoint)
         self.non_deterministic_vouts.discard(outpoint.to_str())
+        self.data.touch('non_deterministic_txo_scriptpubkey')
 
     @locked
     def get_assets_to_watch(self) -> Sequence[str]:
@@ -720,6 +935,7 @@ class WalletDB(JsonDB):
         assert isinstance(asset, str)
         assert (error := get_error_for_asset_name(asset) is None), error
         self.assets_to_watch.add(asset)
+        self.data.touch('assets_to_watch')
 
     @modifier
     def add_verified_asset_metadata(self, asset: str, metadata: StrictAssetMetadata, source_tup: Tuple[TxOutpoint, int], source_divisions_tup: Optional[Tuple[TxOutpoint, int]], source_associated_data_tup: Optional[Tuple[TxOutpoint, int]]):
@@ -741,6 +957,7 @@ class WalletDB(JsonDB):
             assert isinstance(source_associated_data_tup[1], int)
 
         self.verified_asset_metadata[asset] = metadata, source_tup, source_divisions_tup, source_associated_data_tup
+        self._add_to_height_index('asset', asset, source_tup[1])
 
     @locked
     def get_verified_asset_metadata(self, asset: str) -> Optional[StrictAssetMetadata]:
@@ -770,15 +987,12 @@ class WalletDB(JsonDB):
     @locked
     def get_assets_verified_after_height(self, height: int) -> Sequence[str]:
         assert isinstance(height, int)
-        assets = []
-        for asset, (_, (_, verified_height), _, _) in self.verified_asset_metadata.items():
-            if verified_height > height:
-                assets.append(asset)
-        return assets
+        return self._get_height_index('asset').keys_above(height)
 
     @modifier
     def remove_verified_asset_metadata(self, asset: str):
         assert isinstance(asset, str)
+        self._remove_from_height_index('asset', asset)
         return self.verified_asset_metadata.pop(asset, None)
 
     @locked
@@ -790,6 +1004,7 @@ class WalletDB(JsonDB):
     def remove_verified_restricted_verifier(self, asset: str):
         assert isinstance(asset, str)
         self.verified_restricted_verifiers.pop(asset)
+        self._remove_from_height_index('verifier', asset)
 
     @modifier
     def add_verified_restricted_verifier(self, asset: str, d):
@@ -800,15 +1015,12 @@ class WalletDB(JsonDB):
         assert isinstance(d['height'], int)
         assert isinstance(d['string'], str)
         self.verified_restricted_verifiers[asset] = d
+        self._add_to_height_index('verifier', asset, d['height'])
 
     @locked
     def get_verified_restricted_verifier_after_height(self, height: int) -> Set[str]:
         assert isinstance(height, int)
-        s = set()
-        for asset, d in self.verified_restricted_verifiers.items():
-            if d['height'] > height:
-                s.add(asset)
-        return s
+        return set(self._get_height_index('verifier').keys_above(height))
 
     @locked
     def get_verified_restricted_freeze(self, asset: str) -> Optional[Dict[str, Any]]:
@@ -819,6 +1031,7 @@ class WalletDB(JsonDB):
     def remove_verified_restricted_freeze(self, asset: str):
         assert isinstance(asset, str)
         self.verified_restricted_freezes.pop(asset)
+        self._remove_from_height_index('freeze', asset)
 
     @modifier
     def add_verified_restricted_freeze(self, asset: str, d):
@@ -828,15 +1041,12 @@ class WalletDB(JsonDB):
         assert isinstance(d['height'], int)
         assert isinstance(d['frozen'], bool)
         self.verified_restricted_freezes[asset] = d
+        self._add_to_height_index('freeze', asset, d['height'])
 
     @locked
     def get_verified_restricted_freezes_after_height(self, height: int) -> Set[str]:
         assert isinstance(height, int)
-        s = set()
-        for asset, d in self.verified_restricted_freezes.items():
-            if d['height'] > height:
-                s.add(asset)
-        return s
+        return set(self._get_height_index('freeze').keys_above(height))
 
     @locked
     def get_verified_broadcasts(self, asset: str) -> Dict[str, Dict[str, Any]]:
@@ -854,6 +1064,7 @@ class WalletDB(JsonDB):
         assert isinstance(asset, str)
         assert isinstance(tx_hash, str)
         self.verified_broadcasts.get(asset, dict()).pop(tx_hash, None)
+        self._remove_from_height_index('broadcast', (asset, tx_hash))
 
     @modifier
     def add_verified_broadcast(self, asset: str, tx_hash: str, d):
@@ -868,17 +1079,16 @@ class WalletDB(JsonDB):
         if asset not in self.verified_broadcasts:
             self.verified_broadcasts[asset] = dict()
         self.verified_broadcasts[asset][tx_hash] = d
+        self._add_to_height_index('broadcast', (asset, tx_hash), d['height'])
 
     @locked
     def get_verified_broadcasts_after_height(self, height: int) -> Dict[str, Set[str]]:
         assert isinstance(height, int)
         d = dict()
-        for asset, d1 in self.verified_broadcasts.items():
-            for tx_hash, d2 in d1.items():
-                if d2['height'] > height:
-                    if asset not in d:
-                        d[asset] = set()
-                    d[asset].add(tx_hash)
+        for asset, tx_hash in self._get_height_index('broadcast').keys_above(height):
+            if asset not in d:
+                d[asset] = set()
+            d[asset].add(tx_hash)
         return d
 
     @locked
@@ -891,6 +1101,7 @@ class WalletDB(JsonDB):
         assert isinstance(asset, str)
         assert isinstance(res, str)
         self.verified_associations.get(asset, dict()).pop(res, None)
+        self._remove_from_height_index('association', (asset, res))
 
     @modifier
     def add_verified_association(self, asset: str, res: str, d):
@@ -904,15 +1115,14 @@ class WalletDB(JsonDB):
         if self.verified_associations.get(asset) is None:
             self.verified_associations[asset] = dict()
         self.verified_associations[asset][res] = d
+        self._add_to_height_index('association', (asset, res), d['height'])
 
     @locked
     def get_verified_associations_after_height(self, height: int) -> Dict[str, Set[str]]:
         assert isinstance(height, int)
         d = defaultdict(set)
-        for asset, res_dict in self.verified_associations.items():
-            for res, d1 in res_dict.items():
-                if d1['height'] > height:
-                    d[asset].add(res)
+        for asset, res in self._get_height_index('association').keys_above(height):
+            d[asset].add(res)
         return d
 
     @locked
@@ -938,6 +1148,7 @@ class WalletDB(JsonDB):
         assert isinstance(asset, str)
         assert isinstance(h160, str)
         self.verified_tags_for_qualifiers.get(asset, dict()).pop(h160, None)
+        self._remove_from_height_index('qualifier_tag', (asset, h160))
         # Do not pop off top level key
 
     @modifier
@@ -951,15 +1162,14 @@ class WalletDB(JsonDB):
         if self.verified_tags_for_qualifiers.get(asset) is None:
             self.verified_tags_for_qualifiers[asset] = dict()
         self.verified_tags_for_qualifiers[asset][h160] = d
+        self._add_to_height_index('qualifier_tag', (asset, h160), d['height'])
 
     @locked
     def get_verified_qualifier_tags_after_height(self, height: int) -> Dict[str, Set[str]]:
         assert isinstance(height, int)
         d = defaultdict(set)
-        for asset, h160_dict in self.verified_tags_for_qualifiers.items():
-            for h160, d1 in h160_dict.items():
-                if d1['height'] > height:
-                    d[asset].add(h160)
+        for asset, h160 in self._get_height_index('qualifier_tag').keys_above(height):
+            d[asset].add(h160)
         return d
 
     @locked
@@ -983,6 +1193,7 @@ class WalletDB(JsonDB):
         assert isinstance(asset, str)
         assert isinstance(h160, str)
         self.verified_tags_for_h160s.get(h160, dict()).pop(asset, None)
+        self._remove_from_height_index('h160_tag', (h160, asset))
         # Do not pop off top level key
 
     @modifier
@@ -996,26 +1207,29 @@ class WalletDB(JsonDB):
         if self.verified_tags_for_h160s.get(h160) is None:
             self.verified_tags_for_h160s[h160] = dict()
         self.verified_tags_for_h160s[h160][asset] = d
+        self._add_to_height_index('h160_tag', (h160, asset), d['height'])
 
     @locked
     def get_verified_h160_tags_after_height(self, height: int) -> Dict[str, Set[str]]:
         assert isinstance(height, int)
         d = defaultdict(set)
-        for h160, asset_dict in self.verified_tags_for_h160s.items():
-            for asset, d1 in asset_dict.items():
-                if d1['height'] > height:
-                    d[h160].add(asset)
+        for h160, asset in self._get_height_index('h160_tag').keys_above(height):
+            d[h160].add(asset)
         return d
 
     @profiler
     def _load_transactions(self):
         self.data = StoredDict(self.data, self, [])
+        if self.get(self.SQL_TABLES_KEY) and self.storage:
+            self._attach_sql_store(WalletSqlStore(self._get_sql_path(), SQL_TABLES))
         # references in self.data
         # TODO make all these private
         # txid -> address -> prev_outpoint -> value
         self.txi = self.get_dict('txi')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, Optional[str]]]]]
         # txid -> address -> output_index -> (value, is_coinbase)
         self.txo = self.get_dict('txo')                          # type: Dict[str, Dict[str, Dict[str, Tuple[int, Optional[str], bool]]]]
+        # txid -> output_index -> compact asset vout info, for asset outputs only
+        self.txo_asset_info = self.get_dict('txo_asset_info')    # type: Dict[str, Dict[str, list]]
         self.transactions = self.get_dict('transactions')        # type: Dict[str, Transaction]
         self.spent_outpoints = self.get_dict('spent_outpoints')  # txid -> output_index -> next_txid
         self.history = self.get_dict('addr_history')             # address -> list of (txid, height)
@@ -1023,6 +1237,12 @@ class WalletDB(JsonDB):
         self.tx_fees = self.get_dict('tx_fees')                  # type: Dict[str, TxFeesValue]
         # scripthash -> set of (outpoint, value)
         self._prevouts_by_scripthash = self.get_dict('prevouts_by_scripthash')  # type: Dict[str, Set[Tuple[str, int]]]
+        if self.is_sql_backed():
+            # avoid decoding every row at startup
+            n = self._sql_store.remove_unreferenced_transactions()
+            if n:
+                self.logger.info(f"removed {n} unreferenced txs")
+            return
         # remove unreferenced tx
         for tx_hash in list(self.transactions.keys()):
             if not self.get_txi_addresses(tx_hash) and not self.get_txo_addresses(tx_hash):
@@ -1038,15 +1258,65 @@ class WalletDB(JsonDB):
 
     @modifier
     def clear_history(self):
+        self.tx_cache.clear()
         self.txi.clear()
         self.txo.clear()
+        self.txo_asset_info.clear()
         self.spent_outpoints.clear()
         self.transactions.clear()
         self.history.clear()
         self.verified_tx.clear()
+        if self._height_indexes is not None:
+            self._height_indexes['tx'].clear()
         self.tx_fees.clear()
         self._prevouts_by_scripthash.clear()
 
+    def _get_sql_path(self) -> str:
+        return self.storage.path + '.sqlite'
+
+    def is_sql_backed(self) -> bool:
+        return self._sql_store is not None
+
+    def _rebind_sql_tables(self):
+        for name, attr_name in SQL_TABLES.items():
+            if attr_name in self.__dict__:
+                setattr(self, attr_name, self.get_dict(name))
+
+    @locked
+    def migrate_to_sql(self) -> None:
+        """Moves the history and asset collections into an sqlite file,
+        from which rows are loaded on demand. Can be called on an open wallet.
+        The wallet file only references the sqlite file after the next write.
+        """
+        assert self.storage and not self.storage.is_encrypted()
+        assert not self.is_sql_backed()
+        store = WalletSqlStore(self._get_sql_path(), SQL_TABLES)
+        for name in SQL_TABLES:
+            d = self.data.get(name) or {}
+            store.replace_table(name, (
+                (json_db._json_key(k), json.dumps(v, cls=json_db.JsonDBJsonEncoder)) for k, v in d.items()))
+        store.commit()
+        self._attach_sql_store(store)
+        self._rebind_sql_tables()
+        self.set_modified(True)
+        self.logger.info(f"migrated history to {store.path}")
+
+    @locked
+    def migrate_from_sql(self) -> None:
+        """Moves the collections back into the wallet file, which is
+        written right away, and deletes the sqlite file.
+        """
+        assert self.is_sql_backed()
+        store = self._detach_sql_store()
+        self._rebind_sql_tables()
+        self.write()
+        if self.modified():
+            # the write was refused; keep the sqlite file around
+            self.logger.warning(f"could not write wallet file, not removing {store.path}")
+            store.close()
+            return
+        store.delete_file()
+
     def _should_convert_to_stored_dict(self, key) -> bool:
         if key == 'keystore':
             return False
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2024 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import json
+import sqlite3
+from typing import Iterable, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from .json_db import (StoredDict, StoredObject, JsonDBJsonEncoder, locked,
+                      _RaiseKeyError, _json_key, _apply_patches)
+from .logging import Logger
+from .util import test_read_write_permissions
+
+if TYPE_CHECKING:
+    from .json_db import JsonDB
+
+
+class WalletSqlStore(Logger):
+    """Key-value tables in an sqlite file, holding the large collections
+    of a JsonDB, one row per top-level key, the value json-encoded.
+
+    Unlike SqlDB, calls are synchronous: WalletDB is accessed from both
+    the asyncio thread and the GUI thread, always holding the db lock.
+    Changes become durable on commit().
+    """
+
+    def __init__(self, path: str, tables: Sequence[str]):
+        Logger.__init__(self)
+        self.path = path
+        self.tables = list(tables)
+        test_read_write_permissions(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.create_database()
+
+    def create_database(self):
+        for table in self.tables:
+            self.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table}" '
+                f'(key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+        self.conn.commit()
+
+    def get(self, table: str, key: str) -> Optional[str]:
+        r = self.conn.execute(f'SELECT value FROM "{table}" WHERE key=?', (key,)).fetchone()
+        return r[0] if r else None
+
+    def has(self, table: str, key: str) -> bool:
+        r = self.conn.execute(f'SELECT 1 FROM "{table}" WHERE key=?', (key,)).fetchone()
+        return r is not None
+
+    def keys(self, table: str) -> List[str]:
+        return [r[0] for r in self.conn.execute(f'SELECT key FROM "{table}"')]
+
+    def items(self, table: str) -> List[Tuple[str, str]]:
+        return self.conn.execute(f'SELECT key, value FROM "{table}"').fetchall()
+
+    def count(self, table: str) -> int:
+        return self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    def put(self, table: str, key: str, value: str) -> None:
+        self.conn.execute(f'INSERT OR REPLACE INTO "{table}" (key, value) VALUES (?, ?)', (key, value))
+
+    def delete(self, table: str, key: str) -> None:
+        self.conn.execute(f'DELETE FROM "{table}" WHERE key=?', (key,))
+
+    def clear(self, table: str) -> None:
+        self.conn.execute(f'DELETE FROM "{table}"')
+
+    def replace_table(self, table: str, rows: Iterable[Tuple[str, str]]) -> None:
+        self.clear(table)
+        self.conn.executemany(f'INSERT INTO "{table}" (key, value) VALUES (?, ?)', rows)
+
+    def remove_unreferenced_transactions(self) -> int:
+        """Deletes transactions that no longer appear in txi or txo."""
+        c = self.conn.execute(
+            'DELETE FROM "transactions" WHERE '
+            'key NOT IN (SELECT key FROM "txi" WHERE value != \'{}\') AND '
+            'key NOT IN (SELECT key FROM "txo" WHERE value != \'{}\')')
+        return c.rowcount
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def delete_file(self) -> None:
+        self.close()
+        os.remove(self.path)
+        self.logger.info(f"removed {self.path}")
+
+
+class SqlDict(StoredDict):
+    """A StoredDict whose items are rows of a WalletSqlStore table.
+
+    Rows are decoded on first access and cached until the next commit,
+    after which the cache is trimmed. Changes are written through to the
+    table as they are journaled by JsonDB, and committed by JsonDB.write.
+    """
+
+    MAX_CACHED_ROWS = 2000
+
+    def __init__(self, name: str, store: WalletSqlStore, db: 'JsonDB'):
+        StoredDict.__init__(self, {}, db, [name])
+        self.name = name
+        self.store = store
+
+    def _decode_row(self, key: str, raw: str):
+        v = json.loads(raw)
+        v = self.db._convert_dict([], self.name, {key: v})[key]
+        if isinstance(v, dict):
+            v = self.db._convert_dict(self.path, key, v)
+            if self.db._should_convert_to_stored_dict(key):
+                v = StoredDict(v, self.db, self.path + [key])
+        if isinstance(v, (dict, str, int, list)):
+            v = self.db._convert_value(self.path, key, v)
+        if isinstance(v, StoredObject):
+            v.set_db(self.db)
+        dict.__setitem__(self, key, v)
+        return v
+
+    def _load(self, key) -> bool:
+        if dict.__contains__(self, key):
+            return True
+        raw = self.store.get(self.name, _json_key(key))
+        if raw is None:
+            return False
+        self._decode_row(key, raw)
+        return True
+
+    @locked
+    def __getitem__(self, key):
+        if not self._load(key):
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    @locked
+    def get(self, key, default=None):
+        if not self._load(key):
+            return default
+        return dict.__getitem__(self, key)
+
+    @locked
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or self.store.has(self.name, _json_key(key))
+
+    @locked
+    def __delitem__(self, key):
+        self._load(key)
+        StoredDict.__delitem__(self, key)
+
+    @locked
+    def pop(self, key, v=_RaiseKeyError):
+        self._load(key)
+        return StoredDict.pop(self, key, v)
+
+    @locked
+    def __len__(self):
+        return self.store.count(self.name)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    @locked
+    def keys(self):
+        return self.store.keys(self.name)
+
+    @locked
+    def items(self):
+        return [(key, dict.__getitem__(self, key) if dict.__contains__(self, key) else self._decode_row(key, raw))
+                for key, raw in self.store.items(self.name)]
+
+    @locked
+    def values(self):
+        return [v for k, v in self.items()]
+
+    def write_through(self, op: str, path: list, value) -> None:
+        """Applies a change journaled under this table; 'path' is relative to it."""
+        if not path:
+            if op == 'd':
+                self.store.clear(self.name)
+                return
+            self.store.replace_table(self.name, (
+                (_json_key(k), json.dumps(v, cls=JsonDBJsonEncoder)) for k, v in value.items()))
+            return
+        key = _json_key(path[0])
+        if len(path) == 1:
+            if op == 's':
+                self.store.put(self.name, key, json.dumps(value, cls=JsonDBJsonEncoder))
+            else:
+                self.store.delete(self.name, key)
+        elif dict.__contains__(self, path[0]):
+            row = dict.__getitem__(self, path[0])
+            self.store.put(self.name, key, json.dumps(row, cls=JsonDBJsonEncoder))
+        else:
+            # the row was trimmed from the cache while the caller held on
+            # to part of it: patch the stored row instead
+            row = json.loads(self.store.get(self.name, key))
+            if op == 's':
+                value = json.loads(json.dumps(value, cls=JsonDBJsonEncoder))
+                patch = [op, [_json_key(k) for k in path[1:]], value]
+            else:
+                patch = [op, [_json_key(k) for k in path[1:]]]
+            _apply_patches(row, [patch])
+            self.store.put(self.name, key, json.dumps(row))
+
+    def trim(self) -> None:
+        excess = dict.__len__(self) - self.MAX_CACHED_ROWS
+        if excess > 0:
+            for key in list(dict.keys(self))[:excess]:
+                dict.__delitem__(self, key)
+
+    @locked
+    def load_all_raw(self) -> dict:
+        return {key: json.loads(raw) for key, raw in self.store.items(self.name)}